@@ -0,0 +1,94 @@
+'''Concurrent bring-up of the station's peer connections
+
+Each peer (MAVLink, video, haptics) is started by its own thread so a missing peer
+no longer blocks the others or the GUI. Tasks are plain functions that do their own
+bounded waiting and raise TimeoutError (or any other exception) when they give up.
+'''
+
+import threading
+import time
+
+
+class Bringup():
+    """Runs connection tasks concurrently and tracks their readiness
+
+    Status of a task is one of 'pending', 'ready', 'timeout' or 'failed'.
+
+    Attributes:
+        startTime (float): perf_counter when the bring-up object was created
+        tasks (dict): Task name -> state dict (status, elapsed, result, error, ...)
+    """
+
+    def __init__(self):
+        self.startTime = time.perf_counter()
+        self.tasks = {}
+        self.lock = threading.Lock()
+        self._reported = {}
+
+    def start(self, name, function, *args):
+        """Start (or restart) a task in a background thread
+
+        Args:
+            name (str): Task name, e.g. 'mavlink'
+            function (callable): Blocking connect function, its return value is the task result
+            *args: Arguments for function
+        """
+        with self.lock:
+            self.tasks[name] = {'status': 'pending', 'started': time.perf_counter(), 'elapsed': 0.0,
+                                'result': None, 'error': None, 'function': function, 'args': args}
+        thread = threading.Thread(target=self._run, args=(name, function, args), name=f'bringup-{name}')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, name, function, args):
+        started = self.tasks[name]['started']
+        try:
+            result = function(*args)
+            status, error = 'ready', None
+        except TimeoutError as e:
+            result, status, error = None, 'timeout', str(e)
+        except Exception as e:
+            result, status, error = None, 'failed', f'{type(e).__name__}: {e}'
+        with self.lock:
+            task = self.tasks[name]
+            task.update(status=status, result=result, error=error, elapsed=time.perf_counter() - started)
+
+    def retry(self):
+        """Restart every task that timed out or failed"""
+        for name, task in list(self.tasks.items()):
+            if task['status'] in ('timeout', 'failed'):
+                self.start(name, task['function'], *task['args'])
+
+    def status(self, name):
+        return self.tasks[name]['status'] if name in self.tasks else None
+
+    def ready(self, name):
+        return self.status(name) == 'ready'
+
+    def result(self, name):
+        return self.tasks[name]['result']
+
+    def changes(self):
+        """Tasks whose status changed since the last call
+
+        Returns:
+            list: (name, status, elapsed, error) tuples
+        """
+        changed = []
+        with self.lock:
+            for name, task in self.tasks.items():
+                key = (task['status'], task['started'])
+                if self._reported.get(name) != key:
+                    self._reported[name] = key
+                    changed.append((name, task['status'], task['elapsed'], task['error']))
+        return changed
+
+    def summary(self):
+        """One line readiness summary, e.g. 'mavlink ready 0.8s | video pending | haptics timeout'"""
+        parts = []
+        now = time.perf_counter()
+        with self.lock:
+            for name, task in self.tasks.items():
+                elapsed = task['elapsed'] if task['status'] != 'pending' else now - task['started']
+                parts.append(f"{name} {task['status']} {elapsed:0.1f}s")
+        return ' | '.join(parts)
@@ -0,0 +1,179 @@
+'''Local publish/subscribe output of live station state
+
+The station publishes the fused pose, selected MAVLink telemetry, the haptics state and
+trial events as small binary datagrams to any number of local UDP or Unix datagram
+sockets. Publishing never blocks: sockets are non-blocking, a full or missing receiver
+just loses the packet, and each topic is rate limited before anything is encoded. A
+plotter, second display or recorder can then listen without touching the station loop.
+
+    python bus.py udp:127.0.0.1:14600          print what the station publishes
+    python bus.py unix:/tmp/rovstation.sock
+
+Packet: header '<2sBBId' (b'RB', version, topic id, sequence, unix time) + topic body.
+'''
+
+import argparse
+import json
+import os
+import socket
+import struct
+import time
+
+MAGIC = b'RB'
+VERSION = 1
+HEADER = struct.Struct('<2sBBId')
+
+# topic -> (id, body struct, field names); 'event' bodies are UTF-8 JSON
+TOPICS = {
+    'pose': (1, struct.Struct('<10fH'),
+             ('x', 'y', 'z', 'roll', 'pitch', 'yaw', 'targetDist', 'tvec0', 'tvec1', 'tvec2', 'poseAge')),
+    'mavlink': (2, struct.Struct('<9fh'),
+                ('xacc', 'yacc', 'zacc', 'xgyro', 'ygyro', 'zgyro', 'heading', 'groundspeed', 'depth', 'battery')),
+    'haptics': (3, struct.Struct('<2f2h2HB'),
+                ('fingerPos', 'fingerForce', 'vibration', 'hardness', 'speed', 'turn', 'touchControl')),
+    'event': (4, None, None),
+}
+TOPIC_NAMES = {topicId: name for name, (topicId, body, fields) in TOPICS.items()}
+
+
+def parse_target(target):
+    """'udp:host:port' or 'unix:/path' -> (family, address)"""
+    kind, _, address = target.partition(':')
+    if kind == 'udp':
+        host, _, port = address.rpartition(':')
+        return socket.AF_INET, (host, int(port))
+    if kind == 'unix':
+        return socket.AF_UNIX, address
+    raise ValueError(f'unknown bus target {target}, expected udp:host:port or unix:/path')
+
+
+class TelemetryBus():
+    """Non-blocking, rate-limited fan-out of station state
+
+    Attributes:
+        targets (list): (socket, address) pairs packets are sent to
+        rates (dict): Topic -> most packets per second, 0 for unlimited
+        sent (int): Packets sent
+        dropped (int): Packets lost to full or absent receivers
+        limited (int): Publishes skipped by the rate limits
+    """
+
+    DEFAULT_RATES = {'pose': 20, 'mavlink': 10, 'haptics': 50, 'event': 0}
+
+    def __init__(self, targets, rates=None):
+        """Summary
+
+        Args:
+            targets (list): Target strings, see parse_target()
+            rates (dict, optional): Per topic rate limits overriding DEFAULT_RATES
+        """
+        self.targets = []
+        for target in targets:
+            family, address = parse_target(target)
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            self.targets.append((sock, address))
+        self.rates = dict(self.DEFAULT_RATES)
+        self.rates.update(rates or {})
+        self.lastSent = {}
+        self.seq = 0
+        self.sent = 0
+        self.dropped = 0
+        self.limited = 0
+
+    def due(self, topic, now=None):
+        """True if topic may be published now, check before gathering the values"""
+        rate = self.rates.get(topic, 0)
+        if rate <= 0:
+            return True
+        now = time.perf_counter() if now is None else now
+        if now - self.lastSent.get(topic, -1e9) < 1.0 / rate:
+            self.limited += 1
+            return False
+        self.lastSent[topic] = now
+        return True
+
+    def publish(self, topic, *values):
+        """Send one topic sample, values in the order of its fields"""
+        topicId, body, fields = TOPICS[topic]
+        self._send(topicId, body.pack(*values))
+
+    def publish_event(self, name, data):
+        if self.targets:
+            self._send(TOPICS['event'][0], json.dumps({'name': name, 'data': data}, default=str).encode())
+
+    def _send(self, topicId, payload):
+        self.seq = (self.seq + 1) & 0xFFFFFFFF
+        packet = HEADER.pack(MAGIC, VERSION, topicId, self.seq, time.time()) + payload
+        for sock, address in self.targets:
+            try:
+                sock.sendto(packet, address)
+                self.sent += 1
+            except OSError:
+                # full buffer, nobody listening (yet) or receiver gone: never wait for it
+                self.dropped += 1
+
+    def close(self):
+        for sock, address in self.targets:
+            sock.close()
+
+
+def decode(packet):
+    """Decode a bus packet
+
+    Returns:
+        tuple: (topic, sequence, unix time, dict of values)
+    """
+    magic, version, topicId, seq, stamp = HEADER.unpack_from(packet)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('not a station bus packet')
+    topic = TOPIC_NAMES[topicId]
+    topicId, body, fields = TOPICS[topic]
+    payload = packet[HEADER.size:]
+    if body is None:
+        return topic, seq, stamp, json.loads(payload.decode())
+    return topic, seq, stamp, dict(zip(fields, body.unpack(payload)))
+
+
+def parse_rates(items):
+    """['pose=10', 'haptics=0'] -> {'pose': 10.0, 'haptics': 0.0}"""
+    rates = {}
+    for item in items or []:
+        topic, _, rate = item.partition('=')
+        if topic not in TOPICS:
+            raise ValueError(f'unknown bus topic {topic}')
+        rates[topic] = float(rate)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print what the station publishes on its telemetry bus')
+    parser.add_argument('target', help='udp:host:port or unix:/path to listen on')
+    parser.add_argument('--topic', action='append', default=None, help='only show these topics')
+    args = parser.parse_args()
+
+    family, address = parse_target(args.target)
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    if family == socket.AF_UNIX and os.path.exists(address):
+        os.unlink(address)
+    sock.bind(address)
+    lastSeq = None
+    try:
+        while True:
+            packet = sock.recv(65536)
+            topic, seq, stamp, values = decode(packet)
+            if lastSeq is not None and seq != (lastSeq + 1) & 0xFFFFFFFF:
+                print(f"-- {(seq - lastSeq - 1) & 0xFFFFFFFF} packets not received")
+            lastSeq = seq
+            if args.topic is None or topic in args.topic:
+                print(f"{stamp:.3f} {topic} {values}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
+        if family == socket.AF_UNIX:
+            os.unlink(address)
+
+
+if __name__ == '__main__':
+    main()
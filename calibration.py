@@ -0,0 +1,122 @@
+'''Camera calibration context, built once per resolution and reused for every frame
+
+The raw calibration (calibration_matrix.npy, distortion_coefficients.npy) used to be
+passed into every detection call, which then rebuilt the ArUco dictionary, the detector
+parameters and the marker's 3D corner points each frame. CalibrationContext derives all
+of that once: camera matrix scaled to the stream resolution, detector objects, marker
+object points per tag size and the initUndistortRectifyMap tables for an undistorted
+display.
+'''
+
+import time
+
+import cv2
+import numpy as np
+
+from vision import detector_parameters
+
+
+class CalibrationContext():
+    """Everything derived from the camera calibration for one frame size
+
+    Attributes:
+        size (tuple): Frame (width, height) the context is for
+        k (np.ndarray): Camera matrix for this size
+        d (np.ndarray): Distortion coefficients
+        dictionary (object): ArUco dictionary
+        parameters (object): ArUco detector parameters, the tuned profile if there is one
+        tagSize (float): Tag size the object points are for, m
+        objectPoints (np.ndarray): 3D corners of a tagSize marker, in detectMarkers corner order
+        setupCost (float): Measured time of the per-frame setup the context avoids, s
+        frames (int): Frames that used the context
+    """
+
+    _contexts = {}
+
+    def __init__(self, k, d, size, aruco_dict_type, tagSize=1.12, calibratedSize=(1280, 720)):
+        """Summary
+
+        Args:
+            k (np.ndarray): Camera matrix at calibratedSize
+            d (np.ndarray): Distortion coefficients
+            size (tuple): Frame (width, height) to build for
+            aruco_dict_type (int): ArUco dictionary
+            tagSize (float, optional): Tag size in m
+            calibratedSize (tuple, optional): Frame (width, height) the calibration was made at
+        """
+        self.size = tuple(size)
+        self.aruco_dict_type = aruco_dict_type
+        sx = size[0] / calibratedSize[0]
+        sy = size[1] / calibratedSize[1]
+        self.k = np.array(k, dtype=np.float64) * [[sx], [sy], [1]]
+        self.d = np.array(d, dtype=np.float64)
+        self.dictionary = cv2.aruco.Dictionary_get(aruco_dict_type)
+        self.parameters = detector_parameters()
+        self.tagSize = None
+        self.objectPoints = None
+        self.set_tag_size(tagSize)
+        self.maps = None
+        self.undistortedK = None
+        self.frames = 0
+        self.setupCost = self.measure_setup()
+
+    @classmethod
+    def get(cls, shape, k, d, aruco_dict_type, tagSize=1.12):
+        """Shared context for a frame shape, built on first use
+
+        Args:
+            shape (tuple): Frame shape (height, width[, channels])
+        """
+        key = (shape[1], shape[0], aruco_dict_type)
+        context = cls._contexts.get(key)
+        if context is None:
+            context = cls._contexts[key] = cls(k, d, (shape[1], shape[0]), aruco_dict_type, tagSize)
+            print(f"calibration: context for {shape[1]}x{shape[0]}, "
+                  f"saves {context.setupCost * 1000:0.2f}ms of setup per frame")
+        context.set_tag_size(tagSize)
+        return context
+
+    def set_tag_size(self, tagSize):
+        """Rebuild the object points if the tag size changed"""
+        if tagSize == self.tagSize:
+            return
+        self.tagSize = tagSize
+        half = tagSize / 2
+        # same corner order and frame as estimatePoseSingleMarkers
+        self.objectPoints = np.array([[-half, half, 0], [half, half, 0],
+                                      [half, -half, 0], [-half, -half, 0]], dtype=np.float32)
+
+    def pose(self, corners):
+        """Pose of one marker from its image corners
+
+        Returns:
+            tuple: rvec, tvec shaped 1x1x3 like estimatePoseSingleMarkers
+        """
+        # the solver estimatePoseSingleMarkers uses, so poses are unchanged
+        ok, rvec, tvec = cv2.solvePnP(self.objectPoints, corners.reshape(4, 2), self.k, self.d,
+                                      flags=cv2.SOLVEPNP_ITERATIVE)
+        return rvec.reshape(1, 1, 3), tvec.reshape(1, 1, 3)
+
+    def undistort(self, frame):
+        """Undistorted copy of frame, using lookup tables built on first use"""
+        if self.maps is None:
+            self.undistortedK, roi = cv2.getOptimalNewCameraMatrix(self.k, self.d, self.size, 0)
+            self.maps = cv2.initUndistortRectifyMap(self.k, self.d, None, self.undistortedK,
+                                                    self.size, cv2.CV_16SC2)
+        return cv2.remap(frame, self.maps[0], self.maps[1], cv2.INTER_LINEAR)
+
+    def measure_setup(self, repeats=20):
+        """Time the work detection without a context still repeats on every frame
+
+        The detector parameters are not counted, that path uses the cached vision.detector_parameters() too.
+        """
+        started = time.perf_counter()
+        for _ in range(repeats):
+            cv2.aruco.Dictionary_get(self.aruco_dict_type)
+            half = self.tagSize / 2
+            np.array([[-half, half, 0], [half, half, 0], [half, -half, 0], [-half, -half, 0]], dtype=np.float32)
+        return (time.perf_counter() - started) / repeats
+
+    def saved(self):
+        """Total setup time avoided so far, s"""
+        return self.setupCost * self.frames
@@ -0,0 +1,297 @@
+'''ChArUco camera calibration producing calibration_matrix.npy and distortion_coefficients.npy
+
+Film a printed ChArUco board from many distances and angles (or let this tool capture
+the ROV camera stream), then:
+
+    read + detect   the video is split into chunks, each worker process opens the file
+                    itself, skips frames that barely differ from the last one it looked
+                    at and detects ChArUco corners in the rest, so no frames cross
+                    process boundaries
+    select          greedy pick of the views that cover the image area and the range of
+                    board sizes best, calibration cost grows with every view
+    calibrate       cv2.aruco.calibrateCameraCharucoExtended, views with an outlying
+                    reprojection error are dropped and the calibration rerun once
+    write           the camera matrix (3x3) and distortion coefficients (1x5) as the
+                    station loads them, at the 1280x720 the station assumes
+
+    python charuco.py board.avi
+    python charuco.py --capture 60 --port 5600
+    python charuco.py --print-board board.png
+'''
+
+import argparse
+import heapq
+import multiprocessing
+import os
+import time
+
+import cv2
+import numpy as np
+
+from utils import ARUCO_DICT
+
+CALIBRATED_SIZE = (1280, 720)
+
+
+def make_board(spec):
+    """CharucoBoard and dictionary from (squaresX, squaresY, squareLength, markerLength, dictionary name)"""
+    squaresX, squaresY, squareLength, markerLength, dictionaryName = spec
+    dictionary = cv2.aruco.Dictionary_get(ARUCO_DICT[dictionaryName])
+    board = cv2.aruco.CharucoBoard_create(squaresX, squaresY, squareLength, markerLength, dictionary)
+    return board, dictionary
+
+
+def detectChunk(job):
+    """Pool worker: detect ChArUco corners in frames [start, stop) of a video
+
+    Args:
+        job (tuple): (filename, start, stop, step, board spec, minCorners, minMotion)
+
+    Returns:
+        tuple: (detections, frames read, frames skipped as duplicates, s spent), detections are
+            (frame index, charuco corners, charuco ids)
+    """
+    filename, start, stop, step, spec, minCorners, minMotion = job
+    started = time.perf_counter()
+    # one process per core already, OpenCV's own threads would only compete
+    cv2.setNumThreads(1)
+    board, dictionary = make_board(spec)
+    parameters = cv2.aruco.DetectorParameters_create()
+    capture = cv2.VideoCapture(filename)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    detections = []
+    read = skipped = 0
+    last = None
+    for index in range(start, stop):
+        # grab() without retrieve() skips decoding the frames step leaves out
+        if not capture.grab():
+            break
+        if (index - start) % step:
+            continue
+        ok, frame = capture.retrieve()
+        if not ok:
+            break
+        read += 1
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        thumb = cv2.resize(gray, (64, 36), interpolation=cv2.INTER_AREA).astype(np.int16)
+        if last is not None and np.abs(thumb - last).mean() < minMotion:
+            skipped += 1
+            continue
+        last = thumb
+        corners, ids, rejected = cv2.aruco.detectMarkers(gray, dictionary, parameters=parameters)
+        if ids is None or len(ids) < 2:
+            continue
+        count, charucoCorners, charucoIds = cv2.aruco.interpolateCornersCharuco(corners, ids, gray, board)
+        if count is not None and count >= minCorners:
+            detections.append((index, charucoCorners, charucoIds))
+    capture.release()
+    return detections, read, skipped, time.perf_counter() - started
+
+
+def detect_video(filename, spec, workers=None, step=1, minCorners=8, minMotion=2.0):
+    """Detect ChArUco corners in a whole video with a process pool
+
+    Returns:
+        tuple: (detections sorted by frame, image size (width, height), stats dict)
+    """
+    capture = cv2.VideoCapture(filename)
+    if not capture.isOpened():
+        raise IOError(f'cannot open {filename}')
+    frameCount = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+    capture.release()
+
+    workers = workers or os.cpu_count() or 1
+    # a few chunks per worker so an unlucky chunk full of detections does not hold the rest up
+    chunks = max(1, min(workers * 4, frameCount // max(step * 10, 1)))
+    bounds = np.linspace(0, frameCount, chunks + 1).astype(int)
+    jobs = [(filename, int(start), int(stop), step, spec, minCorners, minMotion)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    detections = []
+    stats = {'frames': frameCount, 'read': 0, 'skipped': 0, 'workerTime': 0.0, 'workers': workers}
+    # spawn like the rest of the station, forking a process with OpenCV state is not safe everywhere
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for chunkDetections, read, skipped, elapsed in pool.imap_unordered(detectChunk, jobs):
+            detections.extend(chunkDetections)
+            stats['read'] += read
+            stats['skipped'] += skipped
+            stats['workerTime'] += elapsed
+    detections.sort(key=lambda detection: detection[0])
+    return detections, size, stats
+
+
+def select_frames(detections, size, maxFrames=60, grid=(8, 6), perCell=3):
+    """Greedy choice of views covering the image and the range of board sizes
+
+    Each view covers the grid cells its corners fall in and one board size bin (log2 of
+    the corners' bounding box area). Views are picked while they still add coverage of
+    keys seen fewer than perCell times, most new coverage first.
+
+    Returns:
+        list: The chosen detections, in frame order
+    """
+    width, height = size
+    keys = []
+    for index, corners, ids in detections:
+        points = corners.reshape(-1, 2)
+        cells = {('cell', min(int(x * grid[0] / width), grid[0] - 1), min(int(y * grid[1] / height), grid[1] - 1))
+                 for x, y in points}
+        extent = points.max(axis=0) - points.min(axis=0)
+        area = max(extent[0] * extent[1] / (width * height), 1e-6)
+        cells.add(('size', int(np.log2(area))))
+        keys.append(cells)
+
+    def gain(i):
+        return sum(1 for key in keys[i] if covered.get(key, 0) < perCell)
+
+    # lazy greedy: a view's gain only ever shrinks, so a stale heap entry is an upper bound
+    # and only the views that reach the top get rescored. More corners break ties.
+    covered = {}
+    chosen = []
+    heap = [(-len(cells), -len(detections[i][2]), i) for i, cells in enumerate(keys)]
+    heapq.heapify(heap)
+    while heap and len(chosen) < maxFrames:
+        negGain, negCorners, i = heapq.heappop(heap)
+        current = gain(i)
+        if current == 0:
+            continue
+        if heap and current < -heap[0][0]:
+            heapq.heappush(heap, (-current, negCorners, i))
+            continue
+        chosen.append(i)
+        for key in keys[i]:
+            covered[key] = covered.get(key, 0) + 1
+    return [detections[i] for i in sorted(chosen)]
+
+
+def calibrate(detections, board, size, outlierFactor=3.0):
+    """Calibrate from the chosen views, dropping views with an outlying reprojection error once
+
+    Returns:
+        tuple: (rms reprojection error px, camera matrix, distortion coefficients, per view errors, views dropped)
+    """
+    def run(views):
+        corners = [view[1] for view in views]
+        ids = [view[2] for view in views]
+        result = cv2.aruco.calibrateCameraCharucoExtended(corners, ids, board, size, None, None)
+        rms, k, d, rvecs, tvecs, stdIntrinsics, stdExtrinsics, perViewErrors = result
+        return rms, k, d, perViewErrors.ravel()
+
+    rms, k, d, errors = run(detections)
+    limit = outlierFactor * float(np.median(errors))
+    kept = [view for view, error in zip(detections, errors) if error <= limit]
+    dropped = len(detections) - len(kept)
+    if dropped and len(kept) >= 10:
+        rms, k, d, errors = run(kept)
+    else:
+        dropped = 0
+    return rms, k, d, errors, dropped
+
+
+def write_calibration(k, d, size, directory='.'):
+    """Save k and d as calibration_matrix.npy / distortion_coefficients.npy, keeping the old files as .bak
+
+    The station scales the camera matrix from 1280x720, so a calibration made at another
+    resolution is scaled to it first.
+    """
+    k = np.array(k, dtype=np.float64) * [[CALIBRATED_SIZE[0] / size[0]], [CALIBRATED_SIZE[1] / size[1]], [1]]
+    d = np.array(d, dtype=np.float64).reshape(1, -1)[:, :5]
+    for name, value in (('calibration_matrix.npy', k), ('distortion_coefficients.npy', d)):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.replace(path, path + '.bak')
+        np.save(path, value)
+    return k, d
+
+
+def capture(port, seconds, filename, profile='default', fps=17.4):
+    """Record the camera stream to filename for seconds, to calibrate from afterwards"""
+    from video import Video
+
+    video = Video(port=port, profile=profile)
+    writer = None
+    frames = 0
+    print(f"Capturing {seconds:0.0f}s of video, move the board through the whole view at several distances")
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        if not video.frame_available():
+            time.sleep(0.005)
+            continue
+        frame = video.frame()
+        if writer is None:
+            writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), fps, (frame.shape[1], frame.shape[0]))
+        writer.write(frame)
+        frames += 1
+    video.stop()
+    if writer is None:
+        raise TimeoutError(f'no video on port {port} after {seconds}s')
+    writer.release()
+    print(f"Captured {frames} frames to {filename}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the camera from a ChArUco board video')
+    parser.add_argument('video', nargs='?', help='recorded video of the board')
+    parser.add_argument('--capture', type=float, default=0, help='record this many seconds from the camera first')
+    parser.add_argument('--port', type=int, default=5600, help='camera UDP port for --capture')
+    parser.add_argument('--squares', default='7x5', help='board squares, XxY')
+    parser.add_argument('--square-length', type=float, default=0.04, help='square side in m')
+    parser.add_argument('--marker-length', type=float, default=0.03, help='marker side in m')
+    parser.add_argument('--dictionary', default='DICT_4X4_50', choices=sorted(ARUCO_DICT))
+    parser.add_argument('--workers', type=int, default=None, help='detection processes, default one per core')
+    parser.add_argument('--step', type=int, default=1, help='only look at every step-th frame')
+    parser.add_argument('--min-corners', type=int, default=8, help='fewest ChArUco corners for a view to count')
+    parser.add_argument('--max-frames', type=int, default=60, help='most views used for the calibration')
+    parser.add_argument('--output', default='.', help='directory the .npy files are written to')
+    parser.add_argument('--print-board', default=None, help='write a printable board image to this file and exit')
+    args = parser.parse_args()
+
+    squaresX, squaresY = (int(n) for n in args.squares.lower().split('x'))
+    spec = (squaresX, squaresY, args.square_length, args.marker_length, args.dictionary)
+    board, dictionary = make_board(spec)
+    if args.print_board:
+        cv2.imwrite(args.print_board, board.draw((squaresX * 200, squaresY * 200)))
+        print(f"Wrote {args.print_board}, print it flat and measure the squares for --square-length")
+        return
+
+    times = {}
+    started = time.perf_counter()
+    filename = args.video
+    if args.capture > 0:
+        filename = filename or f"logs/calibration_{time.strftime('%Y%m%d_%H%M%S')}.avi"
+        os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+        capture(args.port, args.capture, filename)
+        times['capture'] = time.perf_counter() - started
+    if filename is None:
+        parser.error('give a video or --capture')
+
+    stage = time.perf_counter()
+    detections, size, stats = detect_video(filename, spec, args.workers, args.step, args.min_corners)
+    times['read+detect'] = time.perf_counter() - stage
+    print(f"{stats['frames']} frames, {stats['read']} decoded, {stats['skipped']} skipped as near duplicates, "
+          f"board found in {len(detections)} ({stats['workers']} workers, "
+          f"{stats['workerTime'] / max(times['read+detect'], 1e-9):0.1f}x parallel)")
+    if len(detections) < 10:
+        raise SystemExit('too few views of the board to calibrate, film it from more positions')
+
+    stage = time.perf_counter()
+    chosen = select_frames(detections, size, args.max_frames)
+    times['select'] = time.perf_counter() - stage
+
+    stage = time.perf_counter()
+    rms, k, d, errors, dropped = calibrate(chosen, board, size)
+    times['calibrate'] = time.perf_counter() - stage
+    print(f"Calibrated from {len(chosen) - dropped} of {len(detections)} views ({dropped} outliers dropped): "
+          f"reprojection error rms {rms:0.3f}px, worst view {errors.max():0.3f}px")
+
+    stage = time.perf_counter()
+    k, d = write_calibration(k, d, size, args.output)
+    times['write'] = time.perf_counter() - stage
+    print(f"Camera matrix at {CALIBRATED_SIZE[0]}x{CALIBRATED_SIZE[1]}:\n{k}\nDistortion: {d.ravel()}")
+    print(' | '.join(f"{name} {elapsed:0.2f}s" for name, elapsed in times.items()) +
+          f" | total {time.perf_counter() - started:0.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+'''Headless frontend for the ROV station
+
+Runs the station engine without Tk rendering, for soak tests, batch runs and
+cheaper hardware. Commands come from a script and/or stdin, events are printed.
+
+    python headless.py --haptics-host 127.0.0.1 --script trial.jsonl
+    python headless.py --interactive
+        start_trial participant=3 repeat=1 condition=Haptics
+        end_trial passed=true
+
+A script is one JSON object per line: {"at": 5.0, "command": "start_trial", "args": {...}}
+where "at" is seconds after start-up.
+'''
+
+import argparse
+import json
+import sys
+import threading
+import time
+import queue
+
+from station import Station, add_station_arguments
+
+
+def parse_command(line):
+    """Parse 'name key=value ...' into (name, kwargs), values are JSON where possible"""
+    parts = line.split()
+    kwargs = {}
+    for part in parts[1:]:
+        key, _, value = part.partition('=')
+        try:
+            kwargs[key] = json.loads(value)
+        except ValueError:
+            kwargs[key] = value
+    return parts[0], kwargs
+
+
+def stdin_reader(commands):
+    for line in sys.stdin:
+        if line.strip():
+            commands.put(parse_command(line))
+    commands.put(('quit', {}))
+
+
+def load_script(filename):
+    with open(filename) as scriptFile:
+        script = [json.loads(line) for line in scriptFile if line.strip()]
+    return sorted(script, key=lambda entry: entry['at'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the BlueROV2 operator station without a GUI')
+    add_station_arguments(parser)
+    parser.add_argument('--script', default=None, help='JSON lines file of timed commands')
+    parser.add_argument('--interactive', action='store_true', help='Read commands from stdin')
+    parser.add_argument('--loop-rate', type=float, default=0, help='Cap the loop rate in Hz (0 = run as fast as frames arrive)')
+    args = parser.parse_args()
+
+    station = Station(args)
+    script = load_script(args.script) if args.script else []
+    commands = queue.Queue()
+    if args.interactive:
+        reader = threading.Thread(target=stdin_reader, args=(commands,))
+        reader.daemon = True
+        reader.start()
+
+    period = 1.0 / args.loop_rate if args.loop_rate > 0 else 0
+    startTime = time.perf_counter()
+    running = True
+    while running:
+        loopStart = time.perf_counter()
+        elapsed = loopStart - startTime
+        if args.duration and elapsed > args.duration:
+            print("Duration reached")
+            break
+
+        station.step()
+        if station.newFrame:
+            # nothing is drawn, the frame is 'shown' once the station has processed it
+            station.frame_shown()
+
+        for name, data in station.poll_events():
+            print(f"{elapsed:9.3f} event {name} {data}")
+
+        while script and script[0]['at'] <= elapsed:
+            entry = script.pop(0)
+            print(f"{elapsed:9.3f} command {entry['command']} {entry.get('args', {})}")
+            station.command(entry['command'], **entry.get('args', {}))
+
+        while not commands.empty():
+            name, kwargs = commands.get_nowait()
+            if name == 'quit':
+                running = False
+                break
+            try:
+                station.command(name, **kwargs)
+            except (ValueError, TypeError) as e:
+                print(f"error: {e}")
+
+        if period:
+            time.sleep(max(0, period - (time.perf_counter() - loopStart)))
+        elif not station.newFrame:
+            # nothing new to process, don't spin
+            time.sleep(0.001)
+
+    station.close()
+
+
+if __name__ == '__main__':
+    main()
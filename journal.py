@@ -0,0 +1,466 @@
+'''Crash-safe trial log with group commit, and recovery of interrupted trials
+
+The trial log was a buffered text file only closed on Pass/Fail, so a crash or power
+loss mid-trial lost whatever was still buffered, while an fsync per row would cost the
+loop its frame rate. Journal keeps the same plain text log (one JSON row or event line
+per record, readable as before) but:
+
+    - write() only appends to a list in memory and returns straight away
+    - a committer thread writes the records out every `window` seconds (group commit)
+      and fsyncs them, so at most one window plus one commit is ever lost
+    - a sidecar <log>.crc holds (offset, length, crc32) for every record, fsynced after
+      the data it describes, plus metadata records (the trial's final name, the end)
+
+On the next start recover() finds trials that never finished (still under their
+.pending_ names, see trial.py) and whose station is gone. The sidecar records the boot
+and start time of the process that wrote it, so a PID reused after a reboot or power
+loss is not mistaken for the station that crashed. The log is cut at the first record whose checksum does
+not match, terminated with a FAIL line and renamed to the trial's name, and the video
+files, which have no AVI index when the writer never closed, are rebuilt from the JPEG
+frames they contain. Multi-rate stream files are renamed with the log, as far as they
+were written.
+
+    python journal.py --simulate --seconds 30 --window 0.1      a real trial of headless.py against simulator.py
+    python journal.py --benchmark --rate 60 --seconds 10 --window 0.1     synthetic rows, journal cost only
+    python journal.py --verify "logs/PID_1_..._.txt"
+'''
+
+import argparse
+import glob
+import json
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+from multirate import stream_suffixes
+
+MAGIC = b'RJNL\x01'
+ENTRY = struct.Struct('<BQII')     # kind, offset, length, crc32
+DATA = 0
+META = 1
+
+
+class Journal():
+    """Group-committed, checksummed text log
+
+    Attributes:
+        filename (str): Log file, the checksums are in filename + '.crc'
+        window (float): Durability window, s, 0 commits every write
+        records (int): Records committed
+        bytes (int): Bytes committed
+        commits (int): Group commits made
+        worstExposure (float): Longest a record waited before it was durable, s
+        writes (int): Calls to write()
+        writeTotal (float): Time spent in write(), s
+        writeWorst (float): Longest write(), s
+    """
+
+    def __init__(self, filename, window=0.1):
+        self.filename = filename
+        self.window = window
+        self.file = open(filename, 'wb')
+        self.index = open(filename + '.crc', 'wb')
+        self.index.write(MAGIC)
+        self.pending = []
+        self.offset = 0
+        self.records = 0
+        self.bytes = 0
+        self.commits = 0
+        self.worstExposure = 0.0
+        self.writes = 0
+        self.writeTotal = 0.0
+        self.writeWorst = 0.0
+        self.lock = threading.Lock()
+        self.commitLock = threading.Lock()
+        self.running = True
+        self.thread = None
+        if window > 0:
+            self.thread = threading.Thread(target=self._run, name='journal')
+            self.thread.daemon = True
+            self.thread.start()
+        # tells recover() whether the process behind the .pending_ PID is still this one
+        self.meta(owner=_identity(os.getpid()))
+
+    def write(self, text):
+        """Queue a record, returns the number of bytes it takes in the log"""
+        started = time.perf_counter()
+        data = text.encode()
+        with self.lock:
+            self.pending.append((started, data))
+        if self.window <= 0:
+            self.commit()
+        elapsed = time.perf_counter() - started
+        self.writes += 1
+        self.writeTotal += elapsed
+        self.writeWorst = max(self.writeWorst, elapsed)
+        return len(data)
+
+    def meta(self, **info):
+        """Durably record metadata, e.g. meta(prefix=...) once the trial's final name is known"""
+        payload = json.dumps(info).encode()
+        with self.commitLock:
+            self.index.write(ENTRY.pack(META, 0, len(payload), zlib.crc32(payload)) + payload)
+            self._sync(self.index)
+
+    def _run(self):
+        while self.running:
+            time.sleep(self.window)
+            self.commit()
+
+    @staticmethod
+    def _sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def commit(self):
+        """Write and fsync everything queued so far"""
+        with self.commitLock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return
+            entries = []
+            for queued, data in pending:
+                entries.append(ENTRY.pack(DATA, self.offset, len(data), zlib.crc32(data)))
+                self.offset += len(data)
+            # data first, the checksums must never describe bytes that are not on disk yet
+            self.file.write(b''.join(data for queued, data in pending))
+            self._sync(self.file)
+            self.index.write(b''.join(entries))
+            self._sync(self.index)
+            self.worstExposure = max(self.worstExposure, time.perf_counter() - pending[0][0])
+            self.records += len(pending)
+            self.bytes += sum(len(data) for queued, data in pending)
+            self.commits += 1
+
+    def close(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=self.window * 2 + 1)
+        self.commit()
+        # what the trial cost the loop, read back by simulate()
+        self.meta(end=True, records=self.records, bytes=self.bytes, commits=self.commits,
+                  worstExposure=self.worstExposure, writeMean=self.writeTotal / max(1, self.writes),
+                  writeWorst=self.writeWorst)
+        self.file.close()
+        self.index.close()
+
+    def summary(self):
+        return (f"{self.records} records in {self.commits} commits, "
+                f"worst exposure {self.worstExposure * 1000:0.1f}ms")
+
+
+def read_index(filename):
+    """Entries of a .crc sidecar
+
+    Returns:
+        tuple: (data entries [(offset, length, crc)], metadata dict merged from the META records)
+    """
+    entries = []
+    info = {}
+    with open(filename, 'rb') as index:
+        data = index.read()
+    if not data.startswith(MAGIC):
+        return entries, info
+    position = len(MAGIC)
+    while position + ENTRY.size <= len(data):
+        kind, offset, length, crc = ENTRY.unpack_from(data, position)
+        position += ENTRY.size
+        if kind == META:
+            payload = data[position:position + length]
+            position += length
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            info.update(json.loads(payload))
+        else:
+            entries.append((offset, length, crc))
+    return entries, info
+
+
+def verify(logFilename):
+    """Length of the log that passes its checksums
+
+    Returns:
+        tuple: (good bytes, good records, records in the index, metadata)
+    """
+    entries, info = read_index(logFilename + '.crc')
+    good = 0
+    records = 0
+    with open(logFilename, 'rb') as logFile:
+        for offset, length, crc in entries:
+            if offset != good:
+                break
+            logFile.seek(offset)
+            if zlib.crc32(logFile.read(length)) != crc:
+                break
+            good = offset + length
+            records += 1
+    return good, records, len(entries), info
+
+
+def repair_avi(source, target, fps=None):
+    """Rebuild an MJPG AVI that was never closed (no index, zero sizes) from its JPEG frames
+
+    Returns:
+        int: Frames recovered
+    """
+    import cv2
+    import numpy as np
+
+    with open(source, 'rb') as avi:
+        data = avi.read()
+    if fps is None:
+        # avih starts with the frame period in microseconds
+        avih = data.find(b'avih')
+        period = struct.unpack_from('<I', data, avih + 8)[0] if avih >= 0 else 0
+        fps = 1e6 / period if period else 17.4
+    movi = data.find(b'movi')
+    position = movi + 4 if movi >= 0 else len(data)
+    writer = None
+    frames = 0
+    while position + 8 <= len(data):
+        chunk, size = struct.unpack_from('<4sI', data, position)
+        payload = data[position + 8:position + 8 + size]
+        if len(payload) < size:
+            break                   # the write the crash interrupted
+        position += 8 + size + (size & 1)
+        if chunk[2:] != b'dc':
+            if chunk == b'idx1':
+                break
+            continue
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            break
+        if writer is None:
+            writer = cv2.VideoWriter(target, cv2.VideoWriter_fourcc(*'MJPG'), fps, (frame.shape[1], frame.shape[0]))
+        writer.write(frame)
+        frames += 1
+    if writer is not None:
+        writer.release()
+    return frames
+
+
+def _identity(pid):
+    """[boot id, start time in clock ticks] of a process, None if it is gone or /proc does not say"""
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as bootFile:
+            boot = bootFile.read().strip()
+        with open(f'/proc/{pid}/stat') as statFile:
+            stat = statFile.read()
+        # fields after the command name, which may contain spaces, start at the state (field 3)
+        started = int(stat[stat.rindex(')') + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+    return [boot, started]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+
+
+def recover(directory='logs'):
+    """Finish the trials a previous run left under .pending_ names
+
+    Returns:
+        list: Final prefixes of the recovered trials
+    """
+    recovered = []
+    for logFilename in sorted(glob.glob(os.path.join(directory, '.pending_*.txt'))):
+        tempPrefix = logFilename[:-len('.txt')]
+        try:
+            pid = int(os.path.basename(tempPrefix).split('_')[1])
+        except (IndexError, ValueError):
+            continue
+        crcFilename = logFilename + '.crc'
+        good, records, indexed, info = verify(logFilename) if os.path.exists(crcFilename) else (0, 0, 0, {})
+        owner = info.get('owner')
+        if owner is not None:
+            live = _identity(pid) == owner
+        else:
+            # no identity recorded (not Linux, or a log from before it was), the PID is all there is
+            live = pid == os.getpid() or _alive(pid)
+        if live:
+            continue            # a live station, this one or another
+        prefix = info.get('prefix')
+        if prefix is None and (indexed or os.path.getsize(logFilename)):
+            # started, but the crash came before the trial's name was recorded
+            prefix = os.path.join(directory, 'RECOVERED' + os.path.basename(tempPrefix))
+        if prefix is None:
+            # prepared but never started: nothing to keep
+            for suffix in ['.txt', '.txt.crc', '_raw.avi', '_markup.avi'] + stream_suffixes(tempPrefix):
+                if os.path.exists(tempPrefix + suffix):
+                    os.remove(tempPrefix + suffix)
+            continue
+        size = os.path.getsize(logFilename)
+        with open(logFilename, 'r+b') as logFile:
+            logFile.truncate(good)
+            logFile.seek(good)
+            logFile.write(f"{time.perf_counter()}: RECOVERED - {records} of {indexed} records intact, "
+                          f"{size - good} bytes after them dropped\n".encode())
+            logFile.write(b"FAIL - interrupted\n")
+        os.replace(logFilename, prefix + '.txt')
+        if os.path.exists(crcFilename):
+            os.remove(crcFilename)
+        for suffix in ('_raw.avi', '_markup.avi'):
+            if os.path.exists(tempPrefix + suffix):
+                frames = repair_avi(tempPrefix + suffix, prefix + suffix)
+                os.remove(tempPrefix + suffix)
+                print(f"journal: rebuilt {prefix + suffix} from {frames} frames")
+        for suffix in stream_suffixes(tempPrefix):
+            os.replace(tempPrefix + suffix, prefix + suffix)
+        print(f"journal: recovered {prefix}.txt, {records} of {indexed} committed records intact")
+        recovered.append(prefix)
+    return recovered
+
+
+def save_session(filename, **state):
+    """Write the session state atomically, it survives a crash at any point"""
+    temp = filename + '.tmp'
+    with open(temp, 'w') as sessionFile:
+        json.dump(state, sessionFile)
+        sessionFile.flush()
+        os.fsync(sessionFile.fileno())
+    os.replace(temp, filename)
+
+
+def load_session(filename):
+    try:
+        with open(filename) as sessionFile:
+            return json.load(sessionFile)
+    except (OSError, ValueError):
+        return {}
+
+
+def benchmark(rate=60, seconds=10, window=0.1, directory='logs'):
+    """Synthetic write loop against the journal: one fixed ~400 byte JSON row at rate Hz
+
+    Measures what the journal itself costs: the time write() takes on the calling thread,
+    the commit rate and the worst exposure (the tail-loss bound) on this disk. It does not
+    run the station loop or the simulator, so it says nothing about frame rate, contention
+    with the recorder and other writer threads for the disk, or rows whose size and rate
+    follow the station's; simulate() measures those.
+
+    Returns:
+        dict: Throughput and tail-loss figures
+    """
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f'.journal_benchmark_{os.getpid()}.txt')
+    journal = Journal(filename, window)
+    row = json.dumps({'time': 0.0, 'x': 0.0, 'y': 0.0, 'z': 0.0, 'heading': 0, 'fingerPos': 1000,
+                      'fingerForce': 512, 'vibration': 0, 'hardness': 500, 'pad': 'x' * 260}) + '\n'
+    writeTimes = []
+    started = time.perf_counter()
+    nextRow = started
+    while time.perf_counter() - started < seconds:
+        before = time.perf_counter()
+        journal.write(row)
+        writeTimes.append(time.perf_counter() - before)
+        nextRow += 1.0 / rate
+        time.sleep(max(0.0, nextRow - time.perf_counter()))
+    elapsed = time.perf_counter() - started
+    journal.close()
+    good, records, indexed, info = verify(filename)
+    for name in (filename, filename + '.crc'):
+        os.remove(name)
+    writeTimes.sort()
+    result = {'rows': journal.records, 'rowsPerSecond': journal.records / elapsed,
+              'kBPerSecond': journal.bytes / elapsed / 1e3, 'commits': journal.commits,
+              'writeP99Us': writeTimes[int(len(writeTimes) * 0.99)] * 1e6, 'worstExposureMs': journal.worstExposure * 1e3,
+              'verified': records == indexed == journal.records}
+    print(f"{result['rows']} rows, {result['rowsPerSecond']:0.1f} rows/s, {result['kBPerSecond']:0.1f} kB/s, "
+          f"{result['commits']} commits | write() p99 {result['writeP99Us']:0.1f}us | "
+          f"tail loss bound (worst exposure) {result['worstExposureMs']:0.1f}ms | checksums "
+          f"{'ok' if result['verified'] else 'FAILED'}")
+    return result
+
+
+def simulate(seconds=30, window=0.1, settle=5, mavlinkPort=14650, touchpadPort=8797, videoPort=5650):
+    """Run one trial of headless.py against simulator.py and report what its journal cost
+
+    Unlike benchmark() the rows are the station's own, at its own loop rate and size,
+    written from its loop while the recorder, tlog, streams and network core compete for
+    the CPU and the disk. The figures come from the statistics the trial's journal
+    records in its sidecar when it is closed.
+
+    Args:
+        seconds (float, optional): Length of the trial
+        window (float, optional): Durability window passed to the station
+        settle (float, optional): Time the station gets to bring its links up before the trial
+        mavlinkPort, touchpadPort, videoPort (int, optional): Local ports, away from the defaults
+
+    Returns:
+        dict: Throughput and tail-loss figures, None if the trial log was not found
+    """
+    participant = f'journalsim{os.getpid()}'
+    here = os.path.dirname(os.path.abspath(__file__))
+    simulator = subprocess.Popen([sys.executable, os.path.join(here, 'simulator.py'),
+                                  '--mavlink', f'udpout:127.0.0.1:{mavlinkPort}', '--touchpad-port', str(touchpadPort),
+                                  '--video-port', str(videoPort), '--duration', str(seconds + settle + 30)],
+                                 stdout=subprocess.DEVNULL)
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as script:
+        script.write(json.dumps({'at': settle, 'command': 'start_trial',
+                                 'args': {'participant': participant, 'repeat': 1}}) + '\n')
+        script.write(json.dumps({'at': settle + seconds, 'command': 'end_trial', 'args': {'passed': True}}) + '\n')
+    try:
+        subprocess.run([sys.executable, os.path.join(here, 'headless.py'), '--mavlink', f'udpin:0.0.0.0:{mavlinkPort}',
+                        '--haptics-host', '127.0.0.1', '--haptics-port', str(touchpadPort),
+                        '--video-port', str(videoPort), '--journal-window', str(window), '--script', script.name,
+                        '--duration', str(settle + seconds + 3)], cwd=here, stdout=subprocess.DEVNULL, check=True)
+    finally:
+        simulator.terminate()
+        simulator.wait()
+        os.remove(script.name)
+    logs = glob.glob(os.path.join(here, 'logs', f'PID_{participant}_*.txt'))
+    if not logs:
+        print('journal: the simulated trial left no log')
+        return None
+    good, records, indexed, info = verify(logs[0])
+    result = {'rows': info['records'], 'rowsPerSecond': info['records'] / seconds,
+              'bytesPerRow': info['bytes'] / max(1, info['records']), 'commitsPerSecond': info['commits'] / seconds,
+              'writeMeanUs': info['writeMean'] * 1e6, 'writeWorstUs': info['writeWorst'] * 1e6,
+              'worstExposureMs': info['worstExposure'] * 1e3, 'verified': records == indexed == info['records']}
+    for name in glob.glob(glob.escape(logs[0][:-len('.txt')]) + '*'):
+        os.remove(name)
+    print(f"{result['rows']} station rows, {result['rowsPerSecond']:0.1f} rows/s of {result['bytesPerRow']:0.0f} bytes, "
+          f"{result['commitsPerSecond']:0.1f} commits/s | write() mean {result['writeMeanUs']:0.1f}us "
+          f"worst {result['writeWorstUs']:0.1f}us | tail loss bound (worst exposure) "
+          f"{result['worstExposureMs']:0.1f}ms | checksums {'ok' if result['verified'] else 'FAILED'}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the trial journal or verify a trial log')
+    parser.add_argument('--benchmark', action='store_true', help='synthetic rows in a plain loop, the journal alone')
+    parser.add_argument('--simulate', action='store_true', help='a trial of headless.py against simulator.py')
+    parser.add_argument('--rate', type=float, default=60, help='rows per second for --benchmark')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--window', type=float, default=0.1, help='durability window in s')
+    parser.add_argument('--verify', default=None, help='trial log (.txt) to check against its .crc')
+    parser.add_argument('--recover', default=None, metavar='DIR', help='recover interrupted trials in DIR')
+    args = parser.parse_args()
+
+    if args.verify:
+        good, records, indexed, info = verify(args.verify)
+        size = os.path.getsize(args.verify)
+        print(f"{records} of {indexed} records intact, {good} of {size} bytes covered, {info}")
+    elif args.recover:
+        recover(args.recover)
+    elif args.simulate:
+        simulate(args.seconds, args.window)
+    else:
+        benchmark(args.rate, args.seconds, args.window)
+
+
+if __name__ == '__main__':
+    main()
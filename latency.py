@@ -0,0 +1,162 @@
+'''Glass-to-glass latency of the video receive pipeline profiles
+
+A local sender stamps the time it created each frame into the frame itself (a row of
+black/white blocks, one per bit), encodes it like the ROV camera (RTP H.264 over UDP)
+and the receiving Video reads the stamp back, so the measurement covers encoding,
+the network stack, depayloading, decoding and conversion end to end. Sender and
+receiver share the clock, so no synchronisation is needed.
+
+    python latency.py --profile all --seconds 10
+    python latency.py --profile low-latency --display
+'''
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import video
+from video import Video, PROFILES
+
+BITS = 32
+MASK = (1 << BITS) - 1
+
+
+def now_ms():
+    return int(time.perf_counter() * 1000) & MASK
+
+
+def stamp_frame(frame, ms, block=40):
+    """Write ms into the top row of frame as BITS black/white blocks"""
+    for bit in range(BITS):
+        frame[:block, bit * block:(bit + 1) * block] = 255 if (ms >> bit) & 1 else 0
+    return frame
+
+
+def read_stamp(frame, block=40):
+    """Read back the time written by stamp_frame()"""
+    ms = 0
+    for bit in range(BITS):
+        x = bit * block + block // 2
+        if frame[block // 2, x].mean() > 127:
+            ms |= 1 << bit
+    return ms
+
+
+class TimestampSender():
+    """RTP H.264 sender whose frames carry their creation time
+
+    Attributes:
+        host (str): Destination address
+        port (int): Destination UDP port
+        fps (float): Frame rate
+        video_pipe (object): GStreamer top-level pipeline
+    """
+
+    def __init__(self, host='127.0.0.1', port=5610, width=1280, height=720, fps=30, bitrate=4000):
+        self.Gst = video.load_gst()
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.background = np.full((height, width, 3), 90, dtype=np.uint8)
+        self.pipeline_description = ' '.join([
+            'appsrc name=src is-live=true do-timestamp=true format=time',
+            f'caps=video/x-raw,format=BGR,width={width},height={height},framerate={fps}/1',
+            '! videoconvert ! x264enc tune=zerolatency speed-preset=ultrafast',
+            f'bitrate={bitrate} key-int-max={fps}',
+            '! rtph264pay config-interval=1 pt=96',
+            f'! udpsink host={host} port={port} sync=false'
+        ])
+        self.video_pipe = None
+        self.running = False
+
+    def run(self):
+        self.video_pipe = self.Gst.parse_launch(self.pipeline_description)
+        self.source = self.video_pipe.get_by_name('src')
+        self.video_pipe.set_state(self.Gst.State.PLAYING)
+        self.running = True
+        self.thread = threading.Thread(target=self._send, name='latency-sender')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _send(self):
+        nextFrame = time.perf_counter()
+        while self.running:
+            frame = stamp_frame(self.background.copy(), now_ms())
+            self.source.emit('push-buffer', self.Gst.Buffer.new_wrapped(frame.tobytes()))
+            nextFrame += 1.0 / self.fps
+            time.sleep(max(0, nextFrame - time.perf_counter()))
+
+    def stop(self):
+        self.running = False
+        if self.video_pipe is not None:
+            self.video_pipe.set_state(self.Gst.State.NULL)
+
+
+def measure(profile, seconds=10, port=5610, fps=30, bitrate=4000, display=False):
+    """Glass-to-glass latency of one profile
+
+    Returns:
+        dict: frames, fps and glass-to-glass/pipeline latency percentiles in ms
+    """
+    sender = TimestampSender(port=port, fps=fps, bitrate=bitrate)
+    receiver = Video(port=port, profile=profile)
+    sender.run()
+    if display:
+        import cv2
+
+    glass = []
+    pipeline = []
+    startTime = time.perf_counter()
+    while time.perf_counter() - startTime < seconds:
+        if not receiver.frame_available():
+            time.sleep(0.0005)
+            continue
+        frame = receiver.frame()
+        if display:
+            cv2.imshow(f'latency {profile}', frame)
+            cv2.waitKey(1)
+        latency = (now_ms() - read_stamp(frame)) & MASK
+        if latency < 5000:      # a misread stamp (e.g. a damaged frame) gives nonsense
+            glass.append(latency)
+            pipeline.append(receiver.latency(receiver.latest_info['sinkTime']) * 1000)
+    elapsed = time.perf_counter() - startTime
+
+    sender.stop()
+    receiver.stop()
+    if display:
+        cv2.destroyAllWindows()
+
+    result = {'profile': profile, 'frames': len(glass), 'fps': len(glass) / elapsed}
+    for name, values in (('glass', glass), ('pipeline', pipeline)):
+        values = np.array(values if values else [np.nan])
+        result[name] = {'min': np.nanmin(values), 'median': np.nanmedian(values),
+                        'p95': np.nanpercentile(values, 95), 'max': np.nanmax(values)}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure glass-to-glass video latency over a local RTP loopback')
+    parser.add_argument('--profile', choices=sorted(PROFILES) + ['all'], default='all')
+    parser.add_argument('--seconds', type=float, default=10, help='measurement time per profile')
+    parser.add_argument('--port', type=int, default=5610, help='loopback UDP port (not the camera port)')
+    parser.add_argument('--fps', type=int, default=30)
+    parser.add_argument('--bitrate', type=int, default=4000, help='sender bitrate in kbit/s')
+    parser.add_argument('--display', action='store_true', help='show frames, so the latency includes drawing them')
+    args = parser.parse_args()
+
+    profiles = sorted(PROFILES) if args.profile == 'all' else [args.profile]
+    print(f"{'profile':>12} {'frames':>7} {'fps':>6} {'glass-to-glass ms (min/median/p95/max)':>40} {'in pipeline ms (median)':>24}")
+    for profile in profiles:
+        result = measure(profile, args.seconds, args.port, args.fps, args.bitrate, args.display)
+        glass = result['glass']
+        print(f"{profile:>12} {result['frames']:>7} {result['fps']:>6.1f} "
+              f"{glass['min']:>10.1f} {glass['median']:>9.1f} {glass['p95']:>9.1f} {glass['max']:>9.1f} "
+              f"{result['pipeline']['median']:>24.1f}")
+        # let the port be released before the next profile binds it
+        time.sleep(0.5)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,314 @@
+'''Multi-rate trial logging: every source recorded at its own rate
+
+The trial log has one row per loop iteration, so everything in it is resampled to the
+video-bound loop rate: IMU messages between iterations, several touchpad replies per
+frame and the RC commands themselves never make it in. MultiRateLog keeps a stream per
+source next to it, one CSV per source, a row per item as the source produces it:
+
+    <trial>_mavlink_<TYPE>.csv    every received MAVLink message, per type
+    <trial>_sent_<TYPE>.csv       every MAVLink message the station sends, e.g.
+                                  sent_RC_CHANNELS_OVERRIDE for each RC command
+    <trial>_haptics.csv           every touchpad exchange
+    <trial>_vision.csv            every frame's pose
+
+Each row starts with t, the perf_counter time the item arrived (or was sent) minus the
+trial start, the clock the trial log's 'time' and 'frameTime' use, and the station frame
+number at that moment. <trial>_streams.json lists the sources, rewritten whenever a
+stream opens and with the row counts once the trial finishes, so a trial cut short by a
+crash still has one.
+Like the trial log, the streams are written under the trial's temporary .pending_ name
+and renamed with it by trial.TrialController, or by journal.recover() after a crash.
+
+Recording is a tuple put on a queue, everything else (decoding messages, formatting,
+writing) happens on the writer thread. MAVLink rows come from the connection's message
+hooks and the haptics rows from the network core's stream of the touchpad channel, so
+neither costs the station loop anything.
+
+Streams are merged and aligned when they are read:
+
+    python multirate.py "logs/PID_1_..." --summary                       rows, rate and largest gap per source
+    python multirate.py "logs/PID_1_..." --merge merged.csv              all rows in time order
+    python multirate.py "logs/PID_1_..." --align vision --out a.csv      the latest row of every source at each frame
+'''
+
+import argparse
+import bisect
+import csv
+import glob
+import heapq
+import json
+import os
+import queue
+import threading
+import time
+
+# fields of the sources that are not MAVLink messages, after t and frame
+FIELDS = {
+    'haptics': ('fingerPos', 'fingerForce', 'vibration', 'hardness', 'rtt'),
+    'vision': ('tvec0', 'tvec1', 'tvec2', 'rvec0', 'rvec1', 'rvec2', 'markerId', 'detectLevel'),
+}
+
+
+class MultiRateLog():
+    """Per-source CSV streams of one trial, written by a background thread
+
+    Attributes:
+        prefix (str): Trial file prefix
+        startTime (float): perf_counter at the start of the trial, t = 0 in every stream
+        rows (dict): Source -> rows written
+        dropped (int): Items lost because the writer fell too far behind
+        done (threading.Event): Set once every stream file is closed
+    """
+
+    def __init__(self, prefix, startTime, frameNumber, queueSize=20000):
+        """Summary
+
+        Args:
+            prefix (str): File prefix the trial is written under, streams are prefix + '_<source>.csv'
+            startTime (float): perf_counter at the start of the trial
+            frameNumber (callable): Returns the current station frame number
+            queueSize (int, optional): Items that can wait for the writer
+        """
+        self.prefix = prefix
+        self.startTime = startTime
+        self.frameNumber = frameNumber
+        self.items = queue.Queue(queueSize)
+        self.rows = {}
+        self.dropped = 0
+        self.master = None
+        self.follower = None
+        self.stopping = threading.Event()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='multirate')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, source, stamp, values):
+        """Queue a row, from any thread
+
+        Args:
+            source (str): Stream name, a key of FIELDS
+            stamp (float): perf_counter time of the item
+            values (tuple): Values in FIELDS[source] order
+        """
+        try:
+            self.items.put_nowait((source, stamp, self.frameNumber(), values))
+        except queue.Full:
+            self.dropped += 1
+
+    def attach_mavlink(self, master):
+        """Record every message master receives, and sends if it is a network core endpoint"""
+        self.master = master
+        master.message_hooks.append(self._received)
+        if hasattr(master, 'send_hooks'):
+            master.send_hooks.append(self._sent)
+
+    def _received(self, master, msg):
+        if msg.get_type() != 'BAD_DATA':
+            self.record('mavlink_' + msg.get_type(), time.perf_counter(), msg)
+
+    def _sent(self, master, msg):
+        # the network core's own 1 Hz heartbeat says nothing about the trial
+        if msg.get_type() != 'HEARTBEAT':
+            self.record('sent_' + msg.get_type(), time.perf_counter(), msg)
+
+    def attach_haptics(self, channel):
+        """Record every exchange of a netcore.HapticsChannel"""
+        self.follower = channel.core.submit(self._follow(channel))
+
+    async def _follow(self, channel):
+        stream = channel.subscribe(1000)
+        try:
+            async for key, value, stamp in stream:
+                self.record('haptics', stamp, value)
+        finally:
+            channel.streams.remove(stream)
+
+    def _run(self):
+        files = {}
+        try:
+            while True:
+                try:
+                    item = self.items.get(timeout=0.1)
+                except queue.Empty:
+                    if self.stopping.is_set():
+                        break
+                    continue
+                if item is None:
+                    break
+                source, stamp, frame, values = item
+                if source not in files:
+                    if source in FIELDS:
+                        fields = list(FIELDS[source])
+                    else:
+                        fields = list(values.get_fieldnames())
+                    streamFile = open(f"{self.prefix}_{source}.csv", 'w', newline='')
+                    writer = csv.writer(streamFile)
+                    writer.writerow(['t', 'frame'] + fields)
+                    files[source] = (streamFile, writer, fields)
+                    self.rows[source] = 0
+                    self._write_manifest(complete=False)
+                streamFile, writer, fields = files[source]
+                if source not in FIELDS:
+                    # MAVLink messages are decoded here rather than on the thread that received them
+                    values = [getattr(values, field) for field in fields]
+                writer.writerow([round(stamp - self.startTime, 6), frame] + list(values))
+                self.rows[source] += 1
+        finally:
+            for streamFile, writer, fields in files.values():
+                streamFile.close()
+            self._write_manifest(complete=True)
+            self.done.set()
+
+    def _write_manifest(self, complete):
+        # replaced in one step, a crash leaves the previous manifest rather than half of one
+        temp = self.prefix + '_streams.json.tmp'
+        with open(temp, 'w') as manifest:
+            json.dump({'start': self.startTime, 'rows': self.rows, 'dropped': self.dropped, 'complete': complete},
+                      manifest, indent=1)
+        os.replace(temp, self.prefix + '_streams.json')
+
+    def stop(self):
+        """Detach and finish writing in the background, returns straight away"""
+        if self.master is not None:
+            if self._received in self.master.message_hooks:
+                self.master.message_hooks.remove(self._received)
+            if self._sent in getattr(self.master, 'send_hooks', ()):
+                self.master.send_hooks.remove(self._sent)
+        if self.follower is not None:
+            self.follower.cancel()
+        self.stopping.set()
+        try:
+            # wakes the writer up, when the queue is full it finds the queue empty and the event set instead
+            self.items.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def summary(self):
+        return f"{sum(self.rows.values())} rows in {len(self.rows)} streams, {self.dropped} dropped"
+
+
+def stream_suffixes(prefix):
+    """Suffixes of the stream files written under prefix, e.g. ['_haptics.csv', '_streams.json']"""
+    paths = glob.glob(glob.escape(prefix) + '_*.csv') + glob.glob(glob.escape(prefix) + '_streams.json')
+    return sorted(path[len(prefix):] for path in paths)
+
+
+def load(prefix, source):
+    """One stream of a trial
+
+    Returns:
+        tuple: (field names, rows), numbers converted to float, t first
+    """
+    with open(f"{prefix}_{source}.csv", newline='') as streamFile:
+        reader = csv.reader(streamFile)
+        fields = next(reader)
+        rows = []
+        for row in reader:
+            values = []
+            for value in row:
+                try:
+                    values.append(float(value))
+                except ValueError:
+                    values.append(value)
+            rows.append(values)
+    return fields, rows
+
+
+def sources(prefix):
+    """Streams of a trial, from its manifest or, if a crash left none, from the files"""
+    try:
+        with open(prefix + '_streams.json') as manifest:
+            return sorted(json.load(manifest)['rows'])
+    except (OSError, ValueError):
+        return [suffix[1:-len('.csv')] for suffix in stream_suffixes(prefix) if suffix.endswith('.csv')]
+
+
+def merge(prefix, names=None):
+    """Rows of several streams in time order
+
+    Yields:
+        tuple: (t, source, row dict)
+    """
+    def rows(name):
+        fields, streamRows = load(prefix, name)
+        for row in streamRows:
+            yield row[0], name, dict(zip(fields, row))
+
+    return heapq.merge(*[rows(name) for name in (names or sources(prefix))], key=lambda item: item[0])
+
+
+def align(prefix, reference, names=None, tolerance=None):
+    """The latest row of every stream at or before each row of reference
+
+    Args:
+        reference (str): Stream whose rows set the time base, e.g. 'vision'
+        names (list, optional): Streams to align, all by default
+        tolerance (float, optional): Leave a stream's values empty when its latest row is older than this, s
+
+    Returns:
+        tuple: (field names, rows), other streams' fields are prefixed with their name
+    """
+    names = [name for name in (names or sources(prefix)) if name != reference]
+    fields, rows = load(prefix, reference)
+    others = []
+    for name in names:
+        otherFields, otherRows = load(prefix, name)
+        others.append((name, otherFields[1:], [row[0] for row in otherRows], otherRows))
+        fields = fields + [f"{name}.{field}" for field in otherFields[1:]]
+    aligned = []
+    for row in rows:
+        t = row[0]
+        out = list(row)
+        for name, otherFields, times, otherRows in others:
+            i = bisect.bisect_right(times, t) - 1
+            if i < 0 or (tolerance is not None and t - times[i] > tolerance):
+                out.extend([''] * len(otherFields))
+            else:
+                out.extend(otherRows[i][1:])
+        aligned.append(out)
+    return fields, aligned
+
+
+def summarise(prefix):
+    print(f"{'stream':>36} {'rows':>8} {'Hz':>8} {'max gap ms':>11}")
+    for name in sources(prefix):
+        fields, rows = load(prefix, name)
+        times = [row[0] for row in rows]
+        span = times[-1] - times[0] if len(times) > 1 else 0
+        gap = max((b - a for a, b in zip(times, times[1:])), default=0)
+        rate = (len(times) - 1) / span if span > 0 else float('nan')
+        print(f"{name:>36} {len(rows):>8} {rate:>8.1f} {gap * 1000:>11.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect, merge and align the multi-rate streams of a trial')
+    parser.add_argument('prefix', help='trial file prefix, the trial log name without .txt')
+    parser.add_argument('--summary', action='store_true', help='rows, rate and largest gap per stream')
+    parser.add_argument('--merge', default=None, metavar='CSV', help='write every row of every stream in time order')
+    parser.add_argument('--align', default=None, metavar='STREAM', help='reference stream for --out, e.g. vision')
+    parser.add_argument('--streams', nargs='*', default=None, help='streams to merge or align (default: all)')
+    parser.add_argument('--tolerance', type=float, default=None, help='oldest value --align carries forward, s')
+    parser.add_argument('--out', default=None, help='aligned CSV')
+    args = parser.parse_args()
+
+    if args.prefix.endswith('.txt'):
+        args.prefix = args.prefix[:-4]
+    if args.merge:
+        with open(args.merge, 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(['t', 'source', 'values'])
+            for t, source, row in merge(args.prefix, args.streams):
+                writer.writerow([t, source, json.dumps(row)])
+    if args.align:
+        fields, rows = align(args.prefix, args.align, args.streams, args.tolerance)
+        with open(args.out or f"{args.prefix}_aligned_{args.align}.csv", 'w', newline='') as out:
+            writer = csv.writer(out)
+            writer.writerow(fields)
+            writer.writerows(rows)
+    if args.summary or not (args.merge or args.align):
+        summarise(args.prefix)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,577 @@
+'''asyncio network core: MAVLink, the touchpad and any other socket on one I/O thread
+
+Network I/O used to be a thread per peer: hapticsThread blocked in recv(128),
+heartbeat_helper slept between heartbeats and the GUI loop polled MAVLink with
+recv_match. NetCore runs a single asyncio event loop on one thread instead, and every
+socket is a Channel coroutine on it:
+
+    MavlinkEndpoint   MAVLink over UDP, datagrams parsed with pymavlink's parser, heartbeats
+                      sent by a task on the loop
+    HapticsChannel    the touchpad's lock-step exchange over TCP or UDP, reconnecting when
+                      the link drops
+
+The rest of the station reads channels the way it read the old links. MavlinkEndpoint
+offers the part of a mavutil connection the station uses (mav, messages, recv_match,
+wait_heartbeat, set_mode, message_hooks...), and HapticsChannel updates the same
+hapticsIn list hapticsThread did. On top of that every channel offers:
+
+    latest(key)        (value, perf_counter stamp) of the newest item, e.g. latest('SCALED_IMU2'), or
+                       latest('touchpad'): (position, force, vibration, hardness, rtt) of an exchange
+    subscribe()        async stream of (key, value, stamp) for coroutines on the loop, oldest
+                       items are dropped when the consumer falls behind
+
+and counts packets and bytes in both directions plus a latency per channel: the
+command to COMMAND_ACK time for MAVLink and the exchange round trip for the touchpad.
+A new socket is a Channel subclass with a run() coroutine, added with NetCore.add().
+
+    python netcore.py --mavlink udpin:0.0.0.0:14550 --haptics 10.55.0.1:8787     print link rates
+    python netcore.py --check                          send an 18 channel RC override through an endpoint
+'''
+
+import argparse
+import asyncio
+import collections
+import pickle
+import socket
+import statistics
+import threading
+import time
+
+from pymavlink import mavutil
+# ArduSub speaks MAVLink 2, the v1 dialect mavutil loads by default has no 18 channel RC override
+from pymavlink.dialects.v20 import ardupilotmega as mavlink2
+
+
+def parse_endpoint(connection):
+    """'udpin:host:port', 'udp:host:port' or 'udpout:host:port' -> (mode, host, port), None for other links"""
+    kind, _, address = connection.partition(':')
+    if kind not in ('udp', 'udpin', 'udpout') or ':' not in address:
+        return None
+    host, _, port = address.rpartition(':')
+    return ('udpout' if kind == 'udpout' else 'udpin'), host, int(port)
+
+
+class _Datagrams(asyncio.DatagramProtocol):
+    """Hands every datagram to a callback"""
+
+    def __init__(self, onDatagram):
+        self.onDatagram = onDatagram
+
+    def datagram_received(self, data, addr):
+        self.onDatagram(data, addr)
+
+
+class Stream():
+    """Async iterator over a channel's (key, value, stamp) items
+
+    Attributes:
+        dropped (int): Items discarded because the consumer fell behind
+    """
+
+    def __init__(self, maxsize=100):
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, item):
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.queue.get()
+
+
+class Channel():
+    """One socket run by NetCore
+
+    Subclasses implement run(), a coroutine that owns the socket, and call received(),
+    sent() and publish() from it.
+
+    Attributes:
+        name (str): Name in reports
+        connected (threading.Event): Set while the peer is reachable
+        latencies (collections.deque): Recent latency samples, s, meaning depends on the channel
+        snapshots (dict): Key -> (value, stamp, count) of the newest item
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.core = None
+        self.connected = threading.Event()
+        self.latencies = collections.deque(maxlen=500)
+        self.snapshots = {}
+        self.condition = threading.Condition()
+        self.streams = []
+        self.rxPackets = 0
+        self.rxBytes = 0
+        self.txPackets = 0
+        self.txBytes = 0
+
+    async def run(self):
+        raise NotImplementedError
+
+    def received(self, size):
+        self.rxPackets += 1
+        self.rxBytes += size
+
+    def sent(self, size):
+        self.txPackets += 1
+        self.txBytes += size
+
+    def publish(self, key, value, stamp):
+        """Store the newest value of key and pass it to the streams, call on the loop"""
+        with self.condition:
+            previous = self.snapshots.get(key)
+            self.snapshots[key] = (value, stamp, previous[2] + 1 if previous else 1)
+            self.condition.notify_all()
+        for stream in self.streams:
+            stream.put((key, value, stamp))
+
+    def latest(self, key):
+        """(value, perf_counter stamp) of the newest item of key, (None, None) before the first"""
+        entry = self.snapshots.get(key)
+        return (entry[0], entry[1]) if entry else (None, None)
+
+    def subscribe(self, maxsize=100):
+        """Async stream of every item from now on, call on the loop"""
+        stream = Stream(maxsize)
+        self.streams.append(stream)
+        return stream
+
+    def wait_connected(self, timeout):
+        return self.connected.wait(timeout)
+
+    def close(self):
+        pass
+
+
+class MavlinkEndpoint(Channel):
+    """MAVLink over UDP, a drop-in for the mavutil connection the station used
+
+    recv_match() returns the newest unread message of the requested types rather than
+    the next one in a queue, which is what the station's polling wanted anyway.
+
+    Attributes:
+        mav (MAVLink): Encoder, mav.<message>_send() works from any thread
+        messages (dict): Message type -> newest message, like mavutil's
+        message_hooks (list): Called as hook(endpoint, msg) for every parsed message
+        send_hooks (list): Called as hook(endpoint, msg) for every message sent, on the sending thread
+        target_system, target_component (int): Of the vehicle, from its heartbeat
+        badData (int): Bytes pymavlink could not parse into messages
+        unsent (int): Messages dropped because no peer address was known yet
+    """
+
+    def __init__(self, connection, sourceSystem=255, sourceComponent=0, heartbeatInterval=0.9):
+        """Summary
+
+        Args:
+            connection (str): 'udpin:host:port' to listen (replies go to the latest sender) or 'udpout:host:port'
+            sourceSystem (int, optional): Our MAVLink system ID
+            sourceComponent (int, optional): Our MAVLink component ID
+            heartbeatInterval (float, optional): GCS heartbeat period, s
+        """
+        super().__init__('mavlink')
+        self.mode, self.host, self.port = parse_endpoint(connection)
+        self.heartbeatInterval = heartbeatInterval
+        self.mav = mavlink2.MAVLink(self, srcSystem=sourceSystem, srcComponent=sourceComponent)
+        self.mav.set_send_callback(self._sending)
+        # the v2 parser reads v1 packets as well
+        self.parser = mavlink2.MAVLink(None)
+        self.parser.robust_parsing = True
+        self.address = (self.host, self.port) if self.mode == 'udpout' else None
+        self.transport = None
+        self.messages = {}
+        self.message_hooks = []
+        self.send_hooks = []
+        self.consumed = {}
+        self.target_system = 0
+        self.target_component = 0
+        self.vehicleType = None
+        self.pendingCommands = {}
+        self.badData = 0
+        self.unsent = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        local = (self.host, self.port) if self.mode == 'udpin' else ('0.0.0.0', 0)
+        self.transport, _ = await loop.create_datagram_endpoint(lambda: _Datagrams(self._datagram), local_addr=local)
+        try:
+            while True:
+                self.mav.heartbeat_send(
+                    mavutil.mavlink.MAV_TYPE_GCS,
+                    mavutil.mavlink.MAV_AUTOPILOT_INVALID,
+                    128, 0, 0)
+                await asyncio.sleep(self.heartbeatInterval)
+        finally:
+            self.transport.close()
+
+    def write(self, buf):
+        # called by mav.<message>_send() on whichever thread sends
+        self.core.call(self._send, bytes(buf))
+
+    def _send(self, buf):
+        if self.transport is None or self.address is None:
+            self.unsent += 1
+            return
+        self.transport.sendto(buf, self.address)
+        self.sent(len(buf))
+
+    def _sending(self, msg):
+        if msg.get_type() == 'COMMAND_LONG':
+            self.pendingCommands[msg.command] = time.perf_counter()
+        for hook in list(self.send_hooks):
+            hook(self, msg)
+
+    def _datagram(self, data, addr):
+        now = time.perf_counter()
+        self.received(len(data))
+        if self.mode == 'udpin':
+            self.address = addr
+        for msg in self.parser.parse_buffer(data) or ():
+            for hook in list(self.message_hooks):
+                hook(self, msg)
+            msgType = msg.get_type()
+            if msgType == 'BAD_DATA':
+                self.badData += len(msg.get_msgbuf())
+                continue
+            if msgType == 'HEARTBEAT':
+                if msg.type == mavutil.mavlink.MAV_TYPE_GCS:
+                    # other ground stations on the same link are not the vehicle
+                    continue
+                if self.target_system == 0:
+                    self.target_system = msg.get_srcSystem()
+                    self.target_component = msg.get_srcComponent()
+                self.vehicleType = msg.type
+            elif msgType == 'COMMAND_ACK':
+                sentTime = self.pendingCommands.pop(msg.command, None)
+                if sentTime is not None:
+                    self.latencies.append(now - sentTime)
+            self.messages[msgType] = msg
+            self.publish(msgType, msg, now)
+
+    def recv_match(self, type=None, blocking=False, timeout=None):
+        """Newest message of type (a name or a tuple of names, None for any) not returned before
+
+        Returns:
+            MAVLink_message: The message, None if there is none (within timeout when blocking)
+        """
+        types = (type,) if isinstance(type, str) else type
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.condition:
+            while True:
+                for msgType in (types if types is not None else list(self.snapshots)):
+                    entry = self.snapshots.get(msgType)
+                    if entry is not None and entry[2] > self.consumed.get(msgType, 0):
+                        self.consumed[msgType] = entry[2]
+                        return entry[0]
+                if not blocking:
+                    return None
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.condition.wait(remaining)
+
+    def wait_heartbeat(self, timeout=None):
+        return self.recv_match(type='HEARTBEAT', blocking=True, timeout=timeout)
+
+    def mode_mapping(self):
+        if self.vehicleType is None:
+            return {}
+        return mavutil.mode_mapping_byname(self.vehicleType) or {}
+
+    def set_mode(self, mode_id):
+        self.mav.command_long_send(
+            self.target_system, self.target_component,
+            mavutil.mavlink.MAV_CMD_DO_SET_MODE, 0,
+            mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, mode_id, 0, 0, 0, 0, 0)
+
+    def motors_armed(self):
+        heartbeat = self.messages.get('HEARTBEAT')
+        return heartbeat is not None and bool(heartbeat.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED)
+
+    def motors_armed_wait(self):
+        while not self.motors_armed():
+            self.wait_heartbeat()
+
+    def motors_disarmed_wait(self):
+        while self.motors_armed():
+            self.wait_heartbeat()
+
+    def close(self):
+        if self.transport is not None:
+            self.core.call(self.transport.close)
+
+
+class BadReply(ValueError):
+    """A touchpad reply that is not [position, force]"""
+
+
+class HapticsChannel(Channel):
+    """The touchpad's lock-step exchange: send [vibration, hardness], read [position, force]
+
+    hapticsIn and hapticsOut are the station's own lists, updated in place as
+    hapticsThread did. The link is reopened whenever it drops or stalls.
+
+    Attributes:
+        rtt (float): Latest exchange round trip, s
+        stamp (float): perf_counter of the latest reply, None before the first
+        reconnects (int): Times the link was lost and reopened
+    """
+
+    def __init__(self, host, port, hapticsIn, hapticsOut, transport='tcp', timeout=5, retry=1.0):
+        """Summary
+
+        Args:
+            host (str): Touchpad address
+            port (int): Touchpad port
+            hapticsIn (list): [position, force] from the touchpad
+            hapticsOut (list): [vibration, hardness] to the touchpad
+            transport (str, optional): 'tcp' or 'udp'
+            timeout (float, optional): Connect and reply timeout, s
+            retry (float, optional): Wait before reconnecting, s
+        """
+        super().__init__('haptics')
+        self.host = host
+        self.port = port
+        self.hapticsIn = hapticsIn
+        self.hapticsOut = hapticsOut
+        self.protocol = transport
+        self.timeout = timeout
+        self.retry = retry
+        self.rtt = 0.0
+        self.stamp = None
+        self.reconnects = 0
+
+    async def run(self):
+        while True:
+            try:
+                if self.protocol == 'udp':
+                    await self._udp()
+                else:
+                    await self._tcp()
+            except (OSError, EOFError, asyncio.TimeoutError, pickle.UnpicklingError, BadReply) as e:
+                if self.connected.is_set():
+                    self.reconnects += 1
+                    print(f"haptics link lost ({type(e).__name__}: {e}), reconnecting")
+                self.connected.clear()
+            await asyncio.sleep(self.retry)
+
+    async def _tcp(self):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            writer.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connected.set()
+            print("Connected to haptics!")
+            while True:
+                hapticDataOut = list(self.hapticsOut)
+                payload = pickle.dumps(hapticDataOut)
+                sentTime = time.perf_counter()
+                writer.write(payload)
+                self.sent(len(payload))
+                reply = await asyncio.wait_for(reader.read(128), self.timeout)
+                if not reply:
+                    raise EOFError('touchpad closed the connection')
+                self._exchange(reply, sentTime, hapticDataOut)
+        finally:
+            writer.close()
+
+    async def _udp(self):
+        loop = asyncio.get_running_loop()
+        replies = asyncio.Queue()
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _Datagrams(lambda data, addr: replies.put_nowait(data)), remote_addr=(self.host, self.port))
+        try:
+            while True:
+                hapticDataOut = list(self.hapticsOut)
+                payload = pickle.dumps(hapticDataOut)
+                sentTime = time.perf_counter()
+                transport.sendto(payload)
+                self.sent(len(payload))
+                reply = await asyncio.wait_for(replies.get(), self.timeout)
+                if not self.connected.is_set():
+                    self.connected.set()
+                    print("Connected to haptics!")
+                self._exchange(reply, sentTime, hapticDataOut)
+        finally:
+            transport.close()
+
+    def _exchange(self, reply, sentTime, hapticDataOut):
+        now = time.perf_counter()
+        self.received(len(reply))
+        hapticDataIn = pickle.loads(reply)
+        if not isinstance(hapticDataIn, (list, tuple)) or len(hapticDataIn) != 2:
+            raise BadReply(f'expected [position, force], got {hapticDataIn!r:.60}')
+        self.rtt = now - sentTime
+        self.latencies.append(self.rtt)
+        self.hapticsIn[0] = hapticDataIn[0]
+        self.hapticsIn[1] = hapticDataIn[1]
+        self.stamp = now
+        self.publish('touchpad', (hapticDataIn[0], hapticDataIn[1], hapticDataOut[0], hapticDataOut[1], self.rtt), now)
+
+
+class NetCore():
+    """A single asyncio event loop, on its own thread, running every Channel
+
+    Attributes:
+        loop (asyncio.AbstractEventLoop): The loop, use call() or submit() from other threads
+        channels (dict): Name -> Channel
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.channels = {}
+        self.tasks = {}
+        self.reported = {}
+        self.reportTime = time.perf_counter()
+        self.thread = threading.Thread(target=self._run, name='netcore')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def add(self, channel):
+        """Start running channel on the loop
+
+        Returns:
+            Channel: channel
+        """
+        channel.core = self
+        self.channels[channel.name] = channel
+        self.tasks[channel.name] = self.submit(channel.run())
+        return channel
+
+    def submit(self, coroutine):
+        """Run a coroutine on the loop from any thread, returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def call(self, function, *args):
+        """Call function on the loop from any thread"""
+        self.loop.call_soon_threadsafe(function, *args)
+
+    def report(self):
+        """Per channel rates since the previous report and latency, ms
+
+        Returns:
+            dict: Name -> {connected, rxHz, rxKBps, txHz, txKBps, latency: (median, p95)}
+        """
+        now = time.perf_counter()
+        elapsed = max(now - self.reportTime, 1e-9)
+        result = {}
+        for name, channel in self.channels.items():
+            counts = (channel.rxPackets, channel.rxBytes, channel.txPackets, channel.txBytes)
+            previous = self.reported.get(name, (0, 0, 0, 0))
+            rxHz, rxBytes, txHz, txBytes = [(count - last) / elapsed for count, last in zip(counts, previous)]
+            latencies = sorted(channel.latencies)
+            latency = (float('nan'), float('nan'))
+            if latencies:
+                latency = (statistics.median(latencies) * 1000, latencies[int(0.95 * (len(latencies) - 1))] * 1000)
+            result[name] = {'connected': channel.connected.is_set(), 'rxHz': rxHz, 'rxKBps': rxBytes / 1e3,
+                            'txHz': txHz, 'txKBps': txBytes / 1e3, 'latency': latency}
+            self.reported[name] = counts
+        self.reportTime = now
+        return result
+
+    def summary(self):
+        parts = []
+        for name, r in self.report().items():
+            parts.append(f"{name} {'up' if r['connected'] else 'down'} rx {r['rxHz']:0.0f}/s {r['rxKBps']:0.1f}kB/s "
+                         f"tx {r['txHz']:0.0f}/s {r['txKBps']:0.1f}kB/s latency {r['latency'][0]:0.2f}ms "
+                         f"(p95 {r['latency'][1]:0.2f})")
+        return ' | '.join(parts)
+
+    async def _shutdown(self):
+        # every task on the loop, channels and followers such as multirate's, gets to run its cleanup
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        """Cancel every task, wait for their cleanup, then stop and close the loop"""
+        if self.loop.is_closed():
+            return
+        for channel in self.channels.values():
+            channel.close()
+        try:
+            self.submit(self._shutdown()).result(timeout=2)
+        except Exception as e:
+            print(f"network: shutdown did not finish cleanly: {type(e).__name__}: {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=2)
+        if not self.thread.is_alive():
+            self.loop.close()
+
+
+def check_rc_override(timeout=2):
+    """Send one 18 channel RC override, as set_rc_channel_pwm does, through an endpoint to a local socket
+
+    Returns:
+        bool: True if it arrived as a MAVLink 2 RC_CHANNELS_OVERRIDE with all 18 channels
+    """
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.settimeout(timeout)
+    core = NetCore()
+    try:
+        endpoint = core.add(MavlinkEndpoint(f'udpout:127.0.0.1:{receiver.getsockname()[1]}'))
+        deadline = time.perf_counter() + timeout
+        while endpoint.transport is None and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        channels = [65535] * 18
+        channels[4] = 1550
+        channels[17] = 1234
+        endpoint.mav.rc_channels_override_send(1, 1, *channels)
+        parser = mavlink2.MAVLink(None)
+        msg = None
+        while msg is None:
+            # the endpoint's heartbeats arrive too
+            for received in parser.parse_buffer(receiver.recv(512)) or ():
+                if received.get_type() == 'RC_CHANNELS_OVERRIDE':
+                    msg = received
+        version2 = msg.get_msgbuf()[0] == 0xFD
+        ok = version2 and msg.chan5_raw == 1550 and msg.chan18_raw == 1234
+        print(f"RC override through the endpoint: {'ok' if ok else 'wrong values'}, MAVLink {'2' if version2 else '1'}")
+        return ok
+    except socket.timeout:
+        print("RC override through the endpoint: nothing arrived")
+        return False
+    finally:
+        core.close()
+        receiver.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the network core on its own and print link rates and latency')
+    parser.add_argument('--check', action='store_true', help='check an RC override goes out as MAVLink 2 and exit')
+    parser.add_argument('--mavlink', default=None, help='MAVLink UDP connection string, e.g. udpin:0.0.0.0:14550')
+    parser.add_argument('--haptics', default=None, metavar='HOST:PORT', help='Touchpad to exchange with')
+    parser.add_argument('--haptics-transport', choices=['tcp', 'udp'], default='tcp')
+    parser.add_argument('--interval', type=float, default=2, help='Seconds between reports')
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(0 if check_rc_override() else 1)
+    core = NetCore()
+    if args.mavlink:
+        core.add(MavlinkEndpoint(args.mavlink))
+    if args.haptics:
+        host, _, port = args.haptics.rpartition(':')
+        core.add(HapticsChannel(host, int(port), [0, 0], [0, 500], args.haptics_transport))
+    try:
+        while True:
+            time.sleep(args.interval)
+            print(core.summary())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        core.close()
+
+
+if __name__ == '__main__':
+    main()
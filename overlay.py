@@ -0,0 +1,119 @@
+'''Overlay layers composited into reused output buffers
+
+The loop used to copy every decoded frame twice (one copy for the operator's reticle
+view, one for the marker view) and draw straight into the copies. Instead:
+
+    StaticOverlay   drawn once per frame size into a cached, cropped pixel/mask pair
+                    (the reticle circles)
+    Layer           the per-frame dynamic drawing (marker outlines, axes) kept as a short
+                    list of draw calls rather than pixels
+    View            an output (user view, markup view, markup recording): the decoded frame
+                    plus its overlays, composited into the same buffer every time, and only
+                    when something actually displays or encodes it
+
+Raw, user and markup outputs therefore all share the one decoded frame.
+'''
+
+import threading
+
+import cv2
+import numpy as np
+
+
+class StaticOverlay():
+    """Overlay that never changes, rasterized once per frame size
+
+    Only the bounding box of what was drawn is kept, with a mask of the drawn pixels, so
+    compositing touches that box and nothing else.
+    """
+
+    def __init__(self, draw):
+        """Summary
+
+        Args:
+            draw (callable): draw(image) draws the overlay onto a black BGR image
+        """
+        self.draw = draw
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def raster(self, shape):
+        """(y0, x0, pixels, mask) for a frame shape, drawn on first use"""
+        with self.lock:
+            raster = self.cache.get(shape)
+            if raster is None:
+                canvas = np.zeros(shape, dtype=np.uint8)
+                self.draw(canvas)
+                drawn = canvas.any(axis=2) if canvas.ndim == 3 else canvas > 0
+                ys, xs = np.nonzero(drawn)
+                if len(ys) == 0:
+                    raster = (0, 0, canvas[:0, :0], drawn[:0, :0])
+                else:
+                    y0, y1, x0, x1 = ys.min(), ys.max() + 1, xs.min(), xs.max() + 1
+                    mask = drawn[y0:y1, x0:x1]
+                    raster = (y0, x0, canvas[y0:y1, x0:x1].copy(),
+                              mask[:, :, None] if canvas.ndim == 3 else mask.copy())
+                self.cache[shape] = raster
+            return raster
+
+    def apply(self, out):
+        y0, x0, pixels, mask = self.raster(out.shape)
+        np.copyto(out[y0:y0 + pixels.shape[0], x0:x0 + pixels.shape[1]], pixels, where=mask)
+
+
+def reticle(radius, thickness, color=(0, 0, 255), center=(640, 360)):
+    """Circle overlay, e.g. reticle(80, 5) for the operator view"""
+    return StaticOverlay(lambda image: cv2.circle(image, center, radius, color, thickness))
+
+
+class Layer():
+    """Dynamic drawing for one frame, recorded as draw calls
+
+    Layers are handed to other threads (the recorder) as they are, so build a new one
+    per frame instead of clearing it.
+    """
+
+    def __init__(self):
+        self.ops = []
+
+    def draw(self, function, *args):
+        """Record function(image, *args), e.g. layer.draw(draw_markers, corners, rvecs, tvecs, k, d)"""
+        self.ops.append((function, args))
+
+    def apply(self, out):
+        for function, args in self.ops:
+            function(out, *args)
+
+
+class View():
+    """One composited output with its own reused buffer
+
+    A View is used from one thread only, its buffer is overwritten by the next render(),
+    so callers keeping a frame around (stills) copy it.
+
+    Attributes:
+        overlays (list): Static overlays, composited over the dynamic layers
+        renders (int): Frames composited
+    """
+
+    def __init__(self, overlays=()):
+        self.overlays = list(overlays)
+        self.buffer = None
+        self.renders = 0
+
+    def render(self, frame, *layers):
+        """Composite frame, layers and the static overlays
+
+        Returns:
+            np.ndarray: The view's buffer
+        """
+        if self.buffer is None or self.buffer.shape != frame.shape:
+            self.buffer = np.empty_like(frame)
+        np.copyto(self.buffer, frame)
+        for layer in layers:
+            if layer is not None:
+                layer.apply(self.buffer)
+        for overlay in self.overlays:
+            overlay.apply(self.buffer)
+        self.renders += 1
+        return self.buffer
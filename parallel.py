@@ -0,0 +1,399 @@
+'''Process-parallel station: vision/recording and the touchpad link in their own processes
+
+Frames move between processes through FrameRing, a ring of frame slots in
+multiprocessing.shared_memory, so the GUI process reads decoded and annotated frames
+without them being pickled or copied. Small state travels the cheapest way available:
+the pose rides in the frame slot header, hapticsIn/hapticsOut are shared arrays and
+recording commands go over a queue.
+'''
+
+import multiprocessing
+import pickle
+import queue
+import socket
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class FrameRing():
+    """Ring of fixed-size frames in shared memory
+
+    Single writer, any number of readers. Each slot has a sequence number which is set
+    to -1 while the slot is being written, so a reader can check a frame it has been
+    looking at was not overwritten underneath it (valid()).
+
+    Attributes:
+        shape (tuple): Frame shape, e.g. (720, 1280, 3)
+        slots (int): Number of frames held
+        meta (int): Number of float64 values stored alongside each frame
+        seqs (np.ndarray): [latest seq, slot 0 seq, slot 1 seq, ...]
+        stamps (np.ndarray): Per slot [timestamp, meta...]
+        frames (np.ndarray): Per slot frame views into the shared block
+    """
+
+    def __init__(self, shape, slots=4, meta=0, name=None):
+        """Summary
+
+        Args:
+            shape (tuple): Frame shape
+            slots (int, optional): Number of frames held
+            meta (int, optional): Number of float64 values stored with each frame
+            name (str, optional): Attach to an existing ring instead of creating one
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.meta = meta
+        self.owner = name is None
+
+        seqBytes = 8 * (1 + slots)
+        stampBytes = 8 * slots * (1 + meta)
+        frameBytes = int(np.prod(self.shape))
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner,
+                                              size=seqBytes + stampBytes + slots * frameBytes)
+
+        self.seqs = np.ndarray((1 + slots,), dtype=np.int64, buffer=self.shm.buf)
+        self.stamps = np.ndarray((slots, 1 + meta), dtype=np.float64, buffer=self.shm.buf, offset=seqBytes)
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf,
+                                 offset=seqBytes + stampBytes)
+        if self.owner:
+            self.seqs[:] = -1
+
+    def spec(self):
+        """Arguments needed to attach to this ring from another process"""
+        return {'shape': self.shape, 'slots': self.slots, 'meta': self.meta, 'name': self.shm.name}
+
+    def begin(self, seq=None):
+        """Claim the slot for the next frame and return (seq, writable view)
+
+        Use when the producer can build the frame in place; finish with commit().
+        """
+        if seq is None:
+            seq = int(self.seqs[0]) + 1
+        slot = seq % self.slots
+        self.seqs[1 + slot] = -1
+        return seq, self.frames[slot]
+
+    def commit(self, seq, timestamp, meta=()):
+        slot = seq % self.slots
+        self.stamps[slot, 0] = timestamp
+        if len(meta):
+            self.stamps[slot, 1:1 + len(meta)] = meta
+        self.seqs[1 + slot] = seq
+        self.seqs[0] = seq
+
+    def write(self, frame, timestamp, meta=(), seq=None):
+        """Copy frame into the next slot, returns its sequence number"""
+        seq, slotFrame = self.begin(seq)
+        np.copyto(slotFrame, frame)
+        self.commit(seq, timestamp, meta)
+        return seq
+
+    def latest_seq(self):
+        return int(self.seqs[0])
+
+    def read(self, seq=None):
+        """Zero-copy view of a frame
+
+        Args:
+            seq (int, optional): Sequence number to read, defaults to the latest
+
+        Returns:
+            tuple: (seq, frame view, [timestamp, meta...]) or None if unavailable
+        """
+        if seq is None:
+            seq = self.latest_seq()
+        if seq < 0 or not self.valid(seq):
+            return None
+        slot = seq % self.slots
+        return seq, self.frames[slot], self.stamps[slot].copy()
+
+    def valid(self, seq):
+        """True while the frame with this sequence number has not been overwritten"""
+        return int(self.seqs[1 + seq % self.slots]) == seq
+
+    def close(self):
+        # numpy views hold exports of the buffer, drop them before closing
+        self.seqs = self.stamps = self.frames = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def visionWorker(rawSpec, markupSpec, port, tagSize, commands, profile='default'):
+    """Vision process: decode video, detect tags, record, publish frames
+
+    Args:
+        rawSpec (dict): FrameRing.spec() of the raw frame ring
+        markupSpec (dict): FrameRing.spec() of the annotated frame ring (meta = tvec + rvec)
+        port (int): Video UDP port
+        tagSize (float): Initial tag size in m
+        commands (Queue): ('tag', size), ('record', rawFile, markupFile, fps), ('stop',), ('quit',)
+        profile (str, optional): Video pipeline profile
+    """
+    import cv2
+    from utils import ARUCO_DICT
+    from video import Video
+    from vision import pose_esitmation
+    from overlay import reticle
+
+    raw = FrameRing(**rawSpec)
+    markup = FrameRing(**markupSpec)
+    height, width = raw.shape[:2]
+
+    aruco_dict_type = ARUCO_DICT['DICT_4X4_100']
+    k = np.load("calibration_matrix.npy")
+    d = np.load("distortion_coefficients.npy")
+    markupReticle = reticle(100, 10)
+
+    video = Video(port=port, profile=profile)
+    rawVideoLog = None
+    markupVideoLog = None
+
+    running = True
+    while running:
+        try:
+            while True:
+                command = commands.get_nowait()
+                if command[0] == 'tag':
+                    tagSize = command[1]
+                elif command[0] == 'record':
+                    rawVideoLog = cv2.VideoWriter(command[1], cv2.VideoWriter_fourcc(*'MJPG'), command[3], (width, height))
+                    markupVideoLog = cv2.VideoWriter(command[2], cv2.VideoWriter_fourcc(*'MJPG'), command[3], (width, height))
+                elif command[0] == 'stop':
+                    if rawVideoLog is not None:
+                        rawVideoLog.release()
+                        markupVideoLog.release()
+                    rawVideoLog = markupVideoLog = None
+                elif command[0] == 'quit':
+                    running = False
+        except queue.Empty:
+            pass
+
+        if not video.frame_available():
+            time.sleep(0.001)
+            continue
+
+        frame = video.frame()
+        if frame.shape != raw.shape:
+            frame = cv2.resize(frame, (width, height))
+        timestamp = time.perf_counter()
+        seq = raw.write(frame, timestamp)
+        if rawVideoLog is not None:
+            rawVideoLog.write(frame)
+
+        # annotate straight into the shared slot, no intermediate copy
+        seq, tagFrame = markup.begin(seq)
+        np.copyto(tagFrame, frame)
+        tagFrame, tvec, rvec = pose_esitmation(tagFrame, aruco_dict_type, k, d, tagSize)
+        markupReticle.apply(tagFrame)
+        markup.commit(seq, timestamp, list(tvec) + list(rvec))
+        if markupVideoLog is not None:
+            markupVideoLog.write(tagFrame)
+
+    if rawVideoLog is not None:
+        rawVideoLog.release()
+        markupVideoLog.release()
+    raw.close()
+    markup.close()
+
+
+def hapticsWorker(host, port, hapticsIn, hapticsOut, hapticsRTT, connected, timeout, stamp, reconnects, retry=1.0):
+    """Touchpad process: same lock-step exchange as netcore.HapticsChannel, over shared arrays
+
+    The link is reopened whenever it drops, stalls for timeout or sends something that
+    is not [position, force], as the in-process channel does.
+
+    Args:
+        host (str): Touchpad address
+        port (int): Touchpad TCP port
+        hapticsIn (Array): [position, force] from the touchpad
+        hapticsOut (Array): [vibration, hardness] to the touchpad
+        hapticsRTT (Value): Latest exchange round-trip time in s
+        connected (Value): 1 while the touchpad link is up, 0 while it is being reopened
+        timeout (float): Connection and reply timeout in s
+        stamp (Value): perf_counter of the latest reply (the clock is system wide)
+        reconnects (Value): Times the link was lost and reopened
+        retry (float, optional): Wait before reconnecting, s
+    """
+    while True:
+        haptics = None
+        try:
+            haptics = socket.create_connection((host, port), timeout=timeout)
+            haptics.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connected.value = 1
+            print("Connected to haptics!")
+
+            while True:
+                sentTime = time.perf_counter()
+                haptics.sendall(pickle.dumps(list(hapticsOut)))
+
+                reply = haptics.recv(128)
+                if not reply:
+                    raise EOFError('touchpad closed the connection')
+                hapticDataIn = pickle.loads(reply)
+                if not isinstance(hapticDataIn, (list, tuple)) or len(hapticDataIn) != 2:
+                    raise ValueError(f'expected [position, force], got {hapticDataIn!r:.60}')
+                hapticsRTT.value = time.perf_counter() - sentTime
+                hapticsIn[0] = hapticDataIn[0]
+                hapticsIn[1] = hapticDataIn[1]
+                stamp.value = time.perf_counter()
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError) as e:
+            if connected.value:
+                reconnects.value += 1
+                print(f"haptics link lost ({type(e).__name__}: {e}), reconnecting")
+            connected.value = 0
+        finally:
+            if haptics is not None:
+                haptics.close()
+        time.sleep(retry)
+
+
+class VisionLink():
+    """GUI-side handle on the vision process
+
+    Attributes:
+        raw (FrameRing): Raw decoded frames
+        markup (FrameRing): Annotated frames, meta holds tvec and rvec
+        commands (Queue): Commands to the vision process
+        process (Process): The vision process
+    """
+
+    def __init__(self, port=5600, tagSize=1.12, shape=(720, 1280, 3), slots=4, profile='default'):
+        ctx = multiprocessing.get_context('spawn')
+        self.raw = FrameRing(shape, slots)
+        self.markup = FrameRing(shape, slots, meta=6)
+        self.commands = ctx.Queue()
+        self.tagSize = tagSize
+        self.lastSeq = -1
+        # GUI-owned (raw, markup) copies, two pairs so the one handed out is never written into
+        self.buffers = [(np.empty(shape, np.uint8), np.empty(shape, np.uint8)) for _ in range(2)]
+        self.current = 0
+        self.torn = 0
+        self.process = ctx.Process(target=visionWorker,
+                                   args=(self.raw.spec(), self.markup.spec(), port, tagSize, self.commands, profile),
+                                   name='vision')
+        self.process.daemon = True
+        self.process.start()
+
+    def frame_available(self):
+        return self.markup.latest_seq() > self.lastSeq
+
+    def wait_first_frame(self, timeout):
+        """Block until the vision process has published a frame
+
+        Raises:
+            TimeoutError: no frame within timeout
+        """
+        deadline = time.perf_counter() + timeout
+        while self.markup.latest_seq() < 0:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f'no video frame after {timeout}s')
+            time.sleep(0.01)
+        return self
+
+    def latest(self):
+        """Latest frame pair and pose
+
+        The frames are copied out of the rings, which the vision process may overwrite at
+        any time, and dropped (counted in torn) if it did so during the copy. The copies
+        stay valid until the next call but one, so the frames handed out last time are
+        never written into.
+
+        Returns:
+            tuple: (frame, tagFrame, tvec, rvec), or None if there is no complete frame
+        """
+        markup = self.markup.read()
+        if markup is None:
+            return None
+        seq, tagFrame, stamps = markup
+        raw = self.raw.read(seq)
+        if raw is None:
+            return None
+        spare = 1 - self.current
+        frame, markupFrame = self.buffers[spare]
+        np.copyto(frame, raw[1])
+        np.copyto(markupFrame, tagFrame)
+        if not (self.raw.valid(seq) and self.markup.valid(seq)):
+            self.torn += 1
+            return None
+        self.current = spare
+        self.lastSeq = seq
+        return frame, markupFrame, stamps[1:4], stamps[4:7]
+
+    def last_frame_time(self):
+        """perf_counter when the vision process published its latest frame, None before the first"""
+        seq = self.raw.latest_seq()
+        if seq < 0:
+            return None
+        return float(self.raw.stamps[seq % self.raw.slots, 0])
+
+    def set_tag_size(self, tagSize):
+        self.tagSize = tagSize
+        self.commands.put(('tag', tagSize))
+
+    def start_recording(self, rawVideoFilename, markupVideoFilename, fps):
+        self.commands.put(('record', rawVideoFilename, markupVideoFilename, fps))
+
+    def stop_recording(self):
+        self.commands.put(('stop',))
+
+    def close(self):
+        self.commands.put(('quit',))
+        self.process.join(timeout=2)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.raw.close()
+        self.markup.close()
+
+
+class HapticsLink():
+    """GUI-side handle on the touchpad process
+
+    hapticsIn and hapticsOut are shared arrays indexed exactly like the lists used by
+    hapticsThread, so the main loop reads and writes them unchanged.
+    """
+
+    def __init__(self, host, port, timeout=5):
+        self.ctx = multiprocessing.get_context('spawn')
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.hapticsIn = self.ctx.Array('d', [0, 0], lock=False)
+        self.hapticsOut = self.ctx.Array('i', [0, 500], lock=False)
+        self.rtt = self.ctx.Value('d', 0.0, lock=False)
+        self.connected = self.ctx.Value('i', 0, lock=False)
+        self.stamp = self.ctx.Value('d', 0.0, lock=False)
+        self.reconnects = self.ctx.Value('i', 0, lock=False)
+        self.process = None
+        self.start()
+
+    def start(self):
+        """(Re)start the touchpad process, the shared arrays are kept"""
+        self.connected.value = 0
+        self.process = self.ctx.Process(target=hapticsWorker,
+                                        args=(self.host, self.port, self.hapticsIn, self.hapticsOut,
+                                              self.rtt, self.connected, self.timeout, self.stamp, self.reconnects),
+                                        name='haptics')
+        self.process.daemon = True
+        self.process.start()
+
+    def wait_connected(self):
+        """Block until the touchpad process is connected
+
+        Raises:
+            TimeoutError: not connected within the timeout (process gave up or is still trying)
+        """
+        deadline = time.perf_counter() + self.timeout + 1
+        while time.perf_counter() < deadline:
+            if self.connected.value:
+                return self
+            if not self.process.is_alive():
+                break
+            time.sleep(0.01)
+        raise TimeoutError(f'touchpad {self.host}:{self.port} not connected')
+
+    def close(self):
+        self.process.terminate()
+        self.process.join(timeout=2)
@@ -0,0 +1,311 @@
+'''Background video recording, pre-trigger buffer and still/clip export
+
+Encoding and writing video files used to happen on the loop thread (VideoWriter.write,
+cv2.imwrite for stills), and nothing from before Start was kept. Recorder moves all of
+it onto one worker thread fed by a queue that the loop never waits on, and keeps the
+last few seconds of frames JPEG-compressed in a PretriggerBuffer so they can be written
+at the head of a trial recording or exported as a clip.
+
+Frames, stills and clips are bounded by the bytes they hold and dropped when the worker
+is behind, so the recorder's memory stays within the queue budget plus the pre-trigger
+budget however slow the disk gets. Control jobs
+(start, prepare, discard, stop) share the queue, so they stay in order with the frames,
+but are never bounded: Start and Stop must neither block nor be lost.
+'''
+
+import collections
+import os
+import queue
+import threading
+import time
+
+import cv2
+
+from overlay import Layer, View
+
+
+class PretriggerBuffer():
+    """Last N seconds of raw frames, JPEG compressed, within a memory budget
+
+    Markup is kept as the frame's overlay layer and only composited when the buffer is
+    written out, so a station that never records pays one JPEG encode per frame, not two.
+    Only touched by the Recorder's worker thread.
+
+    Attributes:
+        seconds (float): Longest span kept
+        budget (int): Most compressed bytes kept
+        quality (int): JPEG quality
+        entries (collections.deque): (timestamp, raw jpeg, markup layer or jpeg, frame id), oldest first
+        bytes (int): Compressed bytes held
+    """
+
+    def __init__(self, seconds=5, budgetMB=64, quality=85):
+        self.seconds = seconds
+        self.budget = int(budgetMB * 1e6)
+        self.quality = quality
+        self.entries = collections.deque()
+        self.bytes = 0
+
+    def add(self, timestamp, raw, markup, frameId=None):
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        rawJpeg = cv2.imencode('.jpg', raw, params)[1]
+        if not isinstance(markup, Layer):
+            # an already composited frame has to be kept as pixels
+            markup = cv2.imencode('.jpg', markup, params)[1]
+        self.entries.append((timestamp, rawJpeg, markup, frameId))
+        self.bytes += self._size(self.entries[-1])
+        # evict by age, then by size
+        while self.entries and (timestamp - self.entries[0][0] > self.seconds or self.bytes > self.budget):
+            self.bytes -= self._size(self.entries.popleft())
+
+    @staticmethod
+    def _size(entry):
+        return entry[1].nbytes + (0 if isinstance(entry[2], Layer) else entry[2].nbytes)
+
+    def frames(self, view):
+        """Decoded (timestamp, raw, markup, frame id) frames, oldest first
+
+        Args:
+            view (overlay.View): Composites the markup of frames buffered with their layer, its
+                buffer is reused so markup is only valid until the next frame
+        """
+        for timestamp, rawJpeg, markup, frameId in list(self.entries):
+            raw = cv2.imdecode(rawJpeg, cv2.IMREAD_COLOR)
+            if isinstance(markup, Layer):
+                markup = view.render(raw, markup)
+            else:
+                markup = cv2.imdecode(markup, cv2.IMREAD_COLOR)
+            yield timestamp, raw, markup, frameId
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def span(self):
+        return self.entries[-1][0] - self.entries[0][0] if len(self.entries) > 1 else 0.0
+
+
+class Recorder():
+    """Worker thread that owns the trial video files, the pre-trigger buffer and exports
+
+    Every method only queues a job and returns straight away. When the frames and stills
+    already waiting hold queueMB the job is dropped and counted, so a slow disk costs
+    recorded frames, not loop time or memory. Control jobs are never dropped or waited on.
+
+    Attributes:
+        pretrigger (PretriggerBuffer): None when disabled
+        dropped (dict): Jobs dropped per kind because the queue was full
+        queueBudget (int): Most frame and still bytes waiting for the worker
+        queued (int): Frame and still bytes waiting for the worker
+        written (int): Frames written to trial recordings
+        prepended (int): Pre-trigger frames written at the head of recordings
+        prepared (tuple): (raw filename, markup filename, raw writer, markup writer) opened by prepare()
+    """
+
+    def __init__(self, pretriggerSeconds=5, pretriggerMB=64, queueMB=64, overlays=()):
+        """Summary
+
+        Args:
+            pretriggerSeconds (float, optional): Seconds kept before Start, 0 disables the buffer
+            pretriggerMB (float, optional): Memory budget of the pre-trigger buffer
+            queueMB (float, optional): Memory budget of the frames and stills waiting for the worker
+            overlays (tuple, optional): Static overlays of the markup recording, see frame()
+        """
+        self.pretrigger = PretriggerBuffer(pretriggerSeconds, pretriggerMB) if pretriggerSeconds > 0 else None
+        # unbounded so control jobs never block, the data jobs are bounded by queueBudget
+        self.jobs = queue.Queue()
+        self.queueBudget = int(queueMB * 1e6)
+        self.queued = 0
+        self.queueLock = threading.Lock()
+        self.dropped = collections.Counter()
+        self.written = 0
+        self.prepended = 0
+        self.recording = False
+        self.rawVideoLog = None
+        self.markupVideoLog = None
+        self.onFrame = None
+        self.videoIndex = 0
+        self.prepared = None
+        self.markupView = View(overlays)
+        self.thread = threading.Thread(target=self._run, name='recorder')
+        self.thread.daemon = True
+        self.thread.start()
+
+    @staticmethod
+    def _nbytes(job):
+        if job[0] == 'frame':
+            # a Layer markup is a few draw calls
+            return job[2].nbytes + getattr(job[3], 'nbytes', 0)
+        if job[0] == 'still':
+            return job[2].nbytes
+        return 0
+
+    def _submit(self, *job):
+        size = self._nbytes(job)
+        with self.queueLock:
+            # an empty queue takes any job, so an oversized frame is not dropped forever
+            if self.queued and self.queued + size > self.queueBudget:
+                self.dropped[job[0]] += 1
+                return False
+            self.queued += size
+        self.jobs.put(job)
+        return True
+
+    def _control(self, *job):
+        self.jobs.put(job)
+
+    def frame(self, raw, markup, frameId=None, timestamp=None):
+        """Queue a frame pair for the pre-trigger buffer and, while recording, the video files
+
+        The arrays are kept as they are, callers must not modify them afterwards.
+
+        Args:
+            raw (np.ndarray): Raw frame
+            markup (np.ndarray or overlay.Layer): Annotated frame, or the frame's overlay layer to be
+                composited with the static overlays on the worker thread
+            frameId (int, optional): Station frame number, reported back by the start() onFrame callback
+            timestamp (float, optional): perf_counter of the frame, defaults to now
+        """
+        if self.pretrigger is not None or self.recording:
+            timestamp = time.perf_counter() if timestamp is None else timestamp
+            self._submit('frame', timestamp, raw, markup, frameId)
+
+    def start(self, rawVideoFilename, markupVideoFilename, fps, size=(1280, 720), prepend=True, onFrame=None):
+        """Open the trial recordings, headed by the pre-trigger frames if prepend
+
+        Args:
+            onFrame (callable, optional): onFrame(frameId, videoIndex, timestamp) for every frame
+                actually written, on the worker thread
+        """
+        self.recording = True
+        self._control('start', rawVideoFilename, markupVideoFilename, fps, size, prepend, onFrame)
+
+    def prepare(self, rawVideoFilename, markupVideoFilename, fps, size=(1280, 720)):
+        """Open the next recordings ahead of time, a start() with the same filenames then uses them"""
+        self._control('prepare', rawVideoFilename, markupVideoFilename, fps, size)
+
+    def discard(self):
+        """Release and delete prepared recordings that were never started"""
+        self._control('discard')
+
+    def stop(self, onStopped=None):
+        """Close the trial recordings, then call onStopped() on the worker thread"""
+        self.recording = False
+        self._control('stop', onStopped)
+
+    def still(self, filename, frame):
+        """Write a JPEG still in the background"""
+        return self._submit('still', filename, frame)
+
+    def clip(self, prefix, fps=17.4, size=(1280, 720)):
+        """Export the pre-trigger buffer as <prefix>_raw.avi and <prefix>_markup.avi"""
+        return self._submit('clip', prefix, fps, size)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            kind = job[0]
+            if kind == 'frame':
+                timestamp, raw, markup, frameId = job[1:]
+                if self.rawVideoLog is not None:
+                    if isinstance(markup, Layer):
+                        markup = self.markupView.render(raw, markup)
+                    self._write(self.rawVideoLog, self.markupVideoLog, raw, markup, frameId, timestamp)
+                    self.written += 1
+                elif self.pretrigger is not None:
+                    # not while recording, the recording itself has those frames
+                    self.pretrigger.add(timestamp, raw, markup, frameId)
+            elif kind == 'start':
+                rawVideoFilename, markupVideoFilename, fps, size, prepend, self.onFrame = job[1:]
+                if self.prepared is not None and self.prepared[:2] == (rawVideoFilename, markupVideoFilename):
+                    self.rawVideoLog, self.markupVideoLog = self.prepared[2:]
+                    self.prepared = None
+                else:
+                    self.rawVideoLog, self.markupVideoLog = self._open(rawVideoFilename, markupVideoFilename, fps, size)
+                self.videoIndex = 0
+                if prepend and self.pretrigger is not None:
+                    self.prepended += self._write_pretrigger(self.rawVideoLog, self.markupVideoLog, size, self.onFrame)
+                if self.pretrigger is not None:
+                    self.pretrigger.clear()
+            elif kind == 'stop':
+                self._close()
+                self.onFrame = None
+                if job[1] is not None:
+                    job[1]()
+            elif kind == 'prepare':
+                self._discard()
+                rawVideoFilename, markupVideoFilename, fps, size = job[1:]
+                self.prepared = (rawVideoFilename, markupVideoFilename) + self._open(rawVideoFilename,
+                                                                                     markupVideoFilename, fps, size)
+            elif kind == 'discard':
+                self._discard()
+            elif kind == 'still':
+                cv2.imwrite(job[1], job[2])
+            elif kind == 'clip':
+                prefix, fps, size = job[1:]
+                if self.pretrigger is not None:
+                    raw, markup = self._open(prefix + '_raw.avi', prefix + '_markup.avi', fps, size)
+                    count = self._write_pretrigger(raw, markup, size)
+                    raw.release()
+                    markup.release()
+                    print(f"Saved {count} frame clip {prefix}")
+            size = self._nbytes(job)
+            if size:
+                with self.queueLock:
+                    self.queued -= size
+        self._close()
+        self._discard()
+
+    @staticmethod
+    def _open(rawVideoFilename, markupVideoFilename, fps, size):
+        return (cv2.VideoWriter(rawVideoFilename, cv2.VideoWriter_fourcc(*'MJPG'), fps, size),
+                cv2.VideoWriter(markupVideoFilename, cv2.VideoWriter_fourcc(*'MJPG'), fps, size))
+
+    def _write(self, rawWriter, markupWriter, raw, markup, frameId, timestamp):
+        rawWriter.write(raw)
+        markupWriter.write(markup)
+        if self.onFrame is not None:
+            self.onFrame(frameId, self.videoIndex, timestamp)
+        self.videoIndex += 1
+
+    def _write_pretrigger(self, rawWriter, markupWriter, size, onFrame=None):
+        count = 0
+        for timestamp, raw, markup, frameId in self.pretrigger.frames(self.markupView):
+            if (raw.shape[1], raw.shape[0]) != size:
+                raw = cv2.resize(raw, size)
+                markup = cv2.resize(markup, size)
+            if onFrame is not None:
+                self._write(rawWriter, markupWriter, raw, markup, frameId, timestamp)
+            else:
+                rawWriter.write(raw)
+                markupWriter.write(markup)
+            count += 1
+        return count
+
+    def _close(self):
+        if self.rawVideoLog is not None:
+            self.rawVideoLog.release()
+            self.markupVideoLog.release()
+        self.rawVideoLog = self.markupVideoLog = None
+
+    def _discard(self):
+        if self.prepared is not None:
+            for filename, writer in zip(self.prepared[:2], self.prepared[2:]):
+                writer.release()
+                if os.path.exists(filename):
+                    os.remove(filename)
+        self.prepared = None
+
+    def memory(self):
+        """Pre-trigger buffer (MB held, seconds held)"""
+        if self.pretrigger is None:
+            return 0.0, 0.0
+        return self.pretrigger.bytes / 1e6, self.pretrigger.span()
+
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join(timeout=10)
+        if sum(self.dropped.values()):
+            print(f"recorder: dropped {dict(self.dropped)}")
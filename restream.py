@@ -0,0 +1,266 @@
+'''Re-stream a station view to secondary displays, encoded once for every viewer
+
+The markup and user views only existed as GUI canvases, so observers had to crowd
+around the operator laptop. Restreamer pushes the composited view into a GStreamer
+appsrc, scales and H.264-encodes it once and hands the RTP packets to a multiudpsink
+that sends the same packets to every viewer, so adding a viewer costs a socket send,
+not an encoder. The loop only copies the view into a buffer and pushes it; a leaky
+queue in front of the encoder drops frames rather than letting the encoder hold the
+loop up.
+
+Pad probes around the encoder time every frame:
+    encode      encoder input to encoder output
+    latency     push from the loop to the first RTP packet of the frame reaching the sink
+    load        encode time per second of wall time (1.0 = one core busy encoding)
+
+View it on any machine on the network with
+
+    gst-launch-1.0 udpsrc port=5700 ! application/x-rtp,payload=96 ! rtph264depay ! avdec_h264 \\
+        ! videoconvert ! autovideosink sync=false
+
+and check it end to end against a local udpsrc receiver with
+
+    python restream.py --test --seconds 10 --viewers 3
+'''
+
+import argparse
+import collections
+import threading
+import time
+
+import numpy as np
+
+import video
+
+
+def parse_viewer(target):
+    """'host:port' or 'udp:host:port' -> (host, port)"""
+    if target.startswith('udp:'):
+        target = target[4:]
+    host, _, port = target.rpartition(':')
+    return host or '127.0.0.1', int(port)
+
+
+class Restreamer():
+    """Shared H.264 encoder fanned out to any number of RTP/UDP viewers
+
+    Attributes:
+        viewers (list): (host, port) pairs currently sent to
+        width, height (int): Streamed resolution, frames are scaled by GStreamer
+        fps (float): Most frames pushed per second
+        bitrate (int): Encoder bitrate, kbit/s
+        pushed (int): Frames pushed by the loop
+        encoded (int): Frames out of the encoder, the rest were dropped in front of it
+        encodeTimes (collections.deque): Recent encode times, s
+        latencies (collections.deque): Recent push to sink times, s
+    """
+
+    def __init__(self, viewers, width=1280, height=720, fps=15, bitrate=2000, sourceSize=(1280, 720)):
+        """Summary
+
+        Args:
+            viewers (list): 'host:port' strings
+            width (int, optional): Streamed width
+            height (int, optional): Streamed height
+            fps (float, optional): Streamed frame rate, extra frames are not pushed
+            bitrate (int, optional): kbit/s
+            sourceSize (tuple, optional): Size of the frames expected, the caps follow the frames pushed
+        """
+        self.Gst = video.load_gst()
+        self.viewers = []
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.bitrate = bitrate
+        self.sourceSize = sourceSize
+        self.pushed = 0
+        self.encoded = 0
+        self.encodeTimes = collections.deque(maxlen=300)
+        self.latencies = collections.deque(maxlen=300)
+        self.encodeTotal = 0.0
+        self.encoderIn = {}
+        self.sent = set()
+        self.lock = threading.Lock()
+        self.startTime = time.perf_counter()
+        self.lastPush = None
+        self.pipeline_description = ' '.join([
+            'appsrc name=src is-live=true format=time',
+            f'caps={self._caps(sourceSize)}',
+            '! queue leaky=downstream max-size-buffers=1',
+            f'! videoscale ! videoconvert ! video/x-raw,format=I420,width={width},height={height}',
+            f'! x264enc name=encoder tune=zerolatency speed-preset=ultrafast bitrate={bitrate} key-int-max={int(fps)}',
+            '! rtph264pay config-interval=1 pt=96',
+            '! multiudpsink name=sink sync=false async=false',
+        ])
+        self.video_pipe = self.Gst.parse_launch(self.pipeline_description)
+        self.source = self.video_pipe.get_by_name('src')
+        self.sink = self.video_pipe.get_by_name('sink')
+        encoder = self.video_pipe.get_by_name('encoder')
+        encoder.get_static_pad('sink').add_probe(self.Gst.PadProbeType.BUFFER, self._encoder_in)
+        encoder.get_static_pad('src').add_probe(self.Gst.PadProbeType.BUFFER, self._encoder_out)
+        self.sink.get_static_pad('sink').add_probe(self.Gst.PadProbeType.BUFFER, self._sink_in)
+        for viewer in viewers:
+            self.add_viewer(viewer)
+        self.video_pipe.set_state(self.Gst.State.PLAYING)
+
+    def _caps(self, size):
+        return f'video/x-raw,format=BGR,width={size[0]},height={size[1]},framerate={int(self.fps)}/1'
+
+    def add_viewer(self, target):
+        host, port = parse_viewer(target)
+        self.sink.emit('add', host, port)
+        self.viewers.append((host, port))
+
+    def remove_viewer(self, target):
+        host, port = parse_viewer(target)
+        self.sink.emit('remove', host, port)
+        self.viewers.remove((host, port))
+
+    def due(self, now=None):
+        """True if a frame should be pushed now, check before rendering a view just for the stream"""
+        now = time.perf_counter() if now is None else now
+        return self.lastPush is None or now - self.lastPush >= 1.0 / self.fps
+
+    def push(self, frame):
+        """Queue a frame for the encoder, skipped above the stream's frame rate
+
+        Args:
+            frame (np.ndarray): BGR frame, may be reused by the caller afterwards
+        """
+        now = time.perf_counter()
+        if not self.due(now):
+            return False
+        size = (frame.shape[1], frame.shape[0])
+        if size != self.sourceSize:
+            # e.g. a lower resolution video profile, videoscale renegotiates behind the new caps
+            print(f"restream: frames are {size[0]}x{size[1]}, not {self.sourceSize[0]}x{self.sourceSize[1]}, "
+                  f"switching the source caps")
+            self.source.set_property('caps', self.Gst.Caps.from_string(self._caps(size)))
+            self.sourceSize = size
+        self.lastPush = now
+        # the only copy, the caller's buffer is reused for the next frame
+        buffer = self.Gst.Buffer.new_wrapped(frame.tobytes())
+        # pts is the push time, so the probes get latency from it without a lookup
+        buffer.pts = int((now - self.startTime) * 1e9)
+        buffer.duration = int(1e9 / self.fps)
+        self.source.emit('push-buffer', buffer)
+        self.pushed += 1
+        return True
+
+    def _clock(self):
+        return int((time.perf_counter() - self.startTime) * 1e9)
+
+    def _encoder_in(self, pad, info):
+        with self.lock:
+            self.encoderIn[info.get_buffer().pts] = self._clock()
+        return self.Gst.PadProbeReturn.OK
+
+    def _encoder_out(self, pad, info):
+        pts = info.get_buffer().pts
+        with self.lock:
+            started = self.encoderIn.pop(pts, None)
+            if len(self.encoderIn) > 100:
+                # frames the encoder never returned (e.g. on a restart)
+                self.encoderIn.clear()
+        if started is not None:
+            elapsed = (self._clock() - started) / 1e9
+            self.encodeTimes.append(elapsed)
+            self.encodeTotal += elapsed
+            self.encoded += 1
+        return self.Gst.PadProbeReturn.OK
+
+    def _sink_in(self, pad, info):
+        # one frame is several RTP packets with the same pts, count the first
+        pts = info.get_buffer().pts
+        if pts not in self.sent:
+            self.sent.add(pts)
+            if len(self.sent) > 100:
+                self.sent = {pts}
+            self.latencies.append((self._clock() - pts) / 1e9)
+        return self.Gst.PadProbeReturn.OK
+
+    def report(self):
+        """Encoder load and latency since the start
+
+        Returns:
+            dict: pushed, encoded, dropped, load and encode/latency median and p95 in ms
+        """
+        elapsed = time.perf_counter() - self.startTime
+        result = {'viewers': len(self.viewers), 'pushed': self.pushed, 'encoded': self.encoded,
+                  'dropped': max(0, self.pushed - self.encoded), 'load': self.encodeTotal / max(elapsed, 1e-9)}
+        for name, values in (('encode', list(self.encodeTimes)), ('latency', list(self.latencies))):
+            values = np.array(values if values else [np.nan]) * 1000
+            result[name] = {'median': float(np.nanmedian(values)), 'p95': float(np.nanpercentile(values, 95))}
+        return result
+
+    def summary(self):
+        r = self.report()
+        return (f"{r['viewers']} viewers, {r['encoded']}/{r['pushed']} frames encoded, load {r['load'] * 100:0.0f}%, "
+                f"encode {r['encode']['median']:0.1f}ms (p95 {r['encode']['p95']:0.1f}), "
+                f"push to wire {r['latency']['median']:0.1f}ms (p95 {r['latency']['p95']:0.1f})")
+
+    def stop(self):
+        if self.video_pipe is not None:
+            self.source.emit('end-of-stream')
+            self.video_pipe.set_state(self.Gst.State.NULL)
+            self.video_pipe = None
+
+
+def test(seconds=10, viewers=2, basePort=5710, width=1280, height=720, fps=15, bitrate=2000):
+    """Re-stream time-stamped frames to local udpsrc receivers and measure each of them
+
+    Every viewer gets the same encoded packets, so all receivers should see the same
+    frames with the same glass-to-glass latency while the encoder load stays that of one
+    stream.
+    """
+    from latency import stamp_frame, read_stamp, now_ms, MASK
+    from video import Video
+
+    targets = [f'127.0.0.1:{basePort + i}' for i in range(viewers)]
+    receivers = [Video(port=basePort + i, profile='low-latency') for i in range(viewers)]
+    restreamer = Restreamer(targets, width, height, fps, bitrate)
+    background = np.full((720, 1280, 3), 90, dtype=np.uint8)
+    frame = np.empty_like(background)
+    glass = [[] for _ in receivers]
+    startTime = time.perf_counter()
+    while time.perf_counter() - startTime < seconds:
+        if restreamer.due():
+            np.copyto(frame, background)
+            # the stamp blocks scale with the stream, keep them readable at lower resolutions
+            restreamer.push(stamp_frame(frame, now_ms(), block=40))
+        for i, receiver in enumerate(receivers):
+            if receiver.frame_available():
+                received = receiver.frame()
+                block = 40 * received.shape[1] // 1280
+                latency = (now_ms() - read_stamp(received, block)) & MASK
+                if latency < 5000:
+                    glass[i].append(latency)
+        time.sleep(0.001)
+    restreamer.stop()
+    for receiver in receivers:
+        receiver.stop()
+    print(restreamer.summary())
+    for target, values in zip(targets, glass):
+        values = np.array(values if values else [np.nan])
+        print(f"{target:>18}: {len(values)} frames, glass-to-glass median {np.nanmedian(values):0.1f}ms "
+              f"p95 {np.nanpercentile(values, 95):0.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Test the single-encode re-stream against local receivers')
+    parser.add_argument('--test', action='store_true', help='stream stamped frames to local udpsrc receivers')
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--viewers', type=int, default=2)
+    parser.add_argument('--port', type=int, default=5710, help='first receiver port')
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--fps', type=float, default=15)
+    parser.add_argument('--bitrate', type=int, default=2000, help='kbit/s')
+    args = parser.parse_args()
+    if not args.test:
+        parser.error('the station streams with --restream, use --test to try it out here')
+    test(args.seconds, args.viewers, args.port, args.width, args.height, args.fps, args.bitrate)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+'''Haptic scene: virtual zones, walls, waypoints and attractors that drive the touchpad cues
+
+A scene is a JSON file of objects placed in the pose space of an ArUco marker (the
+filtered tvec the station computes, x/y/z in m), each producing a vibration or hardness
+cue:
+
+    {
+      "cell": 0.5,
+      "objects": [
+        {"type": "zone", "anchor": 3, "center": [0, null, 3.9], "size": [2, null, 0.4], "cue": "vibration"},
+        {"type": "waypoint", "center": [0, null, 2], "radius": 0.5, "cue": "hardness", "value": 500},
+        {"type": "wall", "anchor": 5, "point": [1, 0, 3], "normal": [-1, 0, 0], "extent": 1, "range": 0.3,
+         "cue": "hardness"},
+        {"type": "attractor", "center": [0, 0, 2], "radius": 3, "cue": "vibration"}
+      ]
+    }
+
+zone       inside an axis-aligned box: full value
+waypoint   inside a sphere: value ramping from 0 at the surface to full at the center
+wall       within range in front of a disc (point, normal, extent): ramping up to full at
+           the surface and beyond it
+attractor  inside a sphere: value growing with the distance from the center, a pull back in
+
+"anchor" is the marker ID the object is placed relative to, objects without one apply to
+whichever marker is seen. A null coordinate leaves that axis unbounded and ignored, so
+[0, null, 2] is a vertical line and a null zone size an infinite slab.
+
+Objects are indexed in a uniform grid per anchor: each is stored in every cell its
+(influence) bounding box touches, and a pose only evaluates the objects of its own cell,
+plus the few unbounded ones. Cue cost therefore depends on how many objects overlap
+where the vehicle is, not on the size of the scene.
+
+    python scene.py scene.json --at 0.1 0 3.9 --anchor 3
+    python scene.py --benchmark
+'''
+
+import argparse
+import json
+import math
+import random
+import time
+
+CUES = ('vibration', 'hardness')
+DEFAULT_VALUES = {'vibration': 1, 'hardness': 500}
+
+
+def _axes(vector):
+    """Indices of the bounded (non-null) coordinates"""
+    return [i for i, value in enumerate(vector) if value is not None]
+
+
+def _distance(position, center, axes):
+    return math.sqrt(sum((position[i] - center[i]) ** 2 for i in axes))
+
+
+class SceneObject():
+    """One scene object, see the module docstring for the types
+
+    Attributes:
+        kind (str): zone, waypoint, wall or attractor
+        anchor (int): Marker ID it is placed relative to, None for any
+        cue (str): vibration or hardness
+        value (float): Full cue value
+        lower, upper (list): Bounding box of its influence, None on unbounded axes
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.kind = spec['type']
+        self.anchor = spec.get('anchor')
+        self.cue = spec.get('cue', 'vibration')
+        if self.cue not in CUES:
+            raise ValueError(f"unknown cue {self.cue}, expected one of {CUES}")
+        self.value = spec.get('value', DEFAULT_VALUES[self.cue])
+        self.name = spec.get('name', self.kind)
+        if self.kind == 'zone':
+            self.center = spec['center']
+            size = spec.get('size', [None, None, None])
+            self.half = [None if c is None or s is None else s / 2 for c, s in zip(self.center, size)]
+            self.lower = [None if h is None else c - h for c, h in zip(self.center, self.half)]
+            self.upper = [None if h is None else c + h for c, h in zip(self.center, self.half)]
+        elif self.kind in ('waypoint', 'attractor'):
+            self.center = spec['center']
+            self.radius = spec['radius']
+            self.axes = _axes(self.center)
+            self.lower = [None if c is None else c - self.radius for c in self.center]
+            self.upper = [None if c is None else c + self.radius for c in self.center]
+        elif self.kind == 'wall':
+            self.point = spec['point']
+            length = math.sqrt(sum(n * n for n in spec['normal']))
+            self.normal = [n / length for n in spec['normal']]
+            self.extent = spec['extent']
+            self.range = spec.get('range', 0.3)
+            reach = self.extent + self.range
+            self.lower = [p - reach for p in self.point]
+            self.upper = [p + reach for p in self.point]
+        else:
+            raise ValueError(f"unknown scene object type {self.kind}")
+
+    def bounded(self):
+        return None not in self.lower and None not in self.upper
+
+    def evaluate(self, position):
+        """Cue value at position, 0 outside the object's influence"""
+        if self.kind == 'zone':
+            for i, (lower, upper) in enumerate(zip(self.lower, self.upper)):
+                if lower is not None and not lower <= position[i] <= upper:
+                    return 0
+            return self.value
+        if self.kind == 'waypoint':
+            distance = _distance(position, self.center, self.axes)
+            return self.value * (self.radius - distance) / self.radius if distance < self.radius else 0
+        if self.kind == 'attractor':
+            distance = _distance(position, self.center, self.axes)
+            return self.value * distance / self.radius if distance < self.radius else 0
+        # wall: signed distance in front of the plane, within the disc
+        offset = [position[i] - self.point[i] for i in range(3)]
+        height = sum(o * n for o, n in zip(offset, self.normal))
+        lateral = math.sqrt(max(0.0, sum(o * o for o in offset) - height * height))
+        if lateral > self.extent or height > self.range:
+            return 0
+        return self.value if height <= 0 else self.value * (self.range - height) / self.range
+
+
+class HapticScene():
+    """Scene objects in a uniform grid per anchor, queried once per loop
+
+    Attributes:
+        cell (float): Grid cell size in m
+        objects (list): All SceneObjects
+        drive (bool): Cues are written to hapticsOut, otherwise only shown as indicators
+        evaluated (int): Object evaluations, for profiling
+        queries (int): Poses evaluated
+    """
+
+    def __init__(self, objects, cell=0.5, drive=True):
+        self.cell = cell
+        self.drive = drive
+        self.objects = [obj if isinstance(obj, SceneObject) else SceneObject(obj) for obj in objects]
+        self.grids = {}
+        self.unbounded = {}
+        for obj in self.objects:
+            self._insert(obj)
+        self.evaluated = 0
+        self.queries = 0
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename) as sceneFile:
+            spec = json.load(sceneFile)
+        return cls(spec['objects'], spec.get('cell', 0.5), spec.get('drive', True))
+
+    @classmethod
+    def default(cls):
+        """The station's original cues: vibrate in the 3.7-4.1 m band, harden within 0.5 m of (x=0, z=2)
+
+        They only ever lit the indicators, so the default scene does not drive the touchpad.
+        """
+        return cls([
+            {'type': 'zone', 'name': 'band', 'center': [None, None, 3.9], 'size': [None, None, 0.4],
+             'cue': 'vibration'},
+            {'type': 'waypoint', 'name': 'target', 'center': [0, None, 2], 'radius': 0.5, 'cue': 'hardness'},
+        ], drive=False)
+
+    def _key(self, values):
+        return tuple(math.floor(v / self.cell) for v in values)
+
+    def _insert(self, obj):
+        if not obj.bounded():
+            self.unbounded.setdefault(obj.anchor, []).append(obj)
+            return
+        grid = self.grids.setdefault(obj.anchor, {})
+        lower = self._key(obj.lower)
+        upper = self._key(obj.upper)
+        for x in range(lower[0], upper[0] + 1):
+            for y in range(lower[1], upper[1] + 1):
+                for z in range(lower[2], upper[2] + 1):
+                    grid.setdefault((x, y, z), []).append(obj)
+
+    def candidates(self, position, anchor=None):
+        """Objects that can affect a pose seen relative to marker anchor"""
+        key = self._key(position)
+        found = []
+        for scope in ((None, anchor) if anchor is not None else (None,)):
+            found.extend(self.grids.get(scope, {}).get(key, ()))
+            found.extend(self.unbounded.get(scope, ()))
+        return found
+
+    def cues(self, position, anchor=None):
+        """Cue values at a pose
+
+        Args:
+            position (tuple): (x, y, z) in the marker's pose space, m
+            anchor (int, optional): ID of the marker the pose was measured from
+
+        Returns:
+            dict: Strongest value per cue, 0 where nothing applies
+        """
+        result = {cue: 0 for cue in CUES}
+        objects = self.candidates(position, anchor)
+        for obj in objects:
+            value = obj.evaluate(position)
+            if value > result[obj.cue]:
+                result[obj.cue] = value
+        self.evaluated += len(objects)
+        self.queries += 1
+        return result
+
+    def summary(self):
+        cells = sum(len(grid) for grid in self.grids.values())
+        return (f"{len(self.objects)} objects in {cells} cells, "
+                f"{self.evaluated / max(1, self.queries):0.1f} evaluated per pose")
+
+
+def synthetic_scene(count, extent=20.0, anchors=4, seed=1):
+    """Random scene of count small objects spread over extent m, for benchmarks"""
+    rng = random.Random(seed)
+    objects = []
+    for i in range(count):
+        center = [rng.uniform(-extent / 2, extent / 2) for _ in range(3)]
+        kind = ('zone', 'waypoint', 'wall', 'attractor')[i % 4]
+        spec = {'type': kind, 'anchor': i % anchors, 'cue': CUES[i % 2]}
+        if kind == 'zone':
+            spec.update(center=center, size=[rng.uniform(0.2, 1.0) for _ in range(3)])
+        elif kind == 'wall':
+            spec.update(point=center, normal=[rng.uniform(-1, 1), rng.uniform(-1, 1), 1], extent=0.5)
+        else:
+            spec.update(center=center, radius=rng.uniform(0.2, 1.0))
+        objects.append(spec)
+    return HapticScene(objects)
+
+
+def benchmark(counts=(10, 100, 1000, 10000), poses=20000, extent=20.0):
+    """Time per pose query as the scene grows, it should stay roughly flat"""
+    print(f"{'objects':>8} {'cells':>8} {'evaluated/pose':>15} {'us/pose':>8}")
+    rng = random.Random(2)
+    positions = [tuple(rng.uniform(-extent / 2, extent / 2) for _ in range(3)) for _ in range(poses)]
+    for count in counts:
+        scene = synthetic_scene(count, extent)
+        started = time.perf_counter()
+        for i, position in enumerate(positions):
+            scene.cues(position, i % 4)
+        elapsed = time.perf_counter() - started
+        cells = sum(len(grid) for grid in scene.grids.values())
+        print(f"{count:>8} {cells:>8} {scene.evaluated / scene.queries:>15.2f} {elapsed / poses * 1e6:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a haptic scene file or benchmark scene queries')
+    parser.add_argument('scene', nargs='?', help='scene JSON file')
+    parser.add_argument('--at', type=float, nargs=3, default=None, metavar=('X', 'Y', 'Z'), help='print the cues at a pose')
+    parser.add_argument('--anchor', type=int, default=None, help='marker ID the pose is relative to')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+    scene = HapticScene.load(args.scene) if args.scene else HapticScene.default()
+    print(scene.summary())
+    if args.at is not None:
+        print(scene.cues(args.at, args.anchor))
+
+
+if __name__ == '__main__':
+    main()
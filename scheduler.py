@@ -0,0 +1,229 @@
+'''Load-aware scheduling of ArUco detection
+
+Full-resolution pose_esitmation on every frame is the most expensive stage of the
+station loop, so on a loaded machine it used to drag display, haptics, control and
+logging down with it. DetectionScheduler gives detection whatever is left of the loop
+period after the other stages and, per frame, picks the best quality level that fits:
+
+    full      detect on the whole frame at full resolution
+    full@0.75 detect on the whole frame, downscaled
+    full@0.5
+    track     detect only in a window around the last marker
+    reuse     keep the last pose
+
+Levels step down as soon as the expected cost no longer fits the budget and step back
+up after a run of frames with clear headroom. Every decision can be written to a CSV
+file, so the pose quality actually delivered during a trial is on record.
+'''
+
+import csv
+import time
+
+import numpy as np
+
+from vision import detect_markers, draw_markers
+
+
+class DetectionScheduler():
+    """Chooses how much detection work each new frame gets
+
+    Attributes:
+        levels (list): (name, scale) quality levels, best first
+        level (int): Index of the current level
+        targetPeriod (float): Loop period the station should hold, s
+        otherTime (float): Smoothed loop time spent outside detection, s
+        costs (dict): Smoothed detection time per level name, s
+        counts (dict): Frames handled per level name
+        decision (str): Level actually used for the latest frame
+        poseAge (int): Frames since the pose was last measured
+        corners (np.ndarray): Corners of the last marker found, for tracking
+        markerId (int): ID of the marker the pose belongs to, None when none was found
+    """
+
+    LEVELS = [('full', 1.0), ('full@0.75', 0.75), ('full@0.5', 0.5), ('track', 1.0), ('reuse', None)]
+
+    def __init__(self, targetRate=20, logFile=None, smoothing=0.2, headroom=0.7,
+                 upgradeAfter=30, maxPoseAge=10, trackMargin=1.0, adaptive=True):
+        """Summary
+
+        Args:
+            targetRate (float, optional): Loop rate to protect, Hz
+            logFile (str, optional): CSV file every decision is written to
+            smoothing (float, optional): Weight of the newest sample in the running averages
+            headroom (float, optional): Step up only if the better level costs less than this share of the budget
+            upgradeAfter (int, optional): Frames with headroom needed before stepping up
+            maxPoseAge (int, optional): Reuse the pose for at most this many frames before measuring again
+            trackMargin (float, optional): Tracking window margin around the last marker, in marker sizes
+            adaptive (bool, optional): False always runs full detection (decisions are still logged)
+        """
+        self.levels = self.LEVELS
+        self.level = 0
+        self.targetPeriod = 1.0 / targetRate
+        self.smoothing = smoothing
+        self.headroom = headroom
+        self.upgradeAfter = upgradeAfter
+        self.maxPoseAge = maxPoseAge
+        self.trackMargin = trackMargin
+        self.adaptive = adaptive
+
+        self.otherTime = 0.0
+        self.costs = {}
+        self.counts = {name: 0 for name, scale in self.levels}
+        self.goodFrames = 0
+        self.poseAge = 0
+        self.corners = None
+        self.lastLoop = None
+        self.detectTime = 0.0
+        self.frameNumber = 0
+        self.decision = 'full'
+        self.tvec = [0, 0, 0]
+        self.rvec = [0, 0, 0]
+        self.markerId = None
+
+        self.file = self.writer = None
+        if logFile:
+            self.file = open(logFile, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['time', 'frame', 'level', 'budgetMs', 'estimateMs', 'detectMs',
+                                  'otherMs', 'found', 'poseAge'])
+
+    def _smooth(self, average, sample):
+        return sample if average is None else average + self.smoothing * (sample - average)
+
+    def loop(self):
+        """Call once at the start of every station loop to measure the time outside detection"""
+        now = time.perf_counter()
+        if self.lastLoop is not None:
+            other = max(0.0, now - self.lastLoop - self.detectTime)
+            self.otherTime = self._smooth(self.otherTime, other)
+        self.lastLoop = now
+        self.detectTime = 0.0
+
+    def budget(self):
+        return self.targetPeriod - self.otherTime
+
+    def estimate(self, index):
+        """Expected detection time of a level, from measurements or scaled from full detection"""
+        name, scale = self.levels[index]
+        if name in self.costs:
+            return self.costs[name]
+        full = self.costs.get('full', 0.0)
+        if name == 'reuse':
+            return 0.0
+        if name == 'track':
+            return full * 0.1
+        return full * scale * scale
+
+    def choose(self):
+        """Pick the level for the next frame"""
+        if not self.adaptive:
+            return 0
+        budget = self.budget()
+        index = self.level
+        # step down straight away until the expected cost fits
+        while index < len(self.levels) - 1 and self.estimate(index) > budget:
+            index += 1
+        # step up one level after a run of frames with clear headroom
+        if index == self.level and index > 0 and self.estimate(index - 1) < budget * self.headroom:
+            self.goodFrames += 1
+            if self.goodFrames >= self.upgradeAfter:
+                index -= 1
+                self.goodFrames = 0
+        else:
+            self.goodFrames = 0
+        if index != self.level:
+            print(f"detection: {self.levels[self.level][0]} -> {self.levels[index][0]} "
+                  f"(budget {budget * 1000:0.1f}ms, other stages {self.otherTime * 1000:0.1f}ms)")
+            self.level = index
+        return index
+
+    def track_window(self, shape):
+        """(x, y, w, h) around the last marker, None if there is nothing to track"""
+        if self.corners is None:
+            return None
+        low = self.corners.min(axis=0)
+        high = self.corners.max(axis=0)
+        margin = (high - low).max() * self.trackMargin
+        x0, y0 = np.maximum(low - margin, 0).astype(int)
+        x1 = int(min(high[0] + margin, shape[1]))
+        y1 = int(min(high[1] + margin, shape[0]))
+        return x0, y0, x1 - x0, y1 - y0
+
+    def detect(self, frame, layer, aruco_dict_type, k, d, tagSize, gray=None, grayScale=1.0, calibration=None):
+        """Detect at the chosen level and add the markers to layer
+
+        Args:
+            frame (np.ndarray): New frame
+            layer (overlay.Layer): This frame's overlay layer, markers and axes are drawn on it
+            aruco_dict_type, k, d, tagSize: As pose_esitmation
+            gray (np.ndarray, optional): Gray version of frame to detect on instead
+            grayScale (float, optional): Size of gray relative to frame
+            calibration (CalibrationContext, optional): Cached calibration, see detect_markers
+
+        Returns:
+            tuple: (layer, tvec, rvec) as pose_esitmation, the last measured pose when reusing
+        """
+        started = time.perf_counter()
+        index = self.choose()
+        name, scale = self.levels[index]
+        if name == 'reuse' and self.poseAge >= self.maxPoseAge:
+            # don't let the pose go completely stale, measure as cheaply as we can
+            name, scale = ('track', 1.0) if self.corners is not None else self.levels[index - 2]
+        roi = None
+        if name == 'track':
+            roi = self.track_window(frame.shape)
+            if roi is None:
+                # nothing to track (lost or never found), search the whole frame cheaply
+                name, scale = self.levels[2]
+
+        found = False
+        if name != 'reuse':
+            if gray is not None:
+                corners, ids, rvecs, tvecs = detect_markers(gray, aruco_dict_type, k, d, tagSize, scale=scale, roi=roi,
+                                                            frameScale=grayScale, calibration=calibration)
+            else:
+                corners, ids, rvecs, tvecs = detect_markers(frame, aruco_dict_type, k, d, tagSize, scale=scale, roi=roi,
+                                                            calibration=calibration)
+            if calibration is not None:
+                k, d = calibration.k, calibration.d
+            layer.draw(draw_markers, corners, rvecs, tvecs, k, d)
+            found = len(tvecs) > 0
+            if found:
+                self.tvec = tvecs[-1][0][0]
+                self.rvec = rvecs[-1][0][0]
+                self.corners = corners[-1].reshape(4, 2)
+                self.markerId = int(ids[-1][0])
+                self.poseAge = 0
+            else:
+                # same as pose_esitmation when nothing is found
+                self.tvec = self.rvec = [0, 0, 0]
+                self.corners = None
+                self.markerId = None
+                self.poseAge = 0
+        else:
+            self.poseAge += 1
+
+        elapsed = time.perf_counter() - started
+        self.detectTime += elapsed
+        self.costs[name] = self._smooth(self.costs.get(name), elapsed)
+        self.counts[name] += 1
+        self.decision = name
+        self.frameNumber += 1
+        if self.writer:
+            self.writer.writerow([round(started, 4), self.frameNumber, name, round(self.budget() * 1000, 2),
+                                  round(self.estimate(index) * 1000, 2), round(elapsed * 1000, 2),
+                                  round(self.otherTime * 1000, 2), int(found), self.poseAge])
+        return layer, self.tvec, self.rvec
+
+    def current(self):
+        """Level actually used for the latest frame"""
+        return self.decision
+
+    def summary(self):
+        """Frames per level, e.g. 'full 812 | full@0.75 40 | track 3'"""
+        return ' | '.join(f'{name} {count}' for name, count in self.counts.items() if count)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = self.writer = None
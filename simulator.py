@@ -0,0 +1,423 @@
+'''Local stand-ins for the BlueROV2, the haptic touchpad and the ROV camera
+
+Runs a fake ArduSub vehicle over MAVLink, a mock touchpad TCP server speaking the
+same pickle protocol as hapticsThread, and a GStreamer RTP H.264 sender, so that
+ExperimentControl.py can be started (and soak tested) without any hardware:
+
+    python simulator.py --duration 3600
+    python ExperimentControl.py --mavlink udpin:0.0.0.0:14550 --haptics-host 127.0.0.1 --stats-interval 10
+    python simulator.py --check          arm, RC override and disarm through the station's MAVLink endpoint
+'''
+
+import argparse
+import math
+import os
+import pickle
+import socket
+import threading
+import time
+
+# ArduSub speaks MAVLink 2, mavutil picks the dialect when it is imported
+os.environ['MAVLINK20'] = '1'
+from pymavlink import mavutil
+
+
+class VehicleSimulator():
+    """Fake ArduSub autopilot
+
+    Streams HEARTBEAT, SCALED_IMU2, VFR_HUD and SYS_STATUS at the configured rates,
+    ACKs mode changes, arm/disarm and servo commands and integrates RC overrides
+    into a very crude heading/speed/depth model so the station sees plausible values.
+
+    Attributes:
+        master (object): MAVLink connection to the station
+        rates (dict): Message name -> send rate in Hz
+        armed (bool): Vehicle armed state
+        custom_mode (int): Current ArduSub mode number
+        rc (list): Latest RC override values (channels 1-6)
+        counters (dict): Messages sent/received, for the statistics printout
+    """
+
+    def __init__(self, connection='udpout:127.0.0.1:14550', rates=None):
+        """Summary
+
+        Args:
+            connection (str, optional): pymavlink connection string to reach the station
+            rates (dict, optional): Message name -> send rate in Hz
+        """
+        self.master = mavutil.mavlink_connection(connection, source_system=1, source_component=1)
+        self.rates = {'HEARTBEAT': 1, 'SCALED_IMU2': 10, 'VFR_HUD': 5, 'SYS_STATUS': 2}
+        if rates:
+            self.rates.update(rates)
+
+        self.armed = False
+        self.custom_mode = 19       # MANUAL
+        self.rc = [1500] * 6
+        self.heading = 0.0
+        self.speed = 0.0
+        self.depth = -1.0
+        self.battery = 100.0
+        self.counters = {'sent': 0, 'acks': 0, 'rc': 0}
+
+        self.bootTime = time.perf_counter()
+        self.running = False
+
+    def time_boot_ms(self):
+        return int((time.perf_counter() - self.bootTime) * 1000)
+
+    def send_heartbeat(self):
+        base_mode = mavutil.mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED
+        if self.armed:
+            base_mode |= mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED
+        self.master.mav.heartbeat_send(
+            mavutil.mavlink.MAV_TYPE_SUBMARINE,
+            mavutil.mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+            base_mode,
+            self.custom_mode,
+            mavutil.mavlink.MAV_STATE_ACTIVE)
+
+    def send_scaled_imu2(self):
+        t = time.perf_counter() - self.bootTime
+        self.master.mav.scaled_imu2_send(
+            self.time_boot_ms(),
+            int(20 * math.sin(t)), int(20 * math.cos(t)), -1000,            # mG
+            int(50 * math.sin(0.5 * t)), int(50 * math.cos(0.5 * t)),       # mrad/s
+            int((self.rc[3] - 1500) * 2),
+            200, 0, -400)
+
+    def send_vfr_hud(self):
+        self.master.mav.vfr_hud_send(
+            self.speed, self.speed,
+            int(self.heading) % 360,
+            int(abs(self.rc[4] - 1500) / 4),
+            self.depth,
+            0.0)
+
+    def send_sys_status(self):
+        self.master.mav.sys_status_send(
+            0, 0, 0,                # sensors present/enabled/health
+            250,                    # load (d%)
+            16000, 1000,            # voltage (mV), current (cA)
+            int(self.battery),
+            0, 0, 0, 0, 0, 0)
+
+    def ack(self, command, result=mavutil.mavlink.MAV_RESULT_ACCEPTED):
+        self.master.mav.command_ack_send(command, result)
+        self.counters['acks'] += 1
+
+    def handle(self, msg):
+        """Respond to a message from the station
+
+        Args:
+            msg (object): Received MAVLink message
+        """
+        mtype = msg.get_type()
+        if mtype == 'COMMAND_LONG':
+            if msg.command == mavutil.mavlink.MAV_CMD_DO_SET_MODE:
+                self.custom_mode = int(msg.param2)
+                self.ack(msg.command)
+                self.send_heartbeat()
+            elif msg.command == mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM:
+                self.armed = msg.param1 == 1
+                self.ack(msg.command)
+                self.send_heartbeat()
+            else:
+                self.ack(msg.command)
+        elif mtype == 'SET_MODE':
+            # older pymavlink set_mode_apm() sends SET_MODE instead of DO_SET_MODE
+            self.custom_mode = msg.custom_mode
+            self.ack(mavutil.mavlink.MAV_CMD_DO_SET_MODE)
+            self.send_heartbeat()
+        elif mtype == 'RC_CHANNELS_OVERRIDE':
+            values = [msg.chan1_raw, msg.chan2_raw, msg.chan3_raw,
+                      msg.chan4_raw, msg.chan5_raw, msg.chan6_raw]
+            for i, value in enumerate(values):
+                if value not in (0, 65535):
+                    self.rc[i] = value
+            self.counters['rc'] += 1
+
+    def integrate(self, dt):
+        """Crude vehicle model driven by the RC overrides"""
+        if not self.armed:
+            self.speed = 0.0
+            return
+        self.heading += (self.rc[3] - 1500) / 400 * 45 * dt
+        self.speed = (self.rc[4] - 1500) / 400 * 1.0
+        self.depth += (self.rc[2] - 1500) / 400 * 0.5 * dt
+        self.battery = max(0.0, self.battery - 0.001 * dt)
+
+    def run(self):
+        senders = {
+            'HEARTBEAT': self.send_heartbeat,
+            'SCALED_IMU2': self.send_scaled_imu2,
+            'VFR_HUD': self.send_vfr_hud,
+            'SYS_STATUS': self.send_sys_status
+        }
+        due = {name: 0.0 for name in senders}
+        last = time.perf_counter()
+        self.running = True
+        while self.running:
+            now = time.perf_counter()
+            self.integrate(now - last)
+            last = now
+            for name, sender in senders.items():
+                rate = self.rates.get(name, 0)
+                if rate > 0 and now >= due[name]:
+                    sender()
+                    self.counters['sent'] += 1
+                    due[name] = now + 1.0 / rate
+
+            msg = self.master.recv_match(blocking=True, timeout=0.005)
+            while msg is not None:
+                self.handle(msg)
+                msg = self.master.recv_match(blocking=False)
+
+    def stop(self):
+        self.running = False
+
+
+class TouchpadSimulator():
+    """Mock soft haptic touchpad
+
+    Speaks the lock-step pickle protocol used by hapticsThread: the station sends
+    pickle.dumps(hapticsOut) and waits for pickle.dumps([position, force]).
+
+    Attributes:
+        host (str): Address to listen on
+        port (int): TCP port to listen on
+        pattern (str): 'idle' (no touch) or 'sweep' (finger sweeps and presses)
+        delay (float): Artificial device latency per exchange in seconds
+        hapticsOut (list): Latest [vibration, hardness] received from the station
+        counters (dict): Exchanges served and connections accepted
+    """
+
+    def __init__(self, host='127.0.0.1', port=8787, pattern='sweep', delay=0.0):
+        self.host = host
+        self.port = port
+        self.pattern = pattern
+        self.delay = delay
+        self.hapticsOut = [0, 0]
+        self.counters = {'exchanges': 0, 'connections': 0}
+        self.running = False
+        self.server = None
+
+    def reading(self, t):
+        """Synthetic [position, force] for time t"""
+        if self.pattern == 'idle':
+            return [1000, 0]
+        position = int(1000 + 600 * math.sin(0.3 * t))
+        force = int(max(0, 500 * math.sin(0.1 * t)))
+        return [position, force]
+
+    def serve(self, conn):
+        start = time.perf_counter()
+        with conn:
+            while self.running:
+                data = conn.recv(128)
+                if not data:
+                    break
+                self.hapticsOut = pickle.loads(data)
+                if self.delay > 0:
+                    time.sleep(self.delay)
+                conn.send(pickle.dumps(self.reading(time.perf_counter() - start)))
+                self.counters['exchanges'] += 1
+        print("touchpad: station disconnected")
+
+    def run(self):
+        self.server = socket.socket()
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((self.host, self.port))
+        self.server.listen(1)
+        self.running = True
+        print(f"touchpad: listening on {self.host}:{self.port}")
+        while self.running:
+            try:
+                conn, addr = self.server.accept()
+            except OSError:
+                break
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.counters['connections'] += 1
+            print(f"touchpad: station connected from {addr}")
+            self.serve(conn)
+
+    def stop(self):
+        self.running = False
+        if self.server is not None:
+            self.server.close()
+
+
+class VideoSimulator():
+    """GStreamer RTP H.264 sender standing in for the ROV camera
+
+    Attributes:
+        host (str): Destination address of the station
+        port (int): Destination UDP port (the station listens on 5600)
+        image (str): Optional still image to stream instead of a test pattern
+        video_pipe (object): GStreamer top-level pipeline
+    """
+
+    def __init__(self, host='127.0.0.1', port=5600, width=1280, height=720, fps=30, bitrate=2000, image=None):
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst
+        self.Gst = Gst
+        Gst.init(None)
+
+        self.host = host
+        self.port = port
+        self.image = image
+        if image:
+            source = f'filesrc location="{image}" ! decodebin ! videoconvert ! imagefreeze ! videoscale'
+        else:
+            source = 'videotestsrc is-live=true pattern=ball'
+        self.pipeline_description = ' '.join([
+            source,
+            f'! video/x-raw,width={width},height={height},framerate={fps}/1',
+            '! videoconvert ! x264enc tune=zerolatency speed-preset=ultrafast',
+            f'bitrate={bitrate} key-int-max={fps}',
+            '! rtph264pay config-interval=1 pt=96',
+            f'! udpsink host={host} port={port}'
+        ])
+        self.video_pipe = None
+
+    def run(self):
+        self.video_pipe = self.Gst.parse_launch(self.pipeline_description)
+        self.video_pipe.set_state(self.Gst.State.PLAYING)
+        print(f"video: streaming RTP H.264 to {self.host}:{self.port}")
+
+    def stop(self):
+        if self.video_pipe is not None:
+            self.video_pipe.set_state(self.Gst.State.NULL)
+
+
+def check(port=14590, timeout=5):
+    """Arm, send an 18 channel RC override and disarm the fake vehicle through a netcore endpoint
+
+    Exercises the same MAVLink messages Station.arm(), set_rc_channel_pwm() and Station.disarm() send.
+
+    Returns:
+        bool: True if every step was acknowledged by the vehicle
+    """
+    from netcore import NetCore, MavlinkEndpoint
+
+    vehicle = VehicleSimulator(f'udpout:127.0.0.1:{port}')
+    thread = threading.Thread(target=vehicle.run, name='vehicle')
+    thread.daemon = True
+    thread.start()
+    core = NetCore()
+    endpoint = core.add(MavlinkEndpoint(f'udpin:127.0.0.1:{port}'))
+
+    def wait(condition):
+        deadline = time.perf_counter() + timeout
+        while not condition():
+            if time.perf_counter() > deadline:
+                return False
+            endpoint.wait_heartbeat(timeout=0.1)
+        return True
+
+    def arm(value):
+        endpoint.mav.command_long_send(endpoint.target_system, endpoint.target_component,
+                                       mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0, value, 0, 0, 0, 0, 0, 0)
+
+    def override():
+        channels = [65535] * 18
+        channels[4] = 1600
+        endpoint.mav.rc_channels_override_send(endpoint.target_system, endpoint.target_component, *channels)
+        return wait(lambda: vehicle.rc[4] == 1600)
+
+    steps = [
+        ('heartbeat', lambda: endpoint.wait_heartbeat(timeout=timeout) is not None),
+        ('arm', lambda: arm(1) or wait(endpoint.motors_armed)),
+        ('RC override', override),
+        ('disarm', lambda: arm(0) or wait(lambda: not endpoint.motors_armed())),
+    ]
+    ok = True
+    try:
+        for name, step in steps:
+            try:
+                passed = step()
+            except Exception as e:
+                passed = False
+                print(f"check: {name} raised {type(e).__name__}: {e}")
+            print(f"check: {name} {'ok' if passed else 'FAILED'}")
+            if not passed:
+                ok = False
+                break
+    finally:
+        vehicle.stop()
+        core.close()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local BlueROV2/touchpad/camera stand-ins for ExperimentControl.py')
+    parser.add_argument('--check', action='store_true', help='run the arm/RC override/disarm check and exit')
+    parser.add_argument('--mavlink', default='udpout:127.0.0.1:14550', help='connection string used to reach the station')
+    parser.add_argument('--heartbeat-rate', type=float, default=1)
+    parser.add_argument('--imu-rate', type=float, default=10)
+    parser.add_argument('--hud-rate', type=float, default=5)
+    parser.add_argument('--status-rate', type=float, default=2)
+    parser.add_argument('--touchpad-host', default='127.0.0.1')
+    parser.add_argument('--touchpad-port', type=int, default=8787)
+    parser.add_argument('--touchpad-pattern', choices=['sweep', 'idle'], default='sweep')
+    parser.add_argument('--touchpad-delay', type=float, default=0.0, help='simulated device latency per exchange (s)')
+    parser.add_argument('--video-host', default='127.0.0.1')
+    parser.add_argument('--video-port', type=int, default=5600)
+    parser.add_argument('--video-image', default=None, help='still image (e.g. a frame with ArUco tags) to stream')
+    parser.add_argument('--no-vehicle', action='store_true')
+    parser.add_argument('--no-touchpad', action='store_true')
+    parser.add_argument('--no-video', action='store_true')
+    parser.add_argument('--duration', type=float, default=0, help='stop after this many seconds (0 = until Ctrl-C)')
+    parser.add_argument('--stats-interval', type=float, default=10)
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(0 if check() else 1)
+    standIns = []
+    if not args.no_vehicle:
+        vehicle = VehicleSimulator(args.mavlink, {
+            'HEARTBEAT': args.heartbeat_rate,
+            'SCALED_IMU2': args.imu_rate,
+            'VFR_HUD': args.hud_rate,
+            'SYS_STATUS': args.status_rate
+        })
+        standIns.append(('vehicle', vehicle))
+    if not args.no_touchpad:
+        touchpad = TouchpadSimulator(args.touchpad_host, args.touchpad_port, args.touchpad_pattern, args.touchpad_delay)
+        standIns.append(('touchpad', touchpad))
+
+    for name, standIn in standIns:
+        thread = threading.Thread(target=standIn.run, name=name)
+        thread.daemon = True
+        thread.start()
+
+    if not args.no_video:
+        video = VideoSimulator(args.video_host, args.video_port, image=args.video_image)
+        video.run()
+        standIns.append(('video', video))
+
+    startTime = time.perf_counter()
+    lastCounters = {}
+    try:
+        while args.duration <= 0 or time.perf_counter() - startTime < args.duration:
+            time.sleep(args.stats_interval)
+            elapsed = time.perf_counter() - startTime
+            line = f"{elapsed:8.1f}s"
+            for name, standIn in standIns:
+                counters = getattr(standIn, 'counters', None)
+                if counters is None:
+                    continue
+                for key, value in counters.items():
+                    rate = (value - lastCounters.get((name, key), 0)) / args.stats_interval
+                    lastCounters[(name, key)] = value
+                    line += f" {name}.{key}={value} ({rate:0.1f}/s)"
+            print(line)
+    except KeyboardInterrupt:
+        pass
+
+    for name, standIn in standIns:
+        standIn.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+'''Long-session soak telemetry: resource growth over an experiment day
+
+soakStats reports loop rate and latency; SoakMonitor watches what leaks show up in
+over hundreds of trials. Every interval it samples a set of probes (RSS, live threads,
+open file descriptors, loop rate, plus whatever the frontend registers, e.g. Tk canvas
+item counts) and, with tracemalloc enabled, the allocation sites that grew most since
+the first sample. Samples are appended to a JSON lines file, one compact object per
+interval:
+
+    {"t": 3600.0, "rssMB": 212.4, "threads": 9, "fds": 41, "loopHz": 30.1, "canvas.robot": 2,
+     "top": [["recorder.py:52", 1840.2, 12], ...]}
+
+A probe is flagged when its last `window` samples never decreased and grew by more
+than its tolerance, which is how a leak looks and how noise does not. The flag is
+printed once and cleared when the probe stops growing.
+
+    python soak.py soak.jsonl          summarise a recorded session
+'''
+
+import argparse
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+def rss_mb():
+    # current (not peak) resident set size, Linux only
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        return float('nan')
+
+
+def open_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return float('nan')
+
+
+def growing(values, tolerance):
+    """True if values never decrease and rise by more than tolerance overall"""
+    if len(values) < 2 or values[-1] - values[0] <= tolerance:
+        return False
+    return all(b >= a for a, b in zip(values, values[1:]))
+
+
+class SoakMonitor():
+    """Periodic resource sampling with monotonic growth detection
+
+    Attributes:
+        interval (float): Seconds between samples
+        window (int): Samples a growth trend has to last before it is flagged
+        probes (dict): Name -> (function returning a number, growth tolerance)
+        history (dict): Name -> recent values, at most window long
+        flagged (set): Probes currently flagged as growing
+        topAllocators (int): Allocation sites reported per sample, 0 when tracemalloc is off
+    """
+
+    def __init__(self, interval=60, filename=None, window=10, topAllocators=0):
+        """Summary
+
+        Args:
+            interval (float, optional): Seconds between samples
+            filename (str, optional): JSON lines file the samples are appended to
+            window (int, optional): Samples in the growth check
+            topAllocators (int, optional): Start tracemalloc and report this many growing sites
+        """
+        self.interval = interval
+        self.window = window
+        self.topAllocators = topAllocators
+        self.startTime = time.perf_counter()
+        self.lastSample = self.startTime
+        self.loops = 0
+        self.probes = {}
+        self.history = {}
+        self.flagged = set()
+        self.baseline = None
+        self.file = open(filename, 'a') if filename else None
+        if topAllocators > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.probe('rssMB', rss_mb, tolerance=20)
+        self.probe('threads', threading.active_count, tolerance=2)
+        self.probe('fds', open_fds, tolerance=5)
+
+    def probe(self, name, function, tolerance=0):
+        """Sample function() every interval under name
+
+        Args:
+            tolerance (float, optional): Growth over the window that is still noise
+        """
+        self.probes[name] = (function, tolerance)
+        self.history[name] = []
+
+    def tick(self):
+        """Call once per loop, samples when the interval has passed"""
+        self.loops += 1
+        now = time.perf_counter()
+        if now - self.lastSample >= self.interval:
+            self.sample(now)
+
+    def sample(self, now=None):
+        now = time.perf_counter() if now is None else now
+        record = {'t': round(now - self.startTime, 1), 'loopHz': round(self.loops / max(now - self.lastSample, 1e-9), 2)}
+        for name, (function, tolerance) in self.probes.items():
+            try:
+                value = function()
+            except Exception:
+                # a probe of a closed window or dead link must not take the station down
+                continue
+            record[name] = round(value, 2) if isinstance(value, float) else value
+            values = self.history[name]
+            values.append(value)
+            del values[:-self.window]
+            if len(values) == self.window and growing(values, tolerance):
+                if name not in self.flagged:
+                    self.flagged.add(name)
+                    rate = (values[-1] - values[0]) / ((self.window - 1) * self.interval) * 60
+                    print(f"soak: {name} grew in each of the last {self.window} samples, "
+                          f"{values[0]} -> {values[-1]} ({rate:+0.2f}/min)")
+            elif name in self.flagged:
+                self.flagged.discard(name)
+                print(f"soak: {name} stopped growing at {value}")
+        if self.topAllocators > 0:
+            record['top'] = self.allocators()
+        record['growing'] = sorted(self.flagged)
+        if self.file is not None:
+            self.file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self.file.flush()
+        self.loops = 0
+        self.lastSample = now
+        return record
+
+    def allocators(self):
+        """[site, kB grown, blocks grown] of the sites that grew most since the first sample"""
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>')])
+        if self.baseline is None:
+            self.baseline = snapshot
+            return []
+        top = []
+        for stat in snapshot.compare_to(self.baseline, 'lineno')[:self.topAllocators]:
+            frame = stat.traceback[0]
+            top.append([f"{os.path.basename(frame.filename)}:{frame.lineno}", round(stat.size_diff / 1e3, 1),
+                        stat.count_diff])
+        return top
+
+    def close(self):
+        if self.flagged:
+            print(f"soak: still growing at exit: {', '.join(sorted(self.flagged))}")
+        if self.file is not None:
+            self.file.close()
+
+
+def summarise(filename, window=10):
+    """Start/end value and growth flags of every probe in a recorded session"""
+    with open(filename) as soakFile:
+        records = [json.loads(line) for line in soakFile if line.strip()]
+    if not records:
+        print("no samples")
+        return
+    names = [name for name in records[-1] if name not in ('t', 'top', 'growing')]
+    hours = (records[-1]['t'] - records[0]['t']) / 3600
+    print(f"{len(records)} samples over {hours:0.2f} h")
+    for name in names:
+        values = [record[name] for record in records if name in record]
+        flagged = sum(1 for record in records if name in record.get('growing', ()))
+        print(f"{name:>16}: {values[0]} -> {values[-1]} (min {min(values)}, max {max(values)}), "
+              f"flagged growing in {flagged} samples")
+    top = records[-1].get('top')
+    if top:
+        print("largest growth by allocation site at the end:")
+        for site, kB, blocks in top:
+            print(f"{site:>40} {kB:>10.1f} kB {blocks:>8} blocks")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarise a soak telemetry file')
+    parser.add_argument('file')
+    args = parser.parse_args()
+    summarise(args.file)
+
+
+if __name__ == '__main__':
+    main()
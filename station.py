@@ -0,0 +1,1249 @@
+'''Operator station engine for the ROV cross-current experiment
+
+Everything except the user interface: MAVLink, video, ArUco pose, touchpad haptics,
+the trial lifecycle and logging. ExperimentControl.py (PySimpleGUI) and headless.py
+are frontends driving a Station.
+'''
+
+import cv2
+import numpy as np
+from utils import ARUCO_DICT
+import time
+import os
+# ArduSub speaks MAVLink 2 and the RC overrides carry 18 channels, mavutil picks the dialect when it is imported
+os.environ['MAVLINK20'] = '1'
+from pymavlink import mavutil
+import threading
+import json
+import queue
+from math import sqrt
+import csv
+from video import Video, PROFILES
+from vision import detect_markers, draw_markers
+from parallel import VisionLink, HapticsLink
+from bringup import Bringup
+from scheduler import DetectionScheduler
+from calibration import CalibrationContext
+from recorder import Recorder
+from bus import TelemetryBus, parse_rates
+from watchdog import Watchdog
+from tlog import TlogWriter
+from sync import SyncIndexWriter
+from trial import TrialController
+from journal import recover, save_session, load_session
+from soak import SoakMonitor, rss_mb
+from overlay import Layer, View, reticle
+from scene import HapticScene
+from restream import Restreamer
+from multirate import MultiRateLog
+from netcore import NetCore, MavlinkEndpoint, HapticsChannel, parse_endpoint
+
+def maprange( a, b, s):
+	(a1, a2), (b1, b2) = a, b
+	return  b1 + ((s - a1) * (b2 - b1) / (a2 - a1))
+
+
+class repeatedTimer(object):
+    def __init__(self, interval, function, *args, **kwargs):
+        self._timer     = None
+        self.interval   = interval
+        self.function   = function
+        self.args       = args
+        self.kwargs     = kwargs
+        self.is_running = False
+        self.start()
+
+    def _run(self):
+        self.is_running = False
+        self.start()
+        self.function(*self.args, **self.kwargs)
+
+    def start(self):
+        if not self.is_running:
+            self._timer = threading.Timer(self.interval, self._run)
+            self._timer.start()
+            self.is_running = True
+
+    def stop(self):
+        self._timer.cancel()
+        self.is_running = False
+
+'''LIGHTING FUNCTIONS'''
+
+def set_servo_pwm(master, servo_n, microseconds):
+    """ Sets AUX 'servo_n' output PWM pulse-width.
+
+    Uses https://mavlink.io/en/messages/common.html#MAV_CMD_DO_SET_SERVO
+
+    'servo_n' is the AUX port to set (assumes port is configured as a servo).
+        Valid values are 1-3 in a normal BlueROV2 setup, but can go up to 8
+        depending on Pixhawk type and firmware.
+    'microseconds' is the PWM pulse-width to set the output to. Commonly
+        between 1100 and 1900 microseconds.
+
+    """
+    # master.set_servo(servo_n+8, microseconds) or:
+    master.mav.command_long_send(
+        master.target_system, master.target_component,
+        mavutil.mavlink.MAV_CMD_DO_SET_SERVO,
+        0,            # first transmission of this command
+        servo_n + 8,  # servo instance, offset by 8 MAIN outputs
+        microseconds, # PWM pulse-width
+        0,0,0,0,0     # unused parameters
+    )
+
+def lightOn(master):
+    set_servo_pwm(master, 1, 1500)
+    print("light on")
+    return
+
+def lightOff(master):
+    set_servo_pwm(master, 1, 1100)
+    print("light off")
+    return
+
+def flashLights(master, n):
+    for i in range(0,n,1):
+        lightOn(master)
+        time.sleep(0.25)
+        lightOff(master)
+        time.sleep(1)
+    return
+
+def lightSignal(master, fast, slow):
+    print("signalling with lights")
+    if fast > 0:
+        print("fast cycle")
+        for i in range(0,fast,1):
+            lightOn(master)
+            time.sleep(0.25)
+            lightOff(master)
+            time.sleep(0.5)
+
+    if slow > 0:
+        print("slow cycle")
+        for i in range(0,slow,1):
+            lightOn(master)
+            time.sleep(0.75)
+            lightOff(master)
+            time.sleep(0.5)
+    return
+
+'''ROBOT HELPERS'''
+
+def set_rc_channel_pwm(master, channel_id, pwm=1500):
+    """ Set RC channel pwm value
+    Args:
+        master (object): MAVLink connection
+        channel_id (TYPE): Channel ID
+        pwm (int, optional): Channel pwm value 1100-1900
+    """
+    if channel_id < 1 or channel_id > 18:
+        print("Channel does not exist.")
+        return
+
+    # Mavlink 2 supports up to 18 channels:
+    # https://mavlink.io/en/messages/common.html#RC_CHANNELS_OVERRIDE
+    rc_channel_values = [65535 for _ in range(18)]
+    rc_channel_values[channel_id - 1] = pwm
+    master.mav.rc_channels_override_send(
+        master.target_system,                # target_system
+        master.target_component,             # target_component
+        *rc_channel_values)                  # RC channel list, in microseconds.
+
+    '''
+    RC Inputs:
+    1 -> Pitch
+    2 -> Roll
+    3 -> Throttle
+    4 -> Yaw
+    5 -> Forward
+    6 -> Lateral (strafe?)
+    1100 = full dir1, 1900 = full dir2, 1500 = stop
+    '''
+
+def clearMotion(master):
+    # Mavlink 2 supports up to 18 channels:
+    # https://mavlink.io/en/messages/common.html#RC_CHANNELS_OVERRIDE
+    rc_channel_values = [65535 for _ in range(18)]
+    rc_channel_values[0] = 1500
+    rc_channel_values[1] = 1500
+    rc_channel_values[2] = 1500
+    rc_channel_values[3] = 1500
+    rc_channel_values[4] = 1500
+    rc_channel_values[5] = 1500
+    master.mav.rc_channels_override_send(
+        master.target_system,                # target_system
+        master.target_component,             # target_component
+        *rc_channel_values)                  # RC channel list, in microseconds.
+
+    '''
+    RC Inputs:
+    1 -> Pitch
+    2 -> Roll
+    3 -> Throttle
+    4 -> Yaw
+    5 -> Forward
+    6 -> Lateral (strafe?)
+    1100 = full dir1, 1900 = full dir2, 1500 = stop
+    '''
+
+def heartbeat_helper(master):
+    print('start heartbeat thread')
+    while True:
+        master.mav.heartbeat_send(
+            6, #MAVTYPE = MAV_TYPE_GCS
+            8, #MAVAUTOPILOT = MAV_AUTOPILOT_INVALID
+            128, # MAV_MODE = MAV_MODE_FLAG_SAFETY_ARMED, have also tried 0 here
+            0,0)
+        #print('sent heartbeat')
+        time.sleep(0.9)
+
+def request_message_interval(master, message_id: int, frequency_hz: float):
+    """
+    Request MAVLink message in a desired frequency,
+    documentation for SET_MESSAGE_INTERVAL:
+        https://mavlink.io/en/messages/common.html#MAV_CMD_SET_MESSAGE_INTERVAL
+
+    Args:
+        master (object): MAVLink connection
+        message_id (int): MAVLink message ID
+        frequency_hz (float): Desired frequency in Hz
+    """
+    master.mav.command_long_send(
+        master.target_system, master.target_component,
+        mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL, 0,
+        message_id, # The MAVLink message ID
+        1e6 / frequency_hz, # The interval between two messages in microseconds. Set to -1 to disable and 0 to request default rate.
+        0, 0, 0, 0, # Unused parameters
+        0, # Target address of message stream (if message has target address fields). 0: Flight-stack default (recommended), 1: address of requestor, 2: broadcast.
+    )
+
+def change_mode(master, mode, timeout=5):
+    """Set the flight mode and wait, for at most timeout, for the autopilot to ACK it
+
+    Args:
+        master (object): MAVLink connection
+        mode (str): Mode name, e.g. 'ALT_HOLD' or 'MANUAL'
+        timeout (float, optional): Seconds to wait for the COMMAND_ACK
+
+    Returns:
+        bool: True if the autopilot accepted the mode
+    """
+    # Check if mode is available
+    if mode not in master.mode_mapping():
+        print('Unknown mode : {}'.format(mode))
+        print('Try:', list(master.mode_mapping().keys()))
+        return False
+
+    # Get mode ID
+    mode_id = master.mode_mapping()[mode]
+    print(f'I know that mode: {mode_id}')
+    # Set new mode
+    # master.mav.command_long_send(
+    #    master.target_system, master.target_component,
+    #    mavutil.mavlink.MAV_CMD_DO_SET_MODE, 0,
+    #    0, mode_id, 0, 0, 0, 0, 0) or:
+    master.set_mode(mode_id)
+
+    print('Sent mode message')
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        # Wait for ACK command, giving up if the autopilot never answers
+        ack_msg = master.recv_match(type='COMMAND_ACK', blocking=True, timeout=deadline - time.perf_counter())
+        if ack_msg is None:
+            break
+        ack_msg = ack_msg.to_dict()
+
+        # Continue waiting if the acknowledged command is not `set_mode`
+        if ack_msg['command'] != mavutil.mavlink.MAV_CMD_DO_SET_MODE:
+            continue
+
+        # Print the ACK result !
+        print(mavutil.mavlink.enums['MAV_RESULT'][ack_msg['result']].description)
+        return ack_msg['result'] == mavutil.mavlink.MAV_RESULT_ACCEPTED
+
+    print(f'No ACK for mode {mode} after {timeout}s')
+    return False
+
+
+class soakStats(object):
+    """Loop rate, haptics and video latency and memory statistics for long (soak) runs
+
+    Attributes:
+        interval (float): Seconds between reports, 0 disables reporting
+        filename (str): Optional CSV file the reports are appended to
+    """
+    def __init__(self, interval, filename=None):
+        self.interval = interval
+        self.startTime = time.perf_counter()
+        self.lastReport = self.startTime
+        self.loops = 0
+        self.worstLoop = 0
+        self.lastLoop = self.startTime
+        self.videoLatency = []
+        self.calibration = None
+        self.lastSaved = 0.0
+        self.writer = None
+        if filename:
+            self.file = open(filename, 'w', newline='')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(['elapsed', 'loopRate', 'worstLoop', 'hapticsRTT', 'videoLatency', 'worstVideoLatency', 'calibSavedMs', 'rssMB'])
+
+    def elapsed(self):
+        return time.perf_counter() - self.startTime
+
+    @staticmethod
+    def rssMB():
+        return rss_mb()
+
+    def frame_shown(self, latency):
+        if latency == latency:
+            self.videoLatency.append(latency)
+
+    def tick(self, hapticsRTT):
+        now = time.perf_counter()
+        self.loops += 1
+        self.worstLoop = max(self.worstLoop, now - self.lastLoop)
+        self.lastLoop = now
+        if self.interval <= 0 or now - self.lastReport < self.interval:
+            return
+        latencies = self.videoLatency or [float('nan')]
+        #Setup work the calibration context saved since the last report
+        saved = self.calibration.saved() if self.calibration is not None else 0.0
+        row = [round(now - self.startTime, 1), round(self.loops / (now - self.lastReport), 2),
+               round(self.worstLoop * 1000, 1), round(hapticsRTT * 1000, 2),
+               round(float(np.median(latencies)) * 1000, 1), round(max(latencies) * 1000, 1),
+               round((saved - self.lastSaved) * 1000, 1), round(self.rssMB(), 1)]
+        print(f"stats: t={row[0]}s loop={row[1]}Hz worst={row[2]}ms hapticsRTT={row[3]}ms "
+              f"video={row[4]}ms (worst {row[5]}ms) calibSaved={row[6]}ms rss={row[7]}MB")
+        self.lastSaved = saved
+        if self.writer:
+            self.writer.writerow(row)
+            self.file.flush()
+        self.loops = 0
+        self.worstLoop = 0
+        self.videoLatency = []
+        self.lastReport = now
+
+'''STATION ENGINE'''
+
+def add_station_arguments(parser):
+    """Command line options shared by every frontend
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to add the options to
+    """
+    #Peer endpoints default to the real ROV/touchpad, override them to run against simulator.py
+    parser.add_argument('--mavlink', default='udpin:0.0.0.0:14550', help='MAVLink connection string')
+    parser.add_argument('--video-port', type=int, default=5600, help='RTP H.264 video UDP port')
+    parser.add_argument('--publish', action='append', default=[], help='Publish live state to udp:host:port or unix:/path (repeatable), see bus.py')
+    parser.add_argument('--publish-rate', action='append', default=[], help='Per topic rate limit, e.g. pose=10 (0 = every loop)')
+    parser.add_argument('--deadline', action='append', default=[], help='Watchdog deadline for an input in s, e.g. haptics=0.5 (inputs: loop, haptics, video, mavlink; 0 = not watched)')
+    parser.add_argument('--watchdog-period', type=float, default=0.02, help='Watchdog polling period in s')
+    parser.add_argument('--pretrigger-seconds', type=float, default=5, help='Seconds of video kept before Start and written at the head of the recording (0 = off)')
+    parser.add_argument('--pretrigger-mb', type=float, default=64, help='Memory budget of the pre-trigger buffer')
+    parser.add_argument('--recorder-queue-mb', type=float, default=64, help='Memory budget of the frames waiting to be recorded, frames beyond it are dropped')
+    parser.add_argument('--undistort', action='store_true', help='Show (and save stills of) undistorted views')
+    parser.add_argument('--gray-detection', action='store_true', help='Detect on a GRAY8 branch of the video pipeline')
+    parser.add_argument('--gray-width', type=int, default=None, help='Downscale the gray detection branch to this width')
+    parser.add_argument('--video-profile', choices=sorted(PROFILES), default='default', help='Video receive pipeline profile')
+    parser.add_argument('--journal-window', type=float, default=0.1, help='Trial log durability window in s, at most this much of the log is lost in a crash (0 = fsync every row)')
+    parser.add_argument('--haptic-scene', default=None, help='JSON scene of haptic zones, walls, waypoints and attractors driving the touchpad (default: the original band and target cues, indicators only)')
+    parser.add_argument('--haptics-host', default='10.55.0.1', help='Haptic touchpad address')
+    parser.add_argument('--haptics-port', type=int, default=8787, help='Haptic touchpad TCP port')
+    parser.add_argument('--haptics-transport', choices=['tcp', 'udp'], default='tcp', help='Haptic touchpad link protocol')
+    parser.add_argument('--duration', type=float, default=0, help='Exit after this many seconds, for soak runs (0 = run until closed)')
+    parser.add_argument('--stats-interval', type=float, default=0, help='Print loop rate/latency/memory every N seconds (0 = off)')
+    parser.add_argument('--stats-file', default=None, help='Also append the statistics to this CSV file')
+    parser.add_argument('--soak-interval', type=float, default=0, help='Sample memory, threads, file descriptors and GUI items every N seconds and flag steady growth (0 = off)')
+    parser.add_argument('--soak-file', default=None, help='Append the soak samples to this JSON lines file')
+    parser.add_argument('--soak-tracemalloc', type=int, default=0, help='Trace allocations and report the N sites that grew most (slows the station down)')
+    parser.add_argument('--restream', action='append', default=[], metavar='HOST:PORT', help='Send a view as RTP/H.264 to this viewer, repeat for more viewers (encoded once for all of them)')
+    parser.add_argument('--restream-view', choices=['markup', 'user', 'raw'], default='markup', help='View re-streamed to the viewers')
+    parser.add_argument('--restream-size', type=int, nargs=2, default=[1280, 720], metavar=('WIDTH', 'HEIGHT'), help='Re-streamed resolution')
+    parser.add_argument('--restream-fps', type=float, default=15, help='Re-streamed frame rate')
+    parser.add_argument('--restream-bitrate', type=int, default=2000, help='Re-streamed bitrate, kbit/s')
+    parser.add_argument('--parallel', action='store_true', help='Run vision/recording and the touchpad link in separate processes')
+    parser.add_argument('--connect-timeout', type=float, default=10, help='Seconds to wait for each peer before reporting it as timed out')
+    parser.add_argument('--target-rate', type=float, default=20, help='Loop rate detection is scaled back to protect, Hz')
+    parser.add_argument('--detect-log', default=None, help='CSV file recording the detection level chosen for every frame')
+    parser.add_argument('--no-adaptive-detection', action='store_true', help='Always run full resolution detection')
+    parser.add_argument('--no-multirate-log', action='store_true', help='Only keep the per-loop trial log, not the per-source streams at their own rates')
+
+
+class Station():
+    """Operator station core: video, vision, telemetry, haptics, trial lifecycle and logging
+
+    Has no knowledge of any GUI. A frontend calls step() once per loop, sends commands
+    with command() (or the methods listed in COMMANDS directly) and picks up what
+    happened with poll_events(). Everything a frontend displays is a plain attribute:
+    frame (and the composited views from view()), the filtered pose (avgx, avgy, avgz, avgyaw, ...), telemetry,
+    fingerPos/fingerForce and the haptic indicators.
+
+    Events are (name, data) tuples:
+        ('link', {name, status, elapsed, error})    peer connection state changed
+        ('trial_started', {participant, condition, repeat})
+        ('trial_ended', {result, reason, repeat})   repeat is the next repeat number
+        ('armed', {}), ('disarmed', {})
+        ('mode', {mode, accepted})
+        ('touch_control', {enabled})
+        ('indicators', {vibration, hard})
+        ('battery_low', {battery})
+        ('emergency', {})
+        ('watchdog', {input, stale, age})            an input passed its deadline or recovered
+        ('trial_transition', {name, blocked, background})   start/end/prepare/finish took this long, s
+    """
+
+    COMMANDS = ('start_trial', 'end_trial', 'arm', 'disarm', 'all_stop', 'move', 'straighten',
+                'set_mode', 'set_touch_control', 'set_vibration', 'set_hardness', 'zero_touchpad',
+                'print_touch', 'light_signal', 'emergency', 'set_tag_size', 'still', 'save_clip', 'reconnect')
+
+    #RC channel and PWM for each manual move
+    MOVES = {
+        'Forward': (5, 1550),
+        'Reverse': (5, 1450),
+        'Left': (4, 1450),
+        'Right': (4, 1550),
+        'Up': (3, 1550),
+        'Down': (3, 1450),
+        'StrafeL': (6, 1450),
+        'StrafeR': (6, 1550)
+    }
+
+    def __init__(self, config):
+        """Summary
+
+        Args:
+            config (argparse.Namespace): Options from add_station_arguments()
+        """
+        self.config = config
+        self.events = queue.Queue()
+        self.bus = TelemetryBus(config.publish, parse_rates(config.publish_rate))
+        self.launchTime = time.perf_counter()
+
+        #Peers, filled in as they come up
+        self.bringup = Bringup()
+        self.master = None
+        self.video = None
+        self.visionLink = None
+        self.hapticsLink = None
+        self.haptics = None
+        self.hapticsIn = [0,0]
+        self.hapticsOut = [0,500]
+        #MAVLink (over UDP) and the touchpad share one asyncio I/O thread
+        self.net = NetCore()
+        self.mavlinkEndpoint = None
+
+        #Latest update of each input, read by the watchdog thread
+        self.loopStamp = None
+        self.telemetryStamp = None
+
+        #initialize experiment setup data
+        self.participant = 0
+        self.repeat = 1
+        self.conditionString = 'No current'
+        #Participant, condition and next repeat survive a crash, interrupted trials are closed as FAIL
+        self.sessionFile = 'logs/session.json'
+        session = load_session(self.sessionFile)
+        self.participant = session.get('participant', self.participant)
+        self.repeat = session.get('repeat', self.repeat)
+        self.conditionString = session.get('condition', self.conditionString)
+        if recover('logs'):
+            print(f"Restored session: participant {self.participant}, {self.conditionString}, repeat {self.repeat}")
+        self.tagSize = 1.12
+        self.touchControlEnabled = False
+        self.armed = False
+
+        #Parameters for ArUco localisation
+        self.aruco_dict_type = ARUCO_DICT['DICT_4X4_100']
+        self.k = np.load("calibration_matrix.npy")
+        self.d = np.load("distortion_coefficients.npy")
+        #Derived from k and d for the stream's resolution once the first frame arrives
+        self.calibration = None
+        self.scheduler = DetectionScheduler(config.target_rate, config.detect_log,
+                                            adaptive=not config.no_adaptive_detection)
+
+        #Logging flags default to false, video files, stills and the pre-trigger buffer are written by the recorder thread
+        #Reticles are rasterized once, views are only composited when displayed, encoded or recorded
+        markupReticle = reticle(100, 10)
+        self.views = {'user': View([reticle(80, 5)]), 'markup': View([markupReticle])}
+        self.rendered = {}
+        self.recorder = Recorder(config.pretrigger_seconds, config.pretrigger_mb, config.recorder_queue_mb,
+                                 overlays=[markupReticle])
+        #Opens the next trial's files in the background, in --parallel mode the vision process records
+        self.trials = TrialController(None if config.parallel else self.recorder, onTransition=self.trial_transition,
+                                      window=config.journal_window)
+        self.logFile = None
+        self.logBytes = 0
+        self.logLock = threading.Lock()
+        self.tlog = None
+        self.sync = None
+        self.streamLog = None
+        self.saveVideo = False
+        self.saveData = False
+
+        self.posZero = 1000
+        self.fingerPos = 1000
+        self.adjustedFingerPos = self.fingerPos
+        self.fingerForce = 512
+        self.adjustedFingerForce = self.fingerForce
+
+        self.averages = 15
+        self.avgx = 0
+        self.avgy = 0
+        self.avgz = 0
+
+        self.avgroll = 0
+        self.avgpitch = 0
+        self.avgyaw = 0
+        self.targetDist = 0
+
+        self.speed = 0
+        self.turn = 0
+
+        self.expTime = 0
+        self.depth = 0
+        self.gndspd = 0
+
+        self.startTime = 0
+        self.startTimePC = 0
+        self.startYaw = 0
+        self.runFail = False
+        self.failReason = 'Unspecified'
+
+        #Telemetry defaults until the vehicle is connected
+        self.msg = {'xacc': 0, 'yacc': 0, 'zacc': 0, 'xgyro': 0, 'ygyro': 0, 'zgyro': 0}
+        self.compassmsg = {'heading': 0, 'groundspeed': 0, 'alt': 0}
+        self.statusmsg = {'battery_remaining': -1}
+        self.batteryLife = -1
+        self.batteryLow = False
+
+        #Haptic cue indicators shown by the frontends, computed from the scene
+        self.indicators = {'vibration': False, 'hard': False}
+        self.scene = HapticScene.load(config.haptic_scene) if config.haptic_scene else HapticScene.default()
+        self.cuesActive = False
+
+        #Shown until the first video frame arrives
+        self.placeholderFrame = cv2.imread("tagSamples/ROVCam_8.jpg")
+        if self.placeholderFrame is None:
+            self.placeholderFrame = np.zeros((720,1280,3), dtype=np.uint8)
+            cv2.putText(self.placeholderFrame, 'Waiting for video...', (480,360), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255,255,255), 2)
+        self.frame = self.rawFrame = self.placeholderFrame
+        #Markers of the latest frame, or the vision process' annotated frame in --parallel mode
+        self.markers, self.tvec, self.rvec = self.detect(self.placeholderFrame)
+        self.visionMarkup = None
+        self.frameCount = 0
+        self.frameTime = time.perf_counter()
+        self.newFrame = True
+        self.videoLatency = float('nan')
+
+        self.stats = soakStats(config.stats_interval, config.stats_file)
+        #Resource growth over long sessions, frontends add their own probes (e.g. canvas items)
+        self.soak = None
+        if config.soak_interval > 0:
+            self.soak = SoakMonitor(config.soak_interval, config.soak_file, topAllocators=config.soak_tracemalloc)
+            self.soak.probe('events', self.events.qsize, tolerance=10)
+            self.soak.probe('recorderQueue', self.recorder.jobs.qsize, tolerance=10)
+        #One encoder for every secondary display
+        self.restreamer = None
+        if config.restream:
+            width, height = config.restream_size
+            self.restreamer = Restreamer(config.restream, width, height, config.restream_fps, config.restream_bitrate)
+        self.start_watchdog()
+        self.start_links()
+
+    '''Events and commands'''
+
+    def emit(self, name, **data):
+        self.events.put((name, data))
+        self.bus.publish_event(name, data)
+
+    def poll_events(self):
+        """Events emitted since the last call
+
+        Returns:
+            list: (name, data) tuples
+        """
+        events = []
+        while True:
+            try:
+                events.append(self.events.get_nowait())
+            except queue.Empty:
+                return events
+
+    def command(self, name, **kwargs):
+        """Run a command by name, e.g. command('start_trial', participant=3, condition='Haptics')"""
+        if name not in self.COMMANDS:
+            raise ValueError(f'Unknown command {name}, try one of {self.COMMANDS}')
+        return getattr(self, name)(**kwargs)
+
+    '''Connection bring-up'''
+
+    def start_links(self):
+        #Bring the peers up concurrently, frontends keep running while they connect
+        config = self.config
+        self.bringup.start('mavlink', self.mavlink_bringup, config.mavlink, config.connect_timeout)
+
+        if config.parallel:
+            #Vision process decodes, detects tags and records, frames come back through shared memory
+            self.visionLink = VisionLink(port=config.video_port, tagSize=self.tagSize, profile=config.video_profile)
+            self.bringup.start('video', self.visionLink.wait_first_frame, config.connect_timeout)
+        else:
+            self.bringup.start('video', self.video_bringup, config.video_port, config.connect_timeout)
+
+        if config.parallel:
+            #Touchpad process shares hapticsIn/hapticsOut with this one
+            self.hapticsLink = HapticsLink(config.haptics_host, config.haptics_port, config.connect_timeout)
+            self.hapticsIn = self.hapticsLink.hapticsIn
+            self.hapticsOut = self.hapticsLink.hapticsOut
+            self.bringup.start('haptics', self.haptics_link_bringup, self.hapticsLink)
+        else:
+            self.bringup.start('haptics', self.haptics_bringup, config.haptics_host, config.haptics_port,
+                               config.connect_timeout)
+
+    def mavlink_bringup(self, connection, timeout):
+        #Connect to blueROV2 over MAVlink
+        if parse_endpoint(connection) is not None:
+            #UDP runs on the network core, which also sends the heartbeats; kept across retries as it owns the port
+            if self.mavlinkEndpoint is None:
+                self.mavlinkEndpoint = self.net.add(MavlinkEndpoint(connection))
+            link = self.mavlinkEndpoint
+            if link.wait_heartbeat(timeout=timeout) is None:
+                raise TimeoutError(f'no heartbeat on {connection} after {timeout}s')
+            print("Connected to robot!")
+        else:
+            #Serial and TCP links keep pymavlink's own connection, MAVLink 2 like the endpoint (see the import)
+            link = mavutil.mavlink_connection(connection)
+            if link.wait_heartbeat(timeout=timeout) is None:
+                link.close()
+                raise TimeoutError(f'no heartbeat on {connection} after {timeout}s')
+            print("Connected to robot!")
+
+            #Start heartbeat thread
+            heartbeatThread = threading.Thread(target=heartbeat_helper, args=(link,))
+            heartbeatThread.daemon = True
+            heartbeatThread.start()
+
+        #Set robot mode
+        change_mode(link, 'ALT_HOLD', timeout)
+        link.wait_heartbeat(timeout=timeout)
+        return link
+
+    def video_bringup(self, port, timeout):
+        #Create video object bound to ROV webcam, kept across retries as it owns the UDP port
+        if self.video is None:
+            self.video = Video(port=port, profile=self.config.video_profile,
+                               gray=self.config.gray_detection, gray_width=self.config.gray_width)
+        return self.video.wait_first_frame(timeout)
+
+    def haptics_bringup(self, host, port, timeout):
+        #Connect to haptic device, the channel keeps reconnecting on its own so it is kept across retries
+        if self.haptics is None:
+            self.haptics = self.net.add(HapticsChannel(host, port, self.hapticsIn, self.hapticsOut,
+                                                       self.config.haptics_transport, timeout))
+        if not self.haptics.wait_connected(timeout):
+            raise TimeoutError(f'touchpad {host}:{port} not connected after {timeout}s')
+        return self.haptics
+
+    @staticmethod
+    def haptics_link_bringup(link):
+        if not link.process.is_alive():
+            link.start()
+        return link.wait_connected()
+
+    def haptics_rtt(self):
+        if self.hapticsLink is not None:
+            return self.hapticsLink.rtt.value
+        return self.haptics.rtt if self.haptics is not None else 0
+
+    def update_links(self):
+        #Pick up peers as they finish connecting
+        for name, status, elapsed, error in self.bringup.changes():
+            print(f"{name} {status} after {elapsed:0.2f}s" + (f": {error}" if error else ""))
+            if status == 'ready':
+                if name == 'mavlink':
+                    self.master = self.bringup.result('mavlink')
+                elif name == 'video':
+                    print(f"Time to first frame: {time.perf_counter() - self.launchTime:0.2f}s")
+            self.emit('link', name=name, status=status, elapsed=elapsed, error=error)
+
+    def reconnect(self):
+        self.bringup.retry()
+
+    '''Per loop processing'''
+
+    def step(self):
+        """Run one iteration of the station: frame, pose, telemetry, haptics, control and logging"""
+        self.loopStamp = time.perf_counter()
+        self.stats.tick(self.haptics_rtt())
+        if self.soak is not None:
+            self.soak.tick()
+        self.scheduler.loop()
+        self.update_links()
+        self.update_frame()
+        self.update_telemetry()
+        self.update_pose()
+        self.update_haptic_cues()
+        self.update_touch_control()
+        if self.saveData:
+            self.log_sample()
+        if self.bus.targets:
+            self.publish_state()
+        if self.runFail:
+            self.end_trial(False, self.failReason)
+        if self.restreamer is not None and self.newFrame and self.restreamer.due():
+            self.restreamer.push(self.view(self.config.restream_view))
+
+    def detect(self, frame):
+        layer = Layer()
+        corners, ids, rvecs, tvecs = detect_markers(frame, self.aruco_dict_type, self.k, self.d, self.tagSize)
+        layer.draw(draw_markers, corners, rvecs, tvecs, self.k, self.d)
+        if len(tvecs) > 0:
+            return layer, tvecs[-1][0][0], rvecs[-1][0][0]
+        return layer, [0,0,0], [0,0,0]
+
+    def update_frame(self):
+        self.newFrame = False
+        if self.visionLink is not None:
+            # Frames and pose were produced by the vision process, copied out of shared memory by latest()
+            latest = self.visionLink.latest() if self.visionLink.frame_available() else None
+            if latest is not None:
+                self.frame, self.visionMarkup, self.tvec, self.rvec = latest
+                self.rawFrame = self.frame
+                self.markers = None
+                self.frameTime = time.perf_counter()
+                self.newFrame = True
+        elif self.video is not None and self.video.frame_available():
+            # Only retrieve, detect and record a frame if it's new, the scheduler decides how hard to look
+            self.frame = self.rawFrame = self.video.frame()
+            self.frameTime = time.perf_counter()
+            if self.calibration is None or self.calibration.size != (self.frame.shape[1], self.frame.shape[0]):
+                self.calibration = CalibrationContext.get(self.frame.shape, self.k, self.d, self.aruco_dict_type, self.tagSize)
+                self.stats.calibration = self.calibration
+            # the gray branch saves a colour conversion, BGR is then only used for display and recording
+            gray = self.video.gray_frame()
+            grayScale = gray.shape[1] / self.frame.shape[1] if gray is not None else 1.0
+            # markers go on a layer, nothing is copied or drawn into until a view is needed
+            self.markers, self.tvec, self.rvec = self.scheduler.detect(self.frame, Layer(), self.aruco_dict_type,
+                                                                       self.k, self.d, self.tagSize, gray, grayScale,
+                                                                       self.calibration)
+            self.newFrame = True
+            #frameCount + 1 is the ID this frame gets below, shared by the recording and the log rows
+            #The recorder composites the markup recording on its own thread
+            self.recorder.frame(self.frame, self.markers, self.frameCount + 1, self.frameTime)
+            if self.config.undistort:
+                # display only, recordings keep the camera's own image
+                self.frame = self.calibration.undistort(self.frame)
+        if self.newFrame:
+            self.frameCount += 1
+            if self.streamLog is not None:
+                self.streamLog.record('vision', self.frameTime, (float(self.tvec[0]), float(self.tvec[1]), float(self.tvec[2]),
+                                                                 float(self.rvec[0]), float(self.rvec[1]), float(self.rvec[2]),
+                                                                 self.scheduler.markerId, self.scheduler.current()))
+
+    def view(self, name):
+        """Latest frame as shown to the operator
+
+        Composited at most once per frame into a buffer that is reused for the next one,
+        copy it to keep it.
+
+        Args:
+            name (str): 'raw', 'user' (reticle) or 'markup' (markers, axes and reticle)
+
+        Returns:
+            np.ndarray: The view
+        """
+        if name == 'raw':
+            return self.frame
+        if name == 'markup' and self.visionMarkup is not None:
+            return self.visionMarkup
+        rendered = self.rendered.get(name)
+        if rendered is None or rendered[0] != self.frameCount:
+            if name == 'markup':
+                # markers are found on the camera's image, undistort after drawing them
+                frame = self.views[name].render(self.rawFrame, self.markers)
+                if self.config.undistort and self.calibration is not None:
+                    frame = self.calibration.undistort(frame)
+            else:
+                frame = self.views[name].render(self.frame)
+            rendered = self.rendered[name] = (self.frameCount, frame)
+        return rendered[1]
+
+    @property
+    def tagFrame(self):
+        """Annotated frame, same as view('markup')"""
+        return self.view('markup')
+
+    def frame_shown(self):
+        """Frontends call this once a new frame is on screen, for receive to display latency"""
+        if self.video is not None and self.visionLink is None:
+            self.videoLatency = self.video.latency()
+            self.stats.frame_shown(self.videoLatency)
+
+    def update_telemetry(self):
+        if self.master is not None:
+            newmsg = self.master.recv_match(type=('SCALED_IMU2'), blocking=False)
+            #newmsg = master.messages['SCALED_IMU2']
+            if newmsg is not None:
+                self.msg = newmsg.to_dict()
+                self.telemetryStamp = time.perf_counter()
+
+            newcompassmsg = self.master.messages.get('VFR_HUD')
+            if newcompassmsg is not None:
+                self.compassmsg = newcompassmsg.to_dict()
+
+            newstatusmsg = self.master.messages.get('SYS_STATUS')
+            if newstatusmsg is not None:
+                self.statusmsg = newstatusmsg.to_dict()
+
+        self.batteryLife = self.statusmsg['battery_remaining']
+        if 0 <= self.batteryLife < 20 and not self.batteryLow:
+            self.batteryLow = True
+            self.emit('battery_low', battery=self.batteryLife)
+
+    def update_pose(self):
+        averages = self.averages
+        tvec = self.tvec
+        msg = self.msg
+
+        self.avgx -= self.avgx/averages
+        self.avgx += tvec[0]/averages
+
+        self.avgy -= self.avgy/averages
+        self.avgy += tvec[1]/averages
+
+        self.avgz -= self.avgz/averages
+        self.avgz += tvec[2]/averages
+
+        self.avgroll -= self.avgroll/averages
+        self.avgroll += msg["ygyro"]/averages
+
+        self.avgpitch -= self.avgpitch/averages
+        self.avgpitch += msg["xgyro"]/averages
+
+        '''
+        avgyaw -= avgyaw/averages
+        avgyaw += msg["zgyro"]/averages
+        '''
+
+        self.avgyaw = self.compassmsg['heading']
+        self.gndspd = self.compassmsg['groundspeed']
+        self.depth = self.compassmsg['alt']
+
+        self.targetDist = sqrt((pow(self.avgx,2) + pow((self.avgz-2),2)))
+
+        self.fingerPos = self.hapticsIn[0]
+        self.fingerForce = self.hapticsIn[1]
+
+    def update_haptic_cues(self):
+        if self.conditionString == 'Haptics' and self.saveData:
+            #Only objects near the pose are evaluated, the marker ID selects the objects anchored to it
+            cues = self.scene.cues((self.avgx, self.avgy, self.avgz), self.scheduler.markerId)
+            if self.scene.drive:
+                self.hapticsOut[0] = 1 if cues['vibration'] > 0 else 0
+                self.hapticsOut[1] = int(cues['hardness'])
+            self.set_indicators(vibration=cues['vibration'] > 0, hard=cues['hardness'] > 0)
+            self.cuesActive = True
+        elif self.cuesActive:
+            self.clear_haptic_cues()
+
+    def clear_haptic_cues(self):
+        """Put the touchpad back to the no-cue state the scene leaves it in away from every object"""
+        if self.scene.drive:
+            self.hapticsOut[0] = 0
+            self.hapticsOut[1] = 0
+        self.set_indicators(vibration=False, hard=False)
+        self.cuesActive = False
+
+    def set_indicators(self, **indicators):
+        if any(self.indicators[key] != value for key, value in indicators.items()):
+            self.indicators.update(indicators)
+            self.emit('indicators', **self.indicators)
+
+    def update_touch_control(self):
+        if not self.touchControlEnabled or self.master is None or self.watchdog.stale('haptics'):
+            return
+        fingerPos = self.fingerPos
+        fingerForce = self.fingerForce
+
+        #Saturate bottom of range
+        if fingerForce < 40:
+            self.adjustedFingerForce = 0
+        else:
+            self.adjustedFingerForce = fingerForce
+        self.speed = int(maprange((0,500),(1500,1700),self.adjustedFingerForce))
+        set_rc_channel_pwm(self.master, 5, self.speed)
+
+        #Set some deadzone
+        deadzone = 50
+        if (fingerPos < self.posZero+deadzone and fingerPos > fingerPos-deadzone) or fingerForce<40:
+            self.adjustedFingerPos = self.posZero
+        else:
+            self.adjustedFingerPos = fingerPos
+        self.turn = int(maprange((0,self.posZero*2),(1400,1600),fingerPos))             #Need to tune turn rate
+        if self.turn<1100:
+            self.turn=1100
+        print(fingerPos)
+        set_rc_channel_pwm(self.master, 4, self.turn)
+
+    def log_sample(self):
+        self.expTime = time.time() - self.startTime
+        #Check failure conditions
+        if (self.expTime) > 120:
+            self.runFail = True
+            self.failReason = 'timeout'
+            print('FAIL - timeout')
+
+        msg = self.msg
+        log={
+            'time': time.perf_counter()-self.startTimePC,
+            'xacc': msg["xacc"],
+            'yacc': msg["yacc"],
+            'zacc': msg["zacc"],
+            'xgyro': msg["xgyro"],
+            'ygyro': msg["ygyro"],
+            'zgyro': msg["zgyro"],
+            'fingerZero': self.posZero,
+            'fingerPos': self.fingerPos,
+            'fingerForce': self.fingerForce,
+            'adjustedFingerPos': self.adjustedFingerPos,
+            'adjustedFingerForce': self.adjustedFingerForce,
+            'vibration': self.hapticsOut[0],
+            'hardness': self.hapticsOut[1],
+            'visualTranslation0': self.tvec[0],
+            'visualTranslation1': self.tvec[1],
+            'visualTranslation2': self.tvec[2],
+            'visualRotation0': self.rvec[0],
+            'visualRotation1': self.rvec[1],
+            'visualRotation2': self.rvec[2],
+            'avgxloc': self.avgx,
+            'avgyloc': self.avgy,
+            'avgzloc': self.avgz,
+            'heading': self.avgyaw,
+            'tgtDist': self.targetDist,
+            'speedDemand': self.speed,
+            'turnDemand': self.turn,
+            'groundSpeed': self.gndspd,
+            'depth': self.depth,
+            'detectLevel': self.scheduler.current(),
+            'poseAge': self.scheduler.poseAge,
+            'frame': self.frameCount,
+            'frameTime': self.frameTime-self.startTimePC
+        }
+        #One write, the watchdog thread may log events at any time
+        with self.logLock:
+            if self.sync is not None:
+                self.sync.row(self.frameCount, self.logBytes)
+            self.write_log(json.dumps(log) + '\n')
+
+    def publish_state(self):
+        #Rate limits are checked first so skipped topics cost nothing
+        now = time.perf_counter()
+        bus = self.bus
+        if bus.due('pose', now):
+            bus.publish('pose', self.avgx, self.avgy, self.avgz, self.avgroll, self.avgpitch, self.avgyaw,
+                        self.targetDist, self.tvec[0], self.tvec[1], self.tvec[2], min(self.scheduler.poseAge, 65535))
+        if bus.due('mavlink', now):
+            msg = self.msg
+            bus.publish('mavlink', msg['xacc'], msg['yacc'], msg['zacc'], msg['xgyro'], msg['ygyro'], msg['zgyro'],
+                        self.compassmsg['heading'], self.gndspd, self.depth, self.batteryLife)
+        if bus.due('haptics', now):
+            bus.publish('haptics', self.fingerPos, self.fingerForce, int(self.hapticsOut[0]), int(self.hapticsOut[1]),
+                        self.speed, self.turn, self.touchControlEnabled)
+
+    '''Watchdog'''
+
+    DEADLINES = {'loop': 0.5, 'haptics': 0.5, 'video': 1.0, 'mavlink': 1.5}
+
+    def start_watchdog(self):
+        deadlines = dict(self.DEADLINES)
+        for item in self.config.deadline:
+            name, _, deadline = item.partition('=')
+            if name not in deadlines:
+                raise ValueError(f'unknown watchdog input {name}')
+            deadlines[name] = float(deadline)
+        self.watchdog = Watchdog(self.watchdog_trip, self.watchdog_clear, self.config.watchdog_period)
+        self.watchdog.watch('loop', lambda: self.loopStamp, deadlines['loop'])
+        self.watchdog.watch('haptics', self.haptics_stamp, deadlines['haptics'])
+        self.watchdog.watch('video', self.video_stamp, deadlines['video'])
+        self.watchdog.watch('mavlink', lambda: self.telemetryStamp, deadlines['mavlink'])
+        self.watchdog.start()
+
+    def haptics_stamp(self):
+        if self.hapticsLink is not None:
+            return self.hapticsLink.stamp.value or None
+        return self.haptics.stamp if self.haptics is not None else None
+
+    def video_stamp(self):
+        if self.visionLink is not None:
+            return self.visionLink.last_frame_time()
+        return self.video.last_frame_time if self.video is not None else None
+
+    def watchdog_trip(self, name, age):
+        #Runs on the watchdog thread, possibly while the loop is stuck
+        if name == 'loop' and self.armed and self.master is not None:
+            #Nothing is updating the overrides, hold the vehicle still
+            clearMotion(self.master)
+        elif name == 'haptics' and self.touchControlEnabled:
+            #Touch control would keep commanding the last speed and turn
+            self.set_touch_control(False)
+            if self.master is not None:
+                clearMotion(self.master)
+        elif name == 'video':
+            #Same as no tag found rather than the last pose
+            self.tvec = [0,0,0]
+            self.rvec = [0,0,0]
+        self.log_event(f"watchdog: {name} stale for {age:0.2f}s")
+        self.emit('watchdog', input=name, stale=True, age=age)
+
+    def watchdog_clear(self, name, age):
+        self.log_event(f"watchdog: {name} fresh again")
+        self.emit('watchdog', input=name, stale=False, age=age)
+
+    '''Trial lifecycle'''
+
+    def start_trial(self, participant, repeat, condition=None):
+        """Start recording video and data for a trial
+
+        Args:
+            participant (str): Participant ID
+            repeat (int): Repeat number
+            condition (str, optional): Haptics/NoHaptics/NoCurrent/Training, keeps the last one if None
+        """
+        if self.saveData:
+            print("Trial already running")
+            return
+        #Stamp the start on the sample clock before anything else, pre-trigger frames get negative times
+        self.startTimePC = time.perf_counter()
+        self.startFrame = self.frameCount
+        print("Saving video/data")
+        self.posZero = self.fingerPos
+        print(f"Touchpad zero set to {self.posZero}")
+        self.startTime = time.time()
+        self.startYaw = self.avgyaw
+        if condition:
+            self.conditionString = condition
+        self.participant = participant
+        self.repeat = int(repeat)
+        filename = f"logs/PID_{self.participant}_CONDITION_{self.conditionString}_REPEAT_{self.repeat}_TIME_{time.ctime(self.startTime)}"
+        if self.visionLink is not None:
+            self.visionLink.start_recording(filename + "_raw.avi", filename + "_markup.avi", self.trials.fps)
+            sinks = self.trials.start(filename, self.startTimePC)
+        else:
+            #Links each recorded frame to its log rows
+            self.sync = SyncIndexWriter(filename + "_sync.npz", self.startTimePC)
+            sinks = self.trials.start(filename, self.startTimePC, onFrame=self.sync.frame_written)
+        #Files were opened in the background under temporary names, renamed once the trial is finished
+        self.logFile = sinks.logFile
+        self.logBytes = 0
+        self.write_log(f"{self.startTimePC}: Trial conducted on: {time.ctime(self.startTime)}\n")
+        self.write_log(f"{self.startTimePC}: Start frame: {self.startFrame}\n")
+        self.write_log(f"{self.startTimePC}: Initial heading: {self.startYaw}\n")
+        self.saveVideo = True
+        self.saveData = True
+        if self.master is not None:
+            #Every MAVLink packet of the trial, indexed by station time and frame number
+            self.tlog = TlogWriter(filename + ".tlog", self.startTimePC, lambda: self.frameCount)
+            self.tlog.start(self.master)
+        if not self.config.no_multirate_log:
+            #Every source at its own rate, next to the per-loop log and renamed with it
+            self.streamLog = MultiRateLog(sinks.tempPrefix, self.startTimePC, lambda: self.frameCount)
+            if self.master is not None:
+                self.streamLog.attach_mavlink(self.master)
+            if isinstance(self.haptics, HapticsChannel):
+                self.streamLog.attach_haptics(self.haptics)
+        self.save_session()
+        self.emit('trial_started', participant=self.participant, condition=self.conditionString, repeat=self.repeat)
+
+    def end_trial(self, passed, reason='Unspecified'):
+        """Finish the running trial as a pass or a fail
+
+        Args:
+            passed (bool): True for PASS, False for FAIL
+            reason (str, optional): Failure reason written to the log
+        """
+        self.runFail = False
+        if not self.saveData:
+            return
+        print("No longer saving video/Data")
+        with self.logLock:
+            self.write_log('PASS\n' if passed else "FAIL - "+reason+"\n")
+            self.write_log(f"{time.perf_counter()}: Trial concluded at: {time.ctime(time.time())}\n")
+            self.saveVideo = False
+            self.saveData = False
+            self.logFile = None
+        if self.visionLink is not None:
+            self.visionLink.stop_recording()
+        #Closing, the sync index and renaming happen on the trial thread
+        self.trials.end(self.sync, self.tlog, self.streamLog)
+        self.sync = None
+        self.tlog = None
+        self.streamLog = None
+        #The scene only drives the touchpad during a Haptics trial, don't leave it on the last cue
+        if self.cuesActive:
+            self.clear_haptic_cues()
+        self.repeat = self.repeat + 1
+        self.failReason = 'Unspecified'
+        self.save_session()
+        self.emit('trial_ended', result='PASS' if passed else 'FAIL', reason=reason, repeat=self.repeat)
+
+    def trial_transition(self, name, blocked, background):
+        self.emit('trial_transition', name=name, blocked=blocked, background=background)
+
+    def log_event(self, text):
+        if self.saveData:
+            with self.logLock:
+                if self.logFile is not None:
+                    self.write_log(f"{time.perf_counter()}: {text}\n")
+
+    def write_log(self, text):
+        #Keeps the byte offset for the sync index, the journal reports how many bytes a record takes
+        self.logBytes += self.logFile.write(text)
+
+    def save_session(self):
+        #On the trial thread, an fsync has no place in the loop
+        self.trials.defer(save_session, self.sessionFile, participant=self.participant,
+                          condition=self.conditionString, repeat=self.repeat)
+
+    '''Vehicle commands'''
+
+    def arm(self):
+        clearMotion(self.master)
+        # Arm
+        # master.arducopter_arm() or:
+        self.master.mav.command_long_send(
+            self.master.target_system,
+            self.master.target_component,
+            mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,
+            0,
+            1, 21196, 0, 0, 0, 0, 0)
+
+        # wait until arming confirmed (can manually check with master.motors_armed())
+        print("Waiting for the vehicle to arm...")
+        self.master.motors_armed_wait()
+        lightOn(self.master)
+        print('Armed!')
+        self.log_event("Armed!")
+        self.armed = True
+        self.emit('armed')
+
+    def disarm(self):
+        clearMotion(self.master)
+        # Disarm
+        # master.arducopter_disarm() or:
+        self.master.mav.command_long_send(
+            self.master.target_system,
+            self.master.target_component,
+            mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,
+            0,
+            0, 21196, 0, 0, 0, 0, 0)
+
+        # wait until disarming confirmed
+        print("Waiting for the vehicle to disarm...")
+        self.master.motors_disarmed_wait()
+        print('Disarmed!')
+        lightOff(self.master)
+        self.log_event("Disarmed!")
+        self.armed = False
+        self.emit('disarmed')
+
+    def all_stop(self):
+        print("stop")
+        clearMotion(self.master)
+
+    def move(self, direction):
+        """Nudge the vehicle, direction is one of MOVES"""
+        print(direction)
+        channel, pwm = self.MOVES[direction]
+        set_rc_channel_pwm(self.master, channel, pwm)
+
+    def straighten(self):
+        print("Straighten")
+        set_rc_channel_pwm(self.master, 3, 1500)
+        set_rc_channel_pwm(self.master, 4, 1500)
+        set_rc_channel_pwm(self.master, 6, 1500)
+
+    def set_mode(self, mode):
+        accepted = change_mode(self.master, mode, self.config.connect_timeout)
+        if accepted:
+            self.master.wait_heartbeat(timeout=self.config.connect_timeout)
+        self.emit('mode', mode=mode, accepted=accepted)
+        return accepted
+
+    def light_signal(self, fast, slow=0):
+        threading.Thread(target=lightSignal, args=(self.master,fast,slow)).start()
+
+    def emergency(self):
+        print("Emergency pressed")
+        self.emit('emergency')
+        if self.master is not None:
+            self.light_signal(1000)
+
+    '''Haptics commands'''
+
+    def set_touch_control(self, enabled=None):
+        """Enable/disable driving with the touchpad, toggles if enabled is None"""
+        self.touchControlEnabled = (not self.touchControlEnabled) if enabled is None else enabled
+        self.emit('touch_control', enabled=self.touchControlEnabled)
+
+    def set_vibration(self, on):
+        self.hapticsOut[0] = 1 if on else 0           #Signal to start/stop vibrating
+        self.set_indicators(vibration=bool(on))
+
+    def set_hardness(self, hardness):
+        self.hapticsOut[1] = hardness                  #500 for max hardness, 0 for min
+        self.set_indicators(hard=hardness > 0)
+
+    def zero_touchpad(self):
+        self.posZero = self.fingerPos
+        print(f"Touchpad zero set to {self.posZero}")
+
+    def print_touch(self):
+        print((self.fingerPos,self.fingerForce))
+
+    '''Vision commands'''
+
+    def set_tag_size(self, tagSize):
+        if tagSize <= 0 or tagSize == self.tagSize:
+            return
+        self.tagSize = tagSize
+        if self.calibration is not None:
+            self.calibration.set_tag_size(tagSize)
+        if self.visionLink is not None:
+            self.visionLink.set_tag_size(tagSize)
+
+    def still(self, kind, frame=None):
+        """Save the latest 'raw', 'circle' (reticle) or 'cv' (annotated) frame, or a frontend's own view, as a JPEG in the background"""
+        if frame is None:
+            # views are reused for the next frame, the recorder gets its own copy
+            frame = self.view({'raw': 'raw', 'circle': 'user', 'cv': 'markup'}[kind]).copy()
+        self.recorder.still(f'ROVCam_{kind}_'+str(time.time())+'.jpg', frame)
+
+    def save_clip(self):
+        """Export the pre-trigger buffer (the last few seconds) as a pair of videos"""
+        self.recorder.clip('ROVCam_clip_'+str(time.time()))
+
+    def close(self):
+        if self.saveData:
+            self.end_trial(False, 'station closed')
+        if self.hapticsLink is not None:
+            self.hapticsLink.close()
+        print(f"network: {self.net.summary()}")
+        self.net.close()
+        if self.visionLink is not None:
+            self.visionLink.close()
+        print(f"detection levels: {self.scheduler.summary()}")
+        self.scheduler.close()
+        self.trials.close()
+        print(f"trial transitions: {self.trials.summary()}")
+        print(f"haptic scene: {self.scene.summary()}")
+        if self.soak is not None:
+            self.soak.close()
+        if self.restreamer is not None:
+            self.restreamer.stop()
+            print(f"restream: {self.restreamer.summary()}")
+        self.recorder.close()
+        self.bus.close()
+        self.watchdog.stop()
+        print(f"watchdog: {self.watchdog.summary()}")
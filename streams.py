@@ -0,0 +1,393 @@
+'''Several camera streams (or ROVs) served by one shared pool of ArUco detectors
+
+Each Stream owns its Video, frame ring, optional MAVLink telemetry, recording and
+statistics. A single DetectorPool of worker processes serves every stream: frames stay
+in the stream's shared-memory FrameRing and only (stream, seq) requests cross the
+process boundary. Scheduling is round robin over streams with a frame waiting and each
+stream only ever has its newest frame queued, so a busy stream cannot starve the others.
+
+    python streams.py --stream front:5600 --stream rear:5602:udpin:0.0.0.0:14551 --workers 3
+    python streams.py --benchmark --max-streams 4 --seconds 10
+'''
+
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+
+import numpy as np
+
+from parallel import FrameRing
+
+
+def detectorWorker(workerId, requests, results, aruco_dict_type, k, d):
+    """Detector process: attaches to stream rings on demand and detects markers
+
+    Args:
+        workerId (int): Index of this worker
+        requests (Queue): (stream, ringSpec, seq, tagSize) or None to stop
+        results (Queue): (workerId, stream, seq, ids, tvec, rvec, detectTime, valid)
+    """
+    from vision import detect_markers
+
+    rings = {}
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+        stream, ringSpec, seq, tagSize = request
+        ring = rings.get(stream)
+        if ring is None or ring.spec()['name'] != ringSpec['name']:
+            if ring is not None:
+                ring.close()
+            try:
+                ring = rings[stream] = FrameRing(**ringSpec)
+            except FileNotFoundError:
+                # the stream was closed after this frame was dispatched, report back so we stay in the pool
+                rings.pop(stream, None)
+                results.put((workerId, stream, seq, None, [0, 0, 0], [0, 0, 0], 0.0, False))
+                continue
+
+        started = time.perf_counter()
+        entry = ring.read(seq)
+        ids = None
+        tvec = rvec = [0, 0, 0]
+        valid = entry is not None
+        if valid:
+            corners, ids, rvecs, tvecs = detect_markers(entry[1], aruco_dict_type, k, d, tagSize)
+            # the slot may have been reused while we were reading it
+            valid = ring.valid(seq)
+            if len(tvecs) > 0:
+                tvec = list(tvecs[-1][0][0])
+                rvec = list(rvecs[-1][0][0])
+            ids = None if ids is None else ids.flatten().tolist()
+        results.put((workerId, stream, seq, ids, tvec, rvec, time.perf_counter() - started, valid))
+
+    for ring in rings.values():
+        ring.close()
+
+
+class DetectorPool():
+    """Shared pool of ArUco detector processes with fair scheduling across streams
+
+    Attributes:
+        workers (int): Number of detector processes
+        pending (dict): Stream name -> newest (ringSpec, seq, tagSize) not yet dispatched
+        streams (dict): Stream name -> object with an on_detection() method
+    """
+
+    def __init__(self, workers=None, aruco_dict_type=None, k=None, d=None):
+        """Summary
+
+        Args:
+            workers (int, optional): Number of processes, defaults to cores - 1
+            aruco_dict_type (int, optional): ArUco dictionary, defaults to DICT_4X4_100
+            k (np.ndarray, optional): Camera matrix, defaults to calibration_matrix.npy
+            d (np.ndarray, optional): Distortion coefficients, defaults to distortion_coefficients.npy
+        """
+        if aruco_dict_type is None:
+            from utils import ARUCO_DICT
+            aruco_dict_type = ARUCO_DICT['DICT_4X4_100']
+        if k is None:
+            k = np.load("calibration_matrix.npy")
+        if d is None:
+            d = np.load("distortion_coefficients.npy")
+
+        self.workers = workers or max(1, multiprocessing.cpu_count() - 1)
+        ctx = multiprocessing.get_context('spawn')
+        self.results = ctx.Queue()
+        self.requests = []
+        self.processes = []
+        for workerId in range(self.workers):
+            requests = ctx.Queue()
+            process = ctx.Process(target=detectorWorker, name=f'detector-{workerId}',
+                                  args=(workerId, requests, self.results, aruco_dict_type, k, d))
+            process.daemon = True
+            process.start()
+            self.requests.append(requests)
+            self.processes.append(process)
+
+        self.idle = list(range(self.workers))
+        self.pending = {}
+        self.order = []
+        self.streams = {}
+        self.lock = threading.Lock()
+        self.running = True
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, name='detector-dispatch')
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    def add_stream(self, stream):
+        with self.lock:
+            self.streams[stream.name] = stream
+            self.order.append(stream.name)
+
+    def remove_stream(self, name):
+        """Stop scheduling a stream, its undispatched frame is dropped and late results are ignored"""
+        with self.lock:
+            self.streams.pop(name, None)
+            self.pending.pop(name, None)
+            if name in self.order:
+                self.order.remove(name)
+
+    def submit(self, name, ring, seq, tagSize):
+        """Queue a frame for detection, replacing any older frame of the same stream
+
+        Returns:
+            bool: True if an older undispatched frame was dropped
+        """
+        with self.lock:
+            dropped = name in self.pending
+            self.pending[name] = (ring.spec(), seq, tagSize)
+        return dropped
+
+    def _dispatch(self):
+        # round robin over streams with a frame waiting, one frame per idle worker
+        with self.lock:
+            while self.idle and self.pending:
+                for _ in range(len(self.order)):
+                    name = self.order.pop(0)
+                    self.order.append(name)
+                    if name in self.pending:
+                        break
+                ringSpec, seq, tagSize = self.pending.pop(name)
+                workerId = self.idle.pop()
+                self.requests[workerId].put((name, ringSpec, seq, tagSize))
+
+    def _dispatch_loop(self):
+        while self.running:
+            self._dispatch()
+            try:
+                result = self.results.get(timeout=0.002)
+            except queue.Empty:
+                continue
+            workerId, name = result[0], result[1]
+            with self.lock:
+                self.idle.append(workerId)
+                stream = self.streams.get(name)
+            if stream is not None:
+                stream.on_detection(*result[2:])
+
+    def close(self):
+        self.running = False
+        for requests in self.requests:
+            requests.put(None)
+        for process in self.processes:
+            process.join(timeout=2)
+            if process.is_alive():
+                process.terminate()
+
+
+class StreamStats():
+    """Per stream frame, detection and latency counters"""
+
+    def __init__(self):
+        self.frames = 0
+        self.detections = 0
+        self.found = 0
+        self.dropped = 0
+        self.stale = 0
+        self.detectTime = 0.0
+        self.latency = 0.0
+
+    def snapshot(self):
+        return dict(self.__dict__)
+
+
+class Stream():
+    """One camera (and optionally its vehicle) served by a DetectorPool
+
+    Attributes:
+        name (str): Stream name
+        video (Video): Video source, None for synthetic streams fed with push()
+        ring (FrameRing): Shared frames read by the detector workers
+        master (object): Optional MAVLink connection for this stream's vehicle
+        telemetry (dict): Latest message dicts by type
+        pose (tuple): Latest (tvec, rvec, ids)
+        stats (StreamStats): Counters
+    """
+
+    def __init__(self, name, pool, port=None, mavlink=None, tagSize=1.12, shape=(720, 1280, 3)):
+        self.name = name
+        self.pool = pool
+        self.tagSize = tagSize
+        self.ring = FrameRing(shape, slots=4)
+        self.stamps = {}
+        self.video = None
+        if port is not None:
+            from video import Video
+            self.video = Video(port=port, name=name)
+        self.master = None
+        if mavlink:
+            from pymavlink import mavutil
+            self.master = mavutil.mavlink_connection(mavlink)
+        self.telemetry = {}
+        self.pose = ([0, 0, 0], [0, 0, 0], None)
+        self.writer = None
+        self.stats = StreamStats()
+        pool.add_stream(self)
+
+    def push(self, frame):
+        """Publish a frame to the detectors (and the recording)"""
+        if frame.shape != self.ring.shape:
+            import cv2
+            frame = cv2.resize(frame, (self.ring.shape[1], self.ring.shape[0]))
+        timestamp = time.perf_counter()
+        seq = self.ring.write(frame, timestamp)
+        self.stamps[seq % self.ring.slots] = timestamp
+        self.stats.frames += 1
+        if self.writer is not None:
+            self.writer.write(frame)
+        if self.pool.submit(self.name, self.ring, seq, self.tagSize):
+            self.stats.dropped += 1
+
+    def poll(self):
+        """Pull a new video frame and telemetry, if any"""
+        if self.video is not None and self.video.frame_available():
+            self.push(self.video.frame())
+        if self.master is not None:
+            msg = self.master.recv_match(blocking=False)
+            while msg is not None:
+                self.telemetry[msg.get_type()] = msg.to_dict()
+                msg = self.master.recv_match(blocking=False)
+
+    def on_detection(self, seq, ids, tvec, rvec, detectTime, valid):
+        # called from the pool's dispatcher thread
+        stats = self.stats
+        stats.detections += 1
+        stats.detectTime += detectTime
+        if not valid:
+            stats.stale += 1
+            return
+        stats.latency += time.perf_counter() - self.stamps.get(seq % self.ring.slots, time.perf_counter())
+        if ids:
+            stats.found += 1
+        self.pose = (tvec, rvec, ids)
+
+    def start_recording(self, filename, fps=17.4):
+        import cv2
+        height, width = self.ring.shape[:2]
+        self.writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+
+    def stop_recording(self):
+        if self.writer is not None:
+            self.writer.release()
+            self.writer = None
+
+    def close(self):
+        # before the ring goes, so no worker is sent a frame of it afterwards
+        self.pool.remove_stream(self.name)
+        self.stop_recording()
+        self.ring.close()
+
+
+def synthetic_frames(count=30, shape=(720, 1280, 3), markerId=0, markerSize=200):
+    """Frames with an ArUco marker moving across a grey background, for benchmarking"""
+    import cv2
+    from utils import ARUCO_DICT
+    dictionary = cv2.aruco.Dictionary_get(ARUCO_DICT['DICT_4X4_100'])
+    marker = cv2.aruco.drawMarker(dictionary, markerId, markerSize)
+    # white quiet zone so the marker border is detectable
+    marker = cv2.copyMakeBorder(marker, 20, 20, 20, 20, cv2.BORDER_CONSTANT, value=255)
+    marker = cv2.cvtColor(marker, cv2.COLOR_GRAY2BGR)
+    height, width = shape[:2]
+    frames = []
+    for i in range(count):
+        frame = np.full(shape, 90, dtype=np.uint8)
+        x = int((width - marker.shape[1]) * i / max(1, count - 1))
+        y = (height - marker.shape[0]) // 2
+        frame[y:y + marker.shape[0], x:x + marker.shape[1]] = marker
+        frames.append(frame)
+    return frames
+
+
+def benchmark(maxStreams=4, workers=None, seconds=10, fps=30):
+    """Throughput of the detector pool with 1..maxStreams synthetic streams
+
+    Every stream offers frames at fps, so total offered load grows with the number of
+    streams and throughput should rise roughly linearly until the workers saturate.
+
+    Returns:
+        list: One dict per stream count with throughput, fairness and latency
+    """
+    pool = DetectorPool(workers)
+    frames = synthetic_frames()
+    report = []
+    print(f"detector pool: {pool.workers} workers, {fps} fps offered per stream, {seconds}s per run")
+    print(f"{'streams':>7} {'offered/s':>10} {'detected/s':>11} {'per stream/s':>24} {'latency ms':>11} {'dropped':>8}")
+    for n in range(1, maxStreams + 1):
+        streams = [Stream(f'synthetic{n}-{i}', pool) for i in range(n)]
+        startTime = time.perf_counter()
+        nextFrame = startTime
+        i = 0
+        while time.perf_counter() - startTime < seconds:
+            for stream in streams:
+                stream.push(frames[i % len(frames)])
+            i += 1
+            nextFrame += 1.0 / fps
+            time.sleep(max(0, nextFrame - time.perf_counter()))
+        time.sleep(0.5)     # let outstanding detections finish
+        elapsed = time.perf_counter() - startTime
+
+        rates = [stream.stats.detections / elapsed for stream in streams]
+        done = sum(stream.stats.detections - stream.stats.stale for stream in streams)
+        latency = sum(stream.stats.latency for stream in streams) / max(1, done)
+        dropped = sum(stream.stats.dropped for stream in streams)
+        row = {'streams': n, 'offered': n * i / elapsed, 'detected': sum(rates), 'perStream': rates,
+               'latency': latency, 'dropped': dropped}
+        report.append(row)
+        perStream = ' '.join(f'{rate:0.1f}' for rate in rates)
+        print(f"{n:>7} {row['offered']:>10.1f} {row['detected']:>11.1f} {perStream:>24} {latency * 1000:>11.1f} {dropped:>8}")
+        for stream in streams:
+            stream.close()
+    pool.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run several camera streams through one shared detector pool')
+    parser.add_argument('--stream', action='append', default=[],
+                        help='name:port[:mavlink connection], may be repeated')
+    parser.add_argument('--workers', type=int, default=None, help='detector processes (default cores - 1)')
+    parser.add_argument('--record', default=None, help='record every stream to <prefix>_<name>.avi')
+    parser.add_argument('--stats-interval', type=float, default=5)
+    parser.add_argument('--duration', type=float, default=0)
+    parser.add_argument('--benchmark', action='store_true', help='measure scaling with synthetic streams')
+    parser.add_argument('--max-streams', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10, help='benchmark run length per stream count')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.max_streams, args.workers, args.seconds)
+        return
+
+    pool = DetectorPool(args.workers)
+    streams = []
+    for definition in args.stream:
+        name, port, *mavlink = definition.split(':', 2)
+        stream = Stream(name, pool, port=int(port), mavlink=mavlink[0] if mavlink else None)
+        if args.record:
+            stream.start_recording(f'{args.record}_{name}.avi')
+        streams.append(stream)
+
+    startTime = lastReport = time.perf_counter()
+    try:
+        while not args.duration or time.perf_counter() - startTime < args.duration:
+            for stream in streams:
+                stream.poll()
+            if time.perf_counter() - lastReport > args.stats_interval:
+                lastReport = time.perf_counter()
+                for stream in streams:
+                    print(stream.name, stream.stats.snapshot(), stream.pose)
+            time.sleep(0.001)
+    except KeyboardInterrupt:
+        pass
+
+    for stream in streams:
+        stream.close()
+    pool.close()
+
+
+if __name__ == '__main__':
+    main()
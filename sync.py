@@ -0,0 +1,134 @@
+'''Frame-accurate index between a trial's video recordings and its sample log
+
+Every frame the station processes has a frame ID (Station.frameCount) and a
+perf_counter timestamp. Log rows carry the ID and time of the latest frame, and the
+recorder reports the position in the .avi files each frame was actually written at
+(pre-trigger frames first, dropped frames never). The result is saved per trial as
+<trial>_sync.npz:
+
+    frameId, time       per video frame (row = position in _raw.avi/_markup.avi), time
+                        relative to the trial start, pre-trigger frames are negative
+    rowFirst, rowCount  log rows (0 = first JSON row) recorded while the frame was the latest one
+    rowOffset           byte offset of the first of those rows in the .txt log
+    bins                video frame shown at binStart + i * binWidth, for O(1) time lookup
+
+    index = SyncIndex('logs/PID_..._sync.npz')
+    videoFrame = index.frame_at(42.0)
+    rows = index.rows(videoFrame, 'logs/PID_....txt')
+'''
+
+import json
+import threading
+
+import numpy as np
+
+
+class SyncIndexWriter():
+    """Collects frame and log row positions during a trial and writes the index
+
+    Attributes:
+        filename (str): Index file (.npz)
+        startTime (float): perf_counter at the trial start
+        frames (list): (frameId, videoIndex, time) in the order they were written
+        rows (dict): frameId -> [first row, row count, byte offset]
+    """
+
+    def __init__(self, filename, startTime, binWidth=0.01):
+        self.filename = filename
+        self.startTime = startTime
+        self.binWidth = binWidth
+        self.frames = []
+        self.rows = {}
+        self.rowCount = 0
+        self.lock = threading.Lock()
+
+    def frame_written(self, frameId, videoIndex, timestamp):
+        # recorder thread
+        with self.lock:
+            self.frames.append((-1 if frameId is None else frameId, videoIndex, timestamp - self.startTime))
+
+    def row(self, frameId, offset):
+        """Record that the next log row, starting at byte offset, belongs to frameId"""
+        entry = self.rows.get(frameId)
+        if entry is None:
+            self.rows[frameId] = [self.rowCount, 1, offset]
+        else:
+            entry[1] += 1
+        self.rowCount += 1
+
+    def finish(self):
+        """Write the index, call once the recording and the log are closed"""
+        with self.lock:
+            frames = sorted(self.frames, key=lambda frame: frame[1])
+        count = len(frames)
+        frameId = np.array([frame[0] for frame in frames], dtype=np.int64)
+        times = np.array([frame[2] for frame in frames], dtype=np.float64)
+        rowFirst = np.full(count, -1, dtype=np.int64)
+        rowCount = np.zeros(count, dtype=np.int32)
+        rowOffset = np.full(count, -1, dtype=np.int64)
+        for i, fid in enumerate(frameId):
+            entry = self.rows.get(int(fid))
+            if entry is not None:
+                rowFirst[i], rowCount[i], rowOffset[i] = entry
+
+        binStart = float(times[0]) if count else 0.0
+        if count:
+            binTimes = np.arange(binStart, times[-1] + self.binWidth, self.binWidth)
+            # latest frame at or before each bin, times are in recording order
+            bins = np.clip(np.searchsorted(times, binTimes, side='right') - 1, 0, count - 1).astype(np.int32)
+        else:
+            bins = np.zeros(0, dtype=np.int32)
+
+        np.savez(self.filename, frameId=frameId, time=times, rowFirst=rowFirst, rowCount=rowCount,
+                 rowOffset=rowOffset, bins=bins, binStart=binStart, binWidth=self.binWidth,
+                 startTime=self.startTime)
+        print(f"Saved sync index: {count} video frames, {self.rowCount} log rows")
+
+
+class SyncIndex():
+    """Random access between video frames, trial time and log rows"""
+
+    def __init__(self, filename):
+        with np.load(filename) as data:
+            self.frameId = data['frameId']
+            self.time = data['time']
+            self.rowFirst = data['rowFirst']
+            self.rowCount = data['rowCount']
+            self.rowOffset = data['rowOffset']
+            self.bins = data['bins']
+            self.binStart = float(data['binStart'])
+            self.binWidth = float(data['binWidth'])
+
+    def frame_at(self, t):
+        """Video frame (position in the .avi files) shown t seconds into the trial, None if no frame was recorded"""
+        if len(self.bins) == 0:
+            return None
+        i = int((t - self.binStart) / self.binWidth)
+        return int(self.bins[min(max(i, 0), len(self.bins) - 1)])
+
+    def video_frame(self, frameId):
+        """Position in the .avi files of a station frame ID, None if it was not recorded"""
+        # IDs increase with the position, so this is a search rather than a lookup
+        i = int(np.searchsorted(self.frameId, frameId))
+        return i if i < len(self.frameId) and self.frameId[i] == frameId else None
+
+    def rows(self, videoFrame, logFilename):
+        """Log rows recorded while a video frame was the latest one
+
+        Returns:
+            list: Decoded JSON rows
+        """
+        count = int(self.rowCount[videoFrame])
+        if count == 0:
+            return []
+        rows = []
+        with open(logFilename, 'rb') as logFile:
+            logFile.seek(int(self.rowOffset[videoFrame]))
+            while len(rows) < count:
+                line = logFile.readline()
+                if not line:
+                    break
+                # event lines (e.g. from the watchdog) can sit between sample rows
+                if line.startswith(b'{'):
+                    rows.append(json.loads(line))
+        return rows
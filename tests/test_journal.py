@@ -0,0 +1,145 @@
+'''Crash recovery of trial logs: journal.recover() and journal.repair_avi()'''
+
+import os
+import subprocess
+
+import pytest
+
+import journal
+
+
+def dead_pid():
+    # a PID that just exited, as left behind by a crashed station
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+
+def crashed_trial(directory, pid, rows, prefix=None, tail=b''):
+    """A trial log as a station killed mid-trial leaves it: committed rows, no end record"""
+    tempPrefix = os.path.join(directory, f'.pending_{pid}_0')
+    log = journal.Journal(tempPrefix + '.txt', window=0)
+    if prefix is not None:
+        log.meta(prefix=prefix)
+    for row in rows:
+        log.write(row)
+    log.running = False
+    log.file.write(tail)
+    log.file.close()
+    log.index.close()
+    return tempPrefix
+
+
+def test_recover_keeps_committed_rows_and_names_the_trial(tmp_path):
+    prefix = str(tmp_path / 'PID_1_CONDITION_Haptics_REPEAT_1')
+    crashed_trial(str(tmp_path), dead_pid(), ['{"x": 1}\n', '{"x": 2}\n'], prefix, tail=b'{"x": 3')
+
+    assert journal.recover(str(tmp_path)) == [prefix]
+
+    with open(prefix + '.txt', 'rb') as logFile:
+        lines = logFile.read().splitlines()
+    assert lines[:2] == [b'{"x": 1}', b'{"x": 2}']
+    assert b'RECOVERED - 2 of 2 records intact, 7 bytes after them dropped' in lines[2]
+    assert lines[3] == b'FAIL - interrupted'
+    assert os.listdir(tmp_path) == [os.path.basename(prefix) + '.txt']
+
+
+def test_recover_cuts_the_log_at_a_corrupt_record(tmp_path):
+    prefix = str(tmp_path / 'PID_2')
+    tempPrefix = crashed_trial(str(tmp_path), dead_pid(), ['first\n', 'second\n', 'third\n'], prefix)
+    with open(tempPrefix + '.txt', 'r+b') as logFile:
+        logFile.seek(len('first\n'))
+        logFile.write(b'X')
+
+    journal.recover(str(tmp_path))
+
+    with open(prefix + '.txt', 'rb') as logFile:
+        lines = logFile.read().splitlines()
+    assert lines[0] == b'first'
+    assert b'1 of 3 records intact' in lines[1]
+
+
+def test_recover_names_a_trial_that_crashed_before_its_name_was_recorded(tmp_path):
+    pid = dead_pid()
+    crashed_trial(str(tmp_path), pid, ['row\n'])
+
+    recovered = journal.recover(str(tmp_path))
+
+    assert recovered == [str(tmp_path / f'RECOVERED.pending_{pid}_0')]
+    assert os.path.exists(recovered[0] + '.txt')
+
+
+def test_recover_removes_a_trial_that_never_started(tmp_path):
+    tempPrefix = crashed_trial(str(tmp_path), dead_pid(), [])
+    for suffix in ('_raw.avi', '_vision.csv'):
+        open(tempPrefix + suffix, 'wb').close()
+
+    assert journal.recover(str(tmp_path)) == []
+    assert os.listdir(tmp_path) == []
+
+
+def test_recover_renames_the_streams_with_the_log(tmp_path):
+    prefix = str(tmp_path / 'PID_3')
+    tempPrefix = crashed_trial(str(tmp_path), dead_pid(), ['row\n'], prefix)
+    with open(tempPrefix + '_mavlink_HEARTBEAT.csv', 'w') as stream:
+        stream.write('t,frame,type\n0.1,1,6\n')
+
+    journal.recover(str(tmp_path))
+
+    assert sorted(os.listdir(tmp_path)) == ['PID_3.txt', 'PID_3_mavlink_HEARTBEAT.csv']
+
+
+def test_recover_leaves_a_live_station_alone(tmp_path):
+    # this process wrote the log, as the running station does
+    tempPrefix = crashed_trial(str(tmp_path), os.getpid(), ['row\n'], str(tmp_path / 'PID_4'))
+
+    assert journal.recover(str(tmp_path)) == []
+    assert os.path.exists(tempPrefix + '.txt')
+
+
+def test_recover_sees_through_a_reused_pid(tmp_path):
+    if journal._identity(os.getpid()) is None:
+        pytest.skip('no process identity from /proc here')
+    # after a reboot the crashed station's PID belongs to an unrelated process
+    unrelated = subprocess.Popen(['sleep', '30'])
+    try:
+        prefix = str(tmp_path / 'PID_5')
+        crashed_trial(str(tmp_path), unrelated.pid, ['row\n'], prefix)
+        assert journal.recover(str(tmp_path)) == [prefix]
+    finally:
+        unrelated.kill()
+        unrelated.wait()
+
+
+def test_recover_falls_back_to_the_pid_without_an_identity(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, '_identity', lambda pid: None)
+    sleeper = subprocess.Popen(['sleep', '30'])
+    try:
+        crashed_trial(str(tmp_path), sleeper.pid, ['row\n'], str(tmp_path / 'PID_6'))
+        assert journal.recover(str(tmp_path)) == []
+    finally:
+        sleeper.kill()
+        sleeper.wait()
+
+
+def test_repair_avi_rebuilds_an_unclosed_recording(tmp_path):
+    cv2 = pytest.importorskip('cv2')
+    np = pytest.importorskip('numpy')
+    source = str(tmp_path / 'closed.avi')
+    writer = cv2.VideoWriter(source, cv2.VideoWriter_fourcc(*'MJPG'), 20, (64, 48))
+    for i in range(10):
+        writer.write(np.full((48, 64, 3), i * 20, dtype=np.uint8))
+    writer.release()
+    with open(source, 'rb') as avi:
+        data = avi.read()
+    # a writer that never closed: no idx1, and the last frame cut short by the crash
+    unclosed = str(tmp_path / 'unclosed.avi')
+    with open(unclosed, 'wb') as avi:
+        avi.write(data[:data.rfind(b'idx1') - 100])
+
+    frames = journal.repair_avi(unclosed, str(tmp_path / 'repaired.avi'))
+
+    assert frames == 9
+    capture = cv2.VideoCapture(str(tmp_path / 'repaired.avi'))
+    assert int(capture.get(cv2.CAP_PROP_FRAME_COUNT)) == 9
+    capture.release()
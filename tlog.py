@@ -0,0 +1,189 @@
+'''Trial-scoped raw MAVLink capture (.tlog) with a time index
+
+Every MAVLink packet the station receives or sends (RC overrides, commands, heartbeats)
+is captured through pymavlink's message hooks and send callback, or the network core
+endpoint's send hooks, and written by a background thread in the standard tlog format (big-endian 64 bit unix
+time in microseconds followed by the raw packet), so MAVProxy, mavlogdump and friends
+read it as usual. Alongside it an index (.tlog.idx) maps station perf_counter time to
+file offsets and to the station frame number, so tools can seek to a moment of a trial
+instead of scanning the whole capture.
+
+    python tlog.py "logs/PID_1_..._.tlog" --at 42.0       messages from 42 s into the trial
+'''
+
+import argparse
+import bisect
+import queue
+import struct
+import threading
+import time
+
+INDEX_HEADER = struct.Struct('<4sd')       # b'TLIX', trial start (perf_counter)
+INDEX_ROW = struct.Struct('<dQq')          # perf_counter, tlog offset, station frame number
+TLOG_STAMP = struct.Struct('>Q')
+
+
+class TlogWriter():
+    """Captures every MAVLink packet a connection receives or sends to a tlog file
+
+    Attributes:
+        filename (str): tlog file, the index is filename + '.idx'
+        indexInterval (float): Longest time between index rows, s
+        written (int): Packets written
+        dropped (int): Packets lost because the writer fell too far behind
+    """
+
+    def __init__(self, filename, startTime, frameNumber, indexInterval=0.1, queueSize=10000):
+        """Summary
+
+        Args:
+            filename (str): tlog file to create
+            startTime (float): perf_counter at the start of the trial, stored in the index
+            frameNumber (callable): Returns the current station frame number
+            indexInterval (float, optional): Index at least this often, and on every new frame
+            queueSize (int, optional): Packets that can wait for the writer
+        """
+        self.filename = filename
+        self.startTime = startTime
+        self.frameNumber = frameNumber
+        self.indexInterval = indexInterval
+        self.packets = queue.Queue(queueSize)
+        self.written = 0
+        self.dropped = 0
+        self.master = None
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def start(self, master):
+        """Hook into master's received and sent messages and start writing"""
+        self.master = master
+        self.thread = threading.Thread(target=self._run, name='tlog')
+        self.thread.daemon = True
+        self.thread.start()
+        master.message_hooks.append(self.hook)
+        if hasattr(master, 'send_hooks'):
+            master.send_hooks.append(self.hook)
+        else:
+            # pymavlink's own connections have a single send callback, nothing else in the station uses it
+            master.mav.set_send_callback(self._sent)
+
+    def _sent(self, msg):
+        self.hook(self.master, msg)
+
+    def hook(self, master, msg):
+        # called for every message parsed or sent, on whichever thread is reading or sending
+        if msg.get_type() == 'BAD_DATA':
+            return
+        try:
+            self.packets.put_nowait((time.perf_counter(), time.time(), msg.get_msgbuf(), self.frameNumber()))
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        with open(self.filename, 'wb') as tlogFile, open(self.filename + '.idx', 'wb') as indexFile:
+            indexFile.write(INDEX_HEADER.pack(b'TLIX', self.startTime))
+            lastIndexTime = None
+            lastFrame = None
+            while True:
+                try:
+                    packet = self.packets.get(timeout=0.1)
+                except queue.Empty:
+                    if self.stopping.is_set():
+                        break
+                    continue
+                if packet is None:
+                    break
+                perfTime, unixTime, msgbuf, frame = packet
+                if lastIndexTime is None or frame != lastFrame or perfTime - lastIndexTime >= self.indexInterval:
+                    indexFile.write(INDEX_ROW.pack(perfTime, tlogFile.tell(), frame))
+                    lastIndexTime = perfTime
+                    lastFrame = frame
+                tlogFile.write(TLOG_STAMP.pack(int(unixTime * 1e6)))
+                tlogFile.write(msgbuf)
+                self.written += 1
+
+    def stop(self):
+        """Unhook and finish writing in the background, returns straight away"""
+        if self.master is not None:
+            if self.hook in self.master.message_hooks:
+                self.master.message_hooks.remove(self.hook)
+            if hasattr(self.master, 'send_hooks'):
+                if self.hook in self.master.send_hooks:
+                    self.master.send_hooks.remove(self.hook)
+            else:
+                self.master.mav.set_send_callback(None)
+        self.stopping.set()
+        try:
+            # wakes the writer up, when the queue is full it finds the queue empty and the event set instead
+            self.packets.put_nowait(None)
+        except queue.Full:
+            pass
+
+
+def read_index(filename):
+    """Load a .tlog.idx file
+
+    Returns:
+        tuple: (trial start perf_counter, times, offsets, frames), times relative to the trial start
+    """
+    with open(filename, 'rb') as indexFile:
+        data = indexFile.read()
+    magic, startTime = INDEX_HEADER.unpack_from(data)
+    if magic != b'TLIX':
+        raise ValueError(f'{filename} is not a tlog index')
+    times, offsets, frames = [], [], []
+    for perfTime, offset, frame in INDEX_ROW.iter_unpack(data[INDEX_HEADER.size:]):
+        times.append(perfTime - startTime)
+        offsets.append(offset)
+        frames.append(frame)
+    return startTime, times, offsets, frames
+
+
+def seek_time(index, t):
+    """tlog (offset, station frame number) at or just before t seconds into the trial, None if the index is empty"""
+    startTime, times, offsets, frames = index
+    if not times:
+        return None
+    i = max(0, bisect.bisect_right(times, t) - 1)
+    return offsets[i], frames[i]
+
+
+def seek_frame(index, frame):
+    """tlog offset of the first packet received while frame was the latest station frame, None if the index is empty"""
+    startTime, times, offsets, frames = index
+    if not frames:
+        return None
+    i = min(bisect.bisect_left(frames, frame), len(frames) - 1)
+    return offsets[i]
+
+
+def main():
+    from pymavlink import mavutil
+
+    parser = argparse.ArgumentParser(description='Print MAVLink messages from a point in a trial tlog')
+    parser.add_argument('tlog')
+    parser.add_argument('--at', type=float, default=0, help='seconds after the trial start')
+    parser.add_argument('--frame', type=int, default=None, help='station frame number instead of a time')
+    parser.add_argument('--count', type=int, default=20)
+    args = parser.parse_args()
+
+    index = read_index(args.tlog + '.idx')
+    if args.frame is not None:
+        offset = seek_frame(index, args.frame)
+    else:
+        found = seek_time(index, args.at)
+        offset = found[0] if found is not None else None
+    if offset is None:
+        print(f"{args.tlog} has no packets")
+        return
+    log = mavutil.mavlink_connection(args.tlog)
+    log.filehandle.seek(offset)
+    for _ in range(args.count):
+        msg = log.recv_match()
+        if msg is None:
+            break
+        print(f"{msg._timestamp:.3f} {msg}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,247 @@
+'''Trial lifecycle state machine with pre-opened sinks
+
+Opening two MJPG VideoWriters and the log file on Start, and releasing/closing them on
+Pass/Fail, used to run on the loop thread and showed up as a frame hitch at both ends
+of every trial. TrialController opens the next trial's sinks in the background while
+the station is idle, under temporary names (the real names contain the start time),
+so Start only stamps the time and hands the open sinks over. Ending a trial hands them
+back to a worker thread that closes them, writes the sync index and renames everything
+to the trial's name.
+
+    preparing --sinks open--> ready --start()--> running --end()--> finishing
+        ^                                                              |
+        +------------ next trial's sinks opened while finishing <------+
+
+Every transition is timed: how long the caller was blocked, and how long the
+background part took.
+'''
+
+import itertools
+import os
+import queue
+import threading
+import time
+
+from journal import Journal
+from multirate import stream_suffixes
+
+PREPARING = 'preparing'
+READY = 'ready'
+RUNNING = 'running'
+FINISHING = 'finishing'
+
+
+class TrialSinks():
+    """Files of one trial, opened under temporary names
+
+    Attributes:
+        tempPrefix (str): Temporary path prefix the files are open under
+        prefix (str): Final path prefix, set on start
+        logFile (Journal): Open sample log
+        video (bool): Video is recorded through the Recorder under the temporary names
+        streams (MultiRateLog): Per-source streams written under the temporary names, if any
+        ready (threading.Event): Set once everything is open
+        videoClosed (threading.Event): Set by the recorder once the videos are released
+    """
+
+    def __init__(self, tempPrefix, video):
+        self.tempPrefix = tempPrefix
+        self.prefix = None
+        self.logFile = None
+        self.video = video
+        self.sync = None
+        self.streams = None
+        self.ready = threading.Event()
+        self.videoClosed = threading.Event()
+
+    def temp(self, suffix):
+        return self.tempPrefix + suffix
+
+    def final(self, suffix):
+        return self.prefix + suffix
+
+
+class TrialController():
+    """Moves the station between trials without opening or closing files on the loop thread
+
+    Attributes:
+        state (str): One of PREPARING, READY, RUNNING, FINISHING
+        sinks (TrialSinks): Sinks of the running or finishing trial
+        next (TrialSinks): Sinks being prepared for the next trial
+        transitions (list): (name, blocked s, background s) of every finished transition
+    """
+
+    def __init__(self, recorder=None, directory='logs', fps=17.4, size=(1280, 720), onTransition=None, window=0.1):
+        """Summary
+
+        Args:
+            recorder (Recorder, optional): Records the trial videos, None when another process does
+            directory (str, optional): Where trial files are written
+            fps (float, optional): Recording frame rate
+            size (tuple, optional): Recording frame size
+            onTransition (callable, optional): onTransition(name, blocked, background), on either thread
+            window (float, optional): Durability window of the trial log, see journal.Journal
+        """
+        self.recorder = recorder
+        self.directory = directory
+        self.fps = fps
+        self.size = size
+        self.onTransition = onTransition
+        self.window = window
+        self.state = PREPARING
+        self.sinks = None
+        self.next = None
+        self.lock = threading.Lock()
+        self.transitions = []
+        self.counter = itertools.count()
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='trial')
+        self.thread.daemon = True
+        self.thread.start()
+        self._prepare_next()
+
+    def _report(self, name, blocked, background):
+        self.transitions.append((name, blocked, background))
+        if background:
+            print(f"trial: {name} took {background * 1000:0.1f}ms in the background")
+        else:
+            print(f"trial: {name} blocked the caller for {blocked * 1000:0.1f}ms")
+        if self.onTransition is not None:
+            self.onTransition(name, blocked, background)
+
+    def _prepare_next(self):
+        self.next = TrialSinks(os.path.join(self.directory, f".pending_{os.getpid()}_{next(self.counter)}"),
+                               self.recorder is not None)
+        self.jobs.put(('prepare', self.next, time.perf_counter()))
+
+    def start(self, prefix, startTime, onFrame=None):
+        """Hand the prepared sinks to a trial
+
+        Waits only if the sinks are still being opened, e.g. right after the previous trial.
+
+        Args:
+            prefix (str): Final path prefix of the trial files
+            startTime (float): perf_counter the trial is stamped with, taken before any sink work
+            onFrame (callable, optional): Recorder onFrame callback, see Recorder.start()
+
+        Returns:
+            TrialSinks: The open sinks, whose logFile the caller writes
+        """
+        if self.state == RUNNING:
+            raise RuntimeError('trial already running')
+        sinks = self.next
+        sinks.ready.wait()
+        self.sinks = sinks
+        sinks.prefix = prefix
+        # lets journal.recover() give the files their names if this run never finishes the trial
+        self.defer(sinks.logFile.meta, prefix=prefix)
+        if sinks.video:
+            # the recorder opened these in Recorder.prepare(), start() only switches it to writing them
+            self.recorder.start(sinks.temp('_raw.avi'), sinks.temp('_markup.avi'), self.fps, self.size,
+                                onFrame=onFrame)
+        with self.lock:
+            self.state = RUNNING
+        self._report('start', time.perf_counter() - startTime, 0.0)
+        return sinks
+
+    def end(self, sync=None, tlog=None, streams=None):
+        """Finish the running trial, files are closed and renamed in the background
+
+        Args:
+            sync (SyncIndexWriter, optional): Written once the videos are closed
+            tlog (TlogWriter, optional): Stopped now, it finishes on its own thread
+            streams (MultiRateLog, optional): Stopped now, its files are renamed once it has finished
+        """
+        if self.state != RUNNING:
+            return
+        began = time.perf_counter()
+        sinks = self.sinks
+        sinks.sync = sync
+        sinks.streams = streams
+        with self.lock:
+            self.state = FINISHING
+        if tlog is not None:
+            tlog.stop()
+        if streams is not None:
+            streams.stop()
+        if sinks.video:
+            self.recorder.stop(onStopped=sinks.videoClosed.set)
+        else:
+            sinks.videoClosed.set()
+        # the next trial can start as soon as its sinks are open, before this one is finalized
+        self._prepare_next()
+        self.jobs.put(('finish', sinks, began))
+        self._report('end', time.perf_counter() - began, 0.0)
+
+    def defer(self, function, *args, **kwargs):
+        """Run function on the trial thread, after the transitions queued before it"""
+        self.jobs.put(('call', (function, args, kwargs), None))
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            kind, sinks, began = job
+            if kind == 'call':
+                function, args, kwargs = sinks
+                function(*args, **kwargs)
+            elif kind == 'prepare':
+                self._prepare(sinks)
+                self._report('prepare', 0.0, time.perf_counter() - began)
+            elif kind == 'finish':
+                self._finish(sinks)
+                self._report('finish', 0.0, time.perf_counter() - began)
+                with self.lock:
+                    if self.state == FINISHING:
+                        self.state = READY if self.next.ready.is_set() else PREPARING
+
+    def _prepare(self, sinks):
+        os.makedirs(self.directory, exist_ok=True)
+        sinks.logFile = Journal(sinks.temp('.txt'), self.window)
+        if sinks.video:
+            self.recorder.prepare(sinks.temp('_raw.avi'), sinks.temp('_markup.avi'), self.fps, self.size)
+        sinks.ready.set()
+        with self.lock:
+            if self.state == PREPARING:
+                self.state = READY
+
+    def _finish(self, sinks):
+        sinks.logFile.close()
+        print(f"trial: log {sinks.logFile.summary()}")
+        os.replace(sinks.temp('.txt'), sinks.final('.txt'))
+        os.replace(sinks.temp('.txt.crc'), sinks.final('.txt.crc'))
+        if sinks.streams is not None:
+            if sinks.streams.done.wait(timeout=30):
+                for suffix in stream_suffixes(sinks.tempPrefix):
+                    os.replace(sinks.temp(suffix), sinks.final(suffix))
+            else:
+                print(f"trial: streams of {sinks.prefix} not closed, left as {sinks.tempPrefix}*")
+        if not sinks.videoClosed.wait(timeout=30):
+            print(f"trial: videos of {sinks.prefix} not closed, left as {sinks.tempPrefix}*")
+            return
+        if sinks.sync is not None:
+            sinks.sync.finish()
+        if sinks.video:
+            for suffix in ('_raw.avi', '_markup.avi'):
+                os.replace(sinks.temp(suffix), sinks.final(suffix))
+
+    def close(self):
+        """Finish pending work and remove the unused prepared sinks"""
+        self.jobs.put(None)
+        self.thread.join(timeout=35)
+        sinks = self.next
+        if self.state != RUNNING and sinks.ready.is_set():
+            sinks.logFile.close()
+            if sinks.video:
+                self.recorder.discard()
+            os.remove(sinks.temp('.txt'))
+            os.remove(sinks.temp('.txt.crc'))
+
+    def summary(self):
+        """Worst blocking time per transition, e.g. 'start 0.3ms | end 0.2ms'"""
+        worst = {}
+        for name, blocked, background in self.transitions:
+            if name in ('start', 'end'):
+                worst[name] = max(worst.get(name, 0.0), blocked)
+        return ' | '.join(f"{name} {blocked * 1000:0.1f}ms" for name, blocked in worst.items())
@@ -0,0 +1,274 @@
+'''ArUco detector parameter tuning against recorded trials
+
+The live detector ran with DetectorParameters_create() defaults, which are not made for
+turbid, low-contrast underwater footage, and nothing told us what a change would cost in
+speed. This tool replays recorded _raw.avi trials through the station's own detection
+and pose code with many parameter settings and measures, for each one:
+
+    detection rate   share of frames with at least one marker found
+    jitter           median frame-to-frame second difference of the marker position, mm:
+                     the vehicle moves smoothly, so what is left is pose noise
+    ms/frame         detection plus pose time per frame, on one core
+
+Settings are drawn at random (seeded) from the search space below, plus OpenCV's
+defaults as the baseline. The videos are split into chunks and spread over a process
+pool; each worker decodes its frames once and runs every setting on each, so decoding is
+not repeated per setting. The settings nothing beats on all three measures (the Pareto
+front) are printed, and the best of them within --max-ms, most detections first and
+least jitter next, is written to detector_profile.json, which the station loads at
+startup. The previous profile is kept as .bak.
+
+    python tuner.py logs/*_raw.avi --settings 60 --step 2
+    python tuner.py logs/*_raw.avi --max-ms 15 --results tuning.csv
+'''
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+
+import cv2
+import numpy as np
+
+from utils import ARUCO_DICT
+
+SPACE = {
+    'adaptiveThreshWinSizeMin': [3, 5, 7, 9],
+    'adaptiveThreshWinSizeMax': [13, 23, 33, 53],
+    'adaptiveThreshWinSizeStep': [2, 4, 10, 20],
+    'adaptiveThreshConstant': [3, 5, 7, 11],
+    'minMarkerPerimeterRate': [0.01, 0.02, 0.03, 0.05],
+    'maxMarkerPerimeterRate': [2.0, 4.0],
+    'polygonalApproxAccuracyRate': [0.02, 0.03, 0.05, 0.08],
+    'cornerRefinementMethod': ['CORNER_REFINE_NONE', 'CORNER_REFINE_SUBPIX', 'CORNER_REFINE_CONTOUR'],
+}
+
+
+def sample_settings(count, seed=1):
+    """count distinct settings from SPACE, OpenCV's defaults ({}) first"""
+    rng = random.Random(seed)
+    settings = [{}]
+    seen = set()
+    combinations = np.prod([len(values) for values in SPACE.values()])
+    while len(settings) < count + 1 and len(seen) < combinations:
+        setting = {name: rng.choice(values) for name, values in SPACE.items()}
+        key = tuple(setting.values())
+        if key in seen:
+            continue
+        seen.add(key)
+        if setting['adaptiveThreshWinSizeMin'] > setting['adaptiveThreshWinSizeMax']:
+            continue
+        settings.append(setting)
+    return settings
+
+
+def tuneChunk(job):
+    """Pool worker: run every setting on frames [start, stop) of a video
+
+    Args:
+        job (tuple): (filename, start, stop, step, settings, k, d, dictionary name, tagSize)
+
+    Returns:
+        list: Per setting (frames, frames with a marker, markers, s detecting, [(frame index, tvec)])
+    """
+    from calibration import CalibrationContext
+    from vision import detect_markers, make_detector_parameters
+
+    filename, start, stop, step, settings, k, d, dictionaryName, tagSize = job
+    # one process per core already, OpenCV's own threads would only compete
+    cv2.setNumThreads(1)
+    parameters = [make_detector_parameters(setting) for setting in settings]
+    results = [[0, 0, 0, 0.0, []] for _ in settings]
+    context = None
+    capture = cv2.VideoCapture(filename)
+    capture.set(cv2.CAP_PROP_POS_FRAMES, start)
+    for index in range(start, stop):
+        # grab() without retrieve() skips decoding the frames step leaves out
+        if not capture.grab():
+            break
+        if (index - start) % step:
+            continue
+        ok, frame = capture.retrieve()
+        if not ok:
+            break
+        if context is None:
+            context = CalibrationContext(k, d, (frame.shape[1], frame.shape[0]), ARUCO_DICT[dictionaryName], tagSize)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        for result, setting in zip(results, parameters):
+            context.parameters = setting
+            started = time.perf_counter()
+            corners, ids, rvecs, tvecs = detect_markers(gray, None, None, None, tagSize, calibration=context)
+            result[3] += time.perf_counter() - started
+            result[0] += 1
+            if len(tvecs) > 0:
+                result[1] += 1
+                result[2] += len(tvecs)
+                # the station follows the last marker found
+                result[4].append((index, tuple(float(v) for v in np.ravel(tvecs[-1])[:3])))
+    capture.release()
+    return results
+
+
+def second_differences(poses, step):
+    """|p[i+1] - 2 p[i] + p[i-1]| over runs of consecutive sampled frames, mm"""
+    poses = sorted(poses)
+    values = []
+    for (i0, p0), (i1, p1), (i2, p2) in zip(poses, poses[1:], poses[2:]):
+        if i1 - i0 == step and i2 - i1 == step:
+            values.append(float(np.linalg.norm(np.subtract(p2, p1) - np.subtract(p1, p0))) * 1000)
+    return values
+
+
+def evaluate(videos, settings, k, d, dictionaryName='DICT_4X4_100', tagSize=1.12, workers=None, step=1):
+    """Measure every setting on every video with a process pool
+
+    Returns:
+        tuple: (list of metric dicts in settings order, stats dict)
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = []
+    for filename in videos:
+        capture = cv2.VideoCapture(filename)
+        if not capture.isOpened():
+            raise IOError(f'cannot open {filename}')
+        frameCount = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        capture.release()
+        # a few chunks per worker so one slow chunk does not hold the rest up, long enough for runs of poses
+        chunks = max(1, min(workers * 4, frameCount // max(step * 50, 1)))
+        bounds = np.linspace(0, frameCount, chunks + 1).astype(int)
+        jobs.extend((filename, int(start), int(stop), step, settings, k, d, dictionaryName, tagSize)
+                    for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start)
+
+    totals = [[0, 0, 0, 0.0, []] for _ in settings]
+    started = time.perf_counter()
+    # spawn like the rest of the station, forking a process with OpenCV state is not safe everywhere
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        for results in pool.imap_unordered(tuneChunk, jobs):
+            for total, result in zip(totals, results):
+                for i in range(4):
+                    total[i] += result[i]
+                # runs never span chunks, so the chunk's frame indices can be compared within it only
+                total[4].extend(second_differences(result[4], step))
+    elapsed = time.perf_counter() - started
+
+    metrics = []
+    for setting, (frames, detected, markers, detectTime, differences) in zip(settings, totals):
+        metrics.append({
+            'settings': setting,
+            'detectionRate': detected / max(frames, 1),
+            'markersPerFrame': markers / max(frames, 1),
+            'jitterMm': statistics.median(differences) if differences else float('nan'),
+            'msPerFrame': detectTime / max(frames, 1) * 1000,
+            'frames': frames,
+        })
+    frames = totals[0][0] if totals else 0
+    return metrics, {'jobs': len(jobs), 'frames': frames, 'workers': workers, 'elapsed': elapsed,
+                     'detectTime': sum(total[3] for total in totals)}
+
+
+def pareto_front(metrics):
+    """Metrics no other setting beats on detection rate, jitter and time at once"""
+    def key(m):
+        # nan jitter (too few runs to tell) counts as worst
+        j = m['jitterMm'] if m['jitterMm'] == m['jitterMm'] else float('inf')
+        return (-m['detectionRate'], j, m['msPerFrame'])
+
+    front = []
+    for m in metrics:
+        a = key(m)
+        dominated = False
+        for other in metrics:
+            b = key(other)
+            if other is not m and all(y <= x for x, y in zip(a, b)) and b != a:
+                dominated = True
+                break
+        if not dominated:
+            front.append(m)
+    return sorted(front, key=key)
+
+
+def choose(front, maxMs=None):
+    """Most detections within the time budget, least jitter among equals"""
+    within = [m for m in front if maxMs is None or m['msPerFrame'] <= maxMs]
+    if not within:
+        return None
+    return min(within, key=lambda m: (-round(m['detectionRate'], 3),
+                                      m['jitterMm'] if m['jitterMm'] == m['jitterMm'] else float('inf')))
+
+
+def describe(setting):
+    if not setting:
+        return 'OpenCV defaults'
+    short = {'adaptiveThreshWinSizeMin': 'win', 'adaptiveThreshWinSizeMax': '-', 'adaptiveThreshWinSizeStep': '/',
+             'adaptiveThreshConstant': ' C', 'minMarkerPerimeterRate': ' perim', 'maxMarkerPerimeterRate': '-',
+             'polygonalApproxAccuracyRate': ' poly', 'cornerRefinementMethod': ' '}
+    return ''.join(f"{short[name]}{str(value).replace('CORNER_REFINE_', '').lower()}" for name, value in setting.items())
+
+
+def write_profile(chosen, baseline, videos, filename='detector_profile.json'):
+    """Save the chosen setting for the live detector, keeping the old profile as .bak"""
+    if os.path.exists(filename):
+        os.replace(filename, filename + '.bak')
+    metrics = {name: chosen[name] for name in ('detectionRate', 'jitterMm', 'msPerFrame')}
+    with open(filename, 'w') as profileFile:
+        json.dump({'parameters': chosen['settings'], 'metrics': metrics,
+                   'baseline': {name: baseline[name] for name in metrics},
+                   'videos': [os.path.basename(video) for video in videos],
+                   'created': time.ctime()}, profileFile, indent=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tune the ArUco detector parameters on recorded trials')
+    parser.add_argument('videos', nargs='+', help='recorded _raw.avi trials')
+    parser.add_argument('--settings', type=int, default=48, help='parameter settings to try besides the defaults')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--step', type=int, default=1, help='only look at every step-th frame')
+    parser.add_argument('--workers', type=int, default=None, help='processes, default one per core')
+    parser.add_argument('--dictionary', default='DICT_4X4_100', choices=sorted(ARUCO_DICT))
+    parser.add_argument('--tag-size', type=float, default=1.12, help='marker size in m, for the pose')
+    parser.add_argument('--max-ms', type=float, default=None, help='time budget per frame for the chosen setting')
+    parser.add_argument('--results', default=None, help='write every setting and its measures to this CSV')
+    parser.add_argument('--profile', default='detector_profile.json', help='profile the station loads')
+    parser.add_argument('--no-write', action='store_true', help='only report, leave the profile alone')
+    args = parser.parse_args()
+
+    k = np.load("calibration_matrix.npy")
+    d = np.load("distortion_coefficients.npy")
+    settings = sample_settings(args.settings, args.seed)
+    metrics, stats = evaluate(args.videos, settings, k, d, args.dictionary, args.tag_size, args.workers, args.step)
+    print(f"{len(settings)} settings x {stats['frames']} frames from {len(args.videos)} videos in {stats['jobs']} chunks, "
+          f"{stats['elapsed']:0.1f}s ({stats['workers']} workers, "
+          f"{stats['detectTime']:0.1f}s of detection)")
+
+    if args.results:
+        with open(args.results, 'w', newline='') as resultsFile:
+            writer = csv.writer(resultsFile)
+            writer.writerow(['detectionRate', 'markersPerFrame', 'jitterMm', 'msPerFrame'] + list(SPACE))
+            for m in metrics:
+                writer.writerow([round(m['detectionRate'], 4), round(m['markersPerFrame'], 3), round(m['jitterMm'], 2),
+                                 round(m['msPerFrame'], 2)] + [m['settings'].get(name, '') for name in SPACE])
+
+    baseline = metrics[0]
+    front = pareto_front(metrics)
+    print(f"{'detected':>9} {'jitter mm':>10} {'ms/frame':>9}  setting")
+    for m in [baseline] + [m for m in front if m is not baseline]:
+        print(f"{m['detectionRate'] * 100:>8.1f}% {m['jitterMm']:>10.2f} {m['msPerFrame']:>9.2f}  {describe(m['settings'])}"
+              + ('' if any(m is f for f in front) else '  (dominated)'))
+
+    chosen = choose(front, args.max_ms)
+    if chosen is None:
+        raise SystemExit(f'no setting within {args.max_ms}ms/frame, raise --max-ms')
+    print(f"Chosen: {describe(chosen['settings'])}, detection {baseline['detectionRate'] * 100:0.1f}% -> "
+          f"{chosen['detectionRate'] * 100:0.1f}%, jitter {baseline['jitterMm']:0.2f} -> {chosen['jitterMm']:0.2f}mm, "
+          f"{baseline['msPerFrame']:0.2f} -> {chosen['msPerFrame']:0.2f}ms/frame")
+    if not args.no_write:
+        write_profile(chosen, baseline, args.videos, args.profile)
+        print(f"Wrote {args.profile}, the station loads it at startup")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+'''Change-driven, rate-limited GUI updates
+
+Tk redraws are the most expensive thing the GUI thread does after the video
+frames, so telemetry widgets are only pushed when their formatted text changes and
+at most at the binder's refresh rate, and canvas figures are moved or recoloured in
+place rather than deleted and redrawn.
+'''
+
+import time
+
+
+class TextBinder():
+    """Batches text element updates for one window
+
+    Values are recorded every loop with set() and pushed by flush(), which formats
+    them and only calls Element.update() for text that differs from what is shown.
+
+    Attributes:
+        window (sg.Window): Window owning the elements
+        interval (float): Minimum seconds between pushes
+        pushed (int): Element updates actually made, for profiling
+        skipped (int): Updates avoided because the text had not changed
+    """
+
+    def __init__(self, window, rate=10):
+        """Summary
+
+        Args:
+            window (sg.Window): Window owning the elements
+            rate (float, optional): Refresh rate in Hz, 0 pushes every flush()
+        """
+        self.window = window
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self.values = {}
+        self.shown = {}
+        self.lastFlush = 0
+        self.pushed = 0
+        self.skipped = 0
+
+    def set(self, key, value, fmt='{:0.2f}'):
+        """Record the latest value of an element, nothing is drawn until flush()"""
+        self.values[key] = (value, fmt)
+
+    def flush(self, force=False):
+        """Push changed text if the refresh interval has elapsed
+
+        Args:
+            force (bool, optional): Push regardless of the refresh interval
+
+        Returns:
+            int: Number of elements updated
+        """
+        now = time.perf_counter()
+        if not force and now - self.lastFlush < self.interval:
+            return 0
+        self.lastFlush = now
+
+        count = 0
+        for key, (value, fmt) in self.values.items():
+            text = fmt.format(value)
+            if self.shown.get(key) == text:
+                self.skipped += 1
+                continue
+            self.window[key].update(text)
+            self.shown[key] = text
+            count += 1
+        self.values.clear()
+        self.pushed += count
+        return count
+
+
+def move_circle(graph, figure, center, radius):
+    """Move/resize an existing circle figure instead of recreating it
+
+    Args:
+        graph (sg.Graph): Graph element the figure belongs to
+        figure (int): Figure id from draw_circle()
+        center (tuple): Centre in graph coordinates
+        radius (float): Radius in graph units
+    """
+    # same conversion as sg.Graph.draw_circle
+    x, y = graph._convert_xy_to_canvas_xy(center[0], center[1])
+    edge = graph._convert_xy_to_canvas_xy(center[0] + radius, center[1])
+    r = edge[0] - x
+    graph.TKCanvas.coords(figure, x - r, y - r, x + r, y + r)
+
+
+def recolour(graph, figure, fill, outline=None):
+    """Change the colour of an existing figure"""
+    graph.TKCanvas.itemconfig(figure, fill=fill, outline=outline if outline is not None else fill)
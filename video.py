@@ -0,0 +1,322 @@
+'''BlueROV2 camera capture over GStreamer'''
+
+import threading
+import time
+
+import numpy as np
+
+# GStreamer takes a noticeable time to import, it is loaded by the first Video()
+Gst = None
+
+
+def load_gst():
+    """Import and initialise GStreamer on first use
+
+    Returns:
+        module: gi.repository.Gst
+    """
+    global Gst
+    if Gst is None:
+        import gi
+        gi.require_version('Gst', '1.0')
+        from gi.repository import Gst as _Gst
+        _Gst.init(None)
+        Gst = _Gst
+    return Gst
+
+
+# Receive pipeline variants, each is (source, codec, decode, sink) as used by Video.run()
+# default      the original pipeline
+# low-latency  single conversion, one buffer at the sink, single threaded decoding (no frame threading delay)
+# robust       jitter buffer and a large socket buffer for lossy or bursty links, at the cost of its latency
+# low-cpu      drops frames above 15 fps before conversion and converts on one thread
+PROFILES = {
+    'default': (
+        'udpsrc port={port}',
+        '! application/x-rtp, payload=96 ! rtph264depay ! h264parse ! avdec_h264',
+        '! decodebin ! videoconvert ! video/x-raw,format=(string)BGR ! videoconvert',
+        '! appsink name=sink emit-signals=true sync=false max-buffers=2 drop=true'),
+    'low-latency': (
+        'udpsrc port={port} buffer-size=1048576',
+        '! application/x-rtp, payload=96 ! rtph264depay ! h264parse ! avdec_h264 max-threads=1',
+        '! videoconvert ! video/x-raw,format=(string)BGR',
+        '! appsink name=sink emit-signals=true sync=false max-buffers=1 drop=true'),
+    'robust': (
+        'udpsrc port={port} buffer-size=4194304',
+        '! application/x-rtp, media=video, clock-rate=90000, encoding-name=H264, payload=96'
+        ' ! rtpjitterbuffer latency=150 drop-on-latency=true ! rtph264depay ! h264parse ! avdec_h264',
+        '! videoconvert ! video/x-raw,format=(string)BGR',
+        '! appsink name=sink emit-signals=true sync=false max-buffers=2 drop=true'),
+    'low-cpu': (
+        'udpsrc port={port} buffer-size=1048576',
+        '! application/x-rtp, payload=96 ! rtph264depay ! h264parse ! avdec_h264 max-threads=2',
+        '! videorate drop-only=true max-rate=15 ! videoconvert n-threads=1 ! video/x-raw,format=(string)BGR',
+        '! appsink name=sink emit-signals=true sync=false max-buffers=1 drop=true'),
+}
+
+
+class Video():
+    """BlueRov video capture class constructor
+
+    Attributes:
+        port (int): Video UDP port
+        video_codec (string): Source h264 parser
+        video_decode (string): Transform YUV (12bits) to BGR (24bits)
+        video_pipe (object): GStreamer top-level pipeline
+        video_sink (object): Gstreamer sink element
+        video_sink_conf (string): Sink configuration
+        video_source (string): Udp source ip and port
+        latest_frame (np.ndarray): Latest retrieved video frame
+        name (string): Stream name, for statistics when running several streams
+        frame_count (int): Frames decoded so far
+        last_frame_time (float): perf_counter of the latest decoded frame
+        profile (string): Pipeline profile, a key of PROFILES
+        latest_info (dict): Timing of latest_frame: pts and pipeline (receive to appsink) in s,
+            sinkTime (perf_counter when it reached the appsink)
+        gray (bool): A GRAY8 branch for detection runs alongside the BGR one
+        gray_width (int): Width of the gray frames, None for full resolution
+        video_gray_conf (string): Gray branch configuration
+    """
+
+    def __init__(self, port=5600, name=None, profile='default', gray=False, gray_width=None):
+        """Summary
+
+        Args:
+            port (int, optional): UDP port
+            name (str, optional): Stream name, defaults to 'video:<port>'
+            profile (str, optional): Pipeline profile, a key of PROFILES
+            gray (bool, optional): Also produce GRAY8 frames (see gray_frame())
+            gray_width (int, optional): Downscale the gray frames to this width, aspect ratio is kept
+        """
+
+        load_gst()
+
+        self.port = port
+        self.name = name or 'video:{}'.format(port)
+        self.profile = profile
+        self.latest_frame = self._new_frame = None
+        self.latest_info = self._new_info = None
+        self.frame_count = 0
+        self.last_frame_time = None
+
+        source, codec, decode, sink = PROFILES[profile]
+        # [Software component diagram](https://www.ardusub.com/software/components.html)
+        # UDP video stream (:5600)
+        self.video_source = source.format(port=self.port)
+        # [Rasp raw image](http://picamera.readthedocs.io/en/release-0.7/recipes2.html#raw-image-capture-yuv-format)
+        # Cam -> CSI-2 -> H264 Raw (YUV 4-4-4 (12bits) I420)
+        self.video_codec = codec
+        # Python don't have nibble, convert YUV nibbles (4-4-4) to OpenCV standard BGR bytes (8-8-8)
+        self.video_decode = decode
+        # Create a sink to get data
+        self.video_sink_conf = sink
+        # The decoder outputs I420, whose Y plane is the grayscale image, so converting
+        # to GRAY8 is a plane copy rather than a colour conversion
+        self.gray = gray
+        self.gray_width = gray_width
+        self.video_gray_conf = \
+            '! queue leaky=downstream max-size-buffers=1 ! videoconvert ! video/x-raw,format=(string)GRAY8'
+        if gray_width:
+            self.video_gray_conf += ' ! videoscale ! video/x-raw,width={}'.format(gray_width)
+        self.video_gray_conf += ' ! appsink name=graysink emit-signals=true sync=false max-buffers=1 drop=true'
+        self._grays = {}
+        self._gray_lock = threading.Lock()
+
+        self.video_pipe = None
+        self.video_sink = None
+        self.gray_sink = None
+
+        self.run()
+
+    def start_gst(self, config=None):
+        """ Start gstreamer pipeline and sink
+        Pipeline description list e.g:
+            [
+                'videotestsrc ! decodebin', \
+                '! videoconvert ! video/x-raw,format=(string)BGR ! videoconvert',
+                '! appsink name=sink'
+            ]
+
+        The appsink must be named 'sink', element auto-names (appsink0, appsink1, ...)
+        are process wide so they differ between Video instances.
+
+        Args:
+            config (list, optional): Gstreamer pileline description list
+        """
+
+        if not config:
+            config = \
+                [
+                    'videotestsrc ! decodebin',
+                    '! videoconvert ! video/x-raw,format=(string)BGR ! videoconvert',
+                    '! appsink name=sink'
+                ]
+
+        command = ' '.join(config)
+        self.video_pipe = Gst.parse_launch(command)
+        self.video_pipe.set_state(Gst.State.PLAYING)
+        self.video_sink = self.video_pipe.get_by_name('sink')
+
+    @staticmethod
+    def gst_to_opencv(sample):
+        """Transform byte array into np array
+
+        Args:
+            sample (TYPE): Description
+
+        Returns:
+            TYPE: Description
+        """
+        buf = sample.get_buffer()
+        caps_structure = sample.get_caps().get_structure(0)
+        height = caps_structure.get_value('height')
+        width = caps_structure.get_value('width')
+        if caps_structure.get_value('format') == 'GRAY8':
+            # rows of single byte formats are padded to 4 bytes
+            stride = buf.get_size() // height
+            array = np.ndarray((height, stride), buffer=buf.extract_dup(0, buf.get_size()),
+                               dtype=np.uint8)[:, :width]
+            return array
+        array = np.ndarray(
+            (
+                height,
+                width,
+                3
+            ),
+            buffer=buf.extract_dup(0, buf.get_size()), dtype=np.uint8)
+        return array
+
+    def frame(self):
+        """ Get Frame
+
+        Returns:
+            np.ndarray: latest retrieved image frame
+        """
+        if self.frame_available:
+            self.latest_frame = self._new_frame
+            self.latest_info = self._new_info
+            # reset to indicate latest frame has been 'consumed'
+            self._new_frame = None
+        return self.latest_frame
+
+    def frame_available(self):
+        """Check if a new frame is available
+
+        Returns:
+            bool: true if a new frame is available
+        """
+        return self._new_frame is not None
+
+    def wait_first_frame(self, timeout):
+        """Block until the first frame has been decoded
+
+        Args:
+            timeout (float): Seconds to wait
+
+        Raises:
+            TimeoutError: no frame within timeout
+        """
+        deadline = time.perf_counter() + timeout
+        while self._new_frame is None and self.latest_frame is None:
+            if time.perf_counter() > deadline:
+                raise TimeoutError(f'no video on port {self.port} after {timeout}s')
+            time.sleep(0.01)
+        return self
+
+    def run(self):
+        """ Get frame to update _new_frame
+        """
+
+        if not self.gray:
+            self.start_gst(
+                [
+                    self.video_source,
+                    self.video_codec,
+                    self.video_decode,
+                    self.video_sink_conf
+                ])
+        else:
+            # split after the decoder, BGR for display/recording and GRAY8 for detection
+            self.start_gst(
+                [
+                    self.video_source,
+                    self.video_codec,
+                    '! tee name=t t. ! queue',
+                    self.video_decode,
+                    self.video_sink_conf,
+                    't.',
+                    self.video_gray_conf
+                ])
+            self.gray_sink = self.video_pipe.get_by_name('graysink')
+            self.gray_sink.connect('new-sample', self.gray_callback)
+
+        self.video_sink.connect('new-sample', self.callback)
+
+    def gray_frame(self):
+        """Gray frame decoded alongside latest_frame
+
+        Both branches carry the decoder's timestamps, so the gray frame is looked up by the
+        pts of the latest BGR frame.
+
+        Returns:
+            np.ndarray: Gray (possibly downscaled) frame, None if there is no gray branch or
+                its frame did not arrive (yet) or was dropped
+        """
+        if not self.gray or self.latest_info is None or self.latest_info['pts'] is None:
+            return None
+        with self._gray_lock:
+            return self._grays.get(self.latest_info['pts'])
+
+    def stop(self):
+        """Stop the pipeline and release the UDP port"""
+        if self.video_pipe is not None:
+            self.video_pipe.set_state(Gst.State.NULL)
+
+    def sample_timing(self, sample):
+        """Pipeline timestamps of a sample
+
+        udpsrc stamps buffers with the pipeline running time at which they were received,
+        so running time now minus the pts is the time spent in depayloading, decoding and
+        conversion (plus any jitter buffer).
+
+        Returns:
+            dict: pts and pipeline in s (None when the pipeline has no clock yet), sinkTime (perf_counter)
+        """
+        info = {'pts': None, 'pipeline': None, 'sinkTime': time.perf_counter()}
+        pts = sample.get_buffer().pts
+        clock = self.video_pipe.get_clock()
+        if clock is not None and pts != Gst.CLOCK_TIME_NONE:
+            running = clock.get_time() - self.video_pipe.get_base_time()
+            info['pts'] = pts / Gst.SECOND
+            info['pipeline'] = max(0, running - pts) / Gst.SECOND
+        return info
+
+    def latency(self, now=None):
+        """Receive to now latency of latest_frame in s, e.g. called when it is displayed"""
+        info = self.latest_info
+        if info is None or info['pipeline'] is None:
+            return float('nan')
+        now = time.perf_counter() if now is None else now
+        return info['pipeline'] + now - info['sinkTime']
+
+    def callback(self, sink):
+        sample = sink.emit('pull-sample')
+        self._new_info = self.sample_timing(sample)
+        self._new_frame = self.gst_to_opencv(sample)
+        self.frame_count += 1
+        self.last_frame_time = self._new_info['sinkTime']
+
+        return Gst.FlowReturn.OK
+
+    def gray_callback(self, sink):
+        sample = sink.emit('pull-sample')
+        pts = sample.get_buffer().pts
+        if pts != Gst.CLOCK_TIME_NONE:
+            gray = self.gst_to_opencv(sample)
+            with self._gray_lock:
+                self._grays[pts / Gst.SECOND] = gray
+                # a few frames are enough to pair with the BGR branch
+                while len(self._grays) > 4:
+                    del self._grays[next(iter(self._grays))]
+
+        return Gst.FlowReturn.OK
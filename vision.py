@@ -0,0 +1,143 @@
+'''ArUco tag detection and pose estimation
+
+Detector parameters come from detector_profile.json when it exists (written by
+tuner.py from recorded trials), OpenCV's defaults otherwise.
+'''
+
+import json
+import os
+
+import cv2
+
+DETECTOR_PROFILE = 'detector_profile.json'
+_detectorParameters = {}
+
+
+def make_detector_parameters(settings):
+    """DetectorParameters with settings applied, cornerRefinementMethod may be given by name"""
+    parameters = cv2.aruco.DetectorParameters_create()
+    for name, value in settings.items():
+        if name == 'cornerRefinementMethod' and isinstance(value, str):
+            value = getattr(cv2.aruco, value)
+        setattr(parameters, name, value)
+    return parameters
+
+
+def detector_parameters(filename=DETECTOR_PROFILE):
+    """The station's detector parameters, loaded from the tuned profile once per process"""
+    parameters = _detectorParameters.get(filename)
+    if parameters is None:
+        settings = {}
+        if os.path.exists(filename):
+            with open(filename) as profileFile:
+                profile = json.load(profileFile)
+            settings = profile['parameters']
+            metrics = profile.get('metrics', {})
+            print(f"detector: {filename}, tuned for {metrics.get('detectionRate', float('nan')) * 100:0.1f}% "
+                  f"detection at {metrics.get('msPerFrame', float('nan')):0.1f}ms/frame")
+        parameters = _detectorParameters[filename] = make_detector_parameters(settings)
+    return parameters
+
+
+def detect_markers(frame, aruco_dict_type, matrix_coefficients, distortion_coefficients, tagSize, scale=1.0, roi=None,
+                   frameScale=1.0, calibration=None):
+
+    '''
+    Detection half of pose_esitmation, nothing is drawn so it can run on any worker
+
+    frame - BGR or already grayscale frame
+    (other arguments as pose_esitmation)
+    scale - search a resized copy of the frame (e.g. 0.5), corners are returned in full frame pixels
+    roi - (x, y, w, h) only search this part of the frame, corners are returned in full frame pixels
+    frameScale - frame is already the full frame downscaled by this (e.g. a reduced gray branch),
+                 scale and roi stay relative to the full frame and it is never upscaled
+    calibration - CalibrationContext, reuses its detector objects, camera matrix and marker points
+                  instead of rebuilding them (aruco_dict_type and the coefficients are then ignored)
+
+    return:-
+    corners - detected marker corners
+    ids - detected marker ids (None if nothing was found)
+    rvecs, tvecs - per marker pose as returned by estimatePoseSingleMarkers (1x1x3 each)
+    '''
+
+    x0 = y0 = 0
+    if roi is not None:
+        x, y, w, h = roi
+        x, y = int(x * frameScale), int(y * frameScale)
+        frame = frame[y:y + int(h * frameScale), x:x + int(w * frameScale)]
+        x0, y0 = x / frameScale, y / frameScale
+    gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    resize = min(1.0, scale / frameScale)
+    if resize != 1.0:
+        gray = cv2.resize(gray, None, fx=resize, fy=resize, interpolation=cv2.INTER_AREA)
+    scale = frameScale * resize
+    if calibration is not None:
+        aruco_dict, parameters = calibration.dictionary, calibration.parameters
+        matrix_coefficients, distortion_coefficients = calibration.k, calibration.d
+        calibration.frames += 1
+    else:
+        aruco_dict = cv2.aruco.Dictionary_get(aruco_dict_type)
+        parameters = detector_parameters()
+
+
+    corners, ids, rejected_img_points = cv2.aruco.detectMarkers(gray, aruco_dict,parameters=parameters,
+        cameraMatrix=matrix_coefficients,
+        distCoeff=distortion_coefficients)
+
+    if len(corners) > 0 and (scale != 1.0 or x0 or y0):
+        # back to full frame pixels, the camera matrix is for the full frame
+        corners = tuple(c / scale + (x0, y0) for c in corners)
+
+    rvecs = []
+    tvecs = []
+    if len(corners) > 0:
+        for i in range(0, len(ids)):
+            if calibration is not None:
+                rvec, tvec = calibration.pose(corners[i])
+                rvecs.append(rvec)
+                tvecs.append(tvec)
+                continue
+            # Estimate pose of each marker and return the values rvec and tvec---(different from those of camera coefficients)
+            rvec, tvec, markerPoints = cv2.aruco.estimatePoseSingleMarkers(corners[i], tagSize, matrix_coefficients,
+                                                                       distortion_coefficients)
+            rvecs.append(rvec)
+            tvecs.append(tvec)
+    return corners, ids, rvecs, tvecs
+
+
+def draw_markers(frame, corners, rvecs, tvecs, matrix_coefficients, distortion_coefficients):
+    '''Draw marker outlines and axes from detect_markers results onto frame'''
+    if len(corners) > 0:
+        # Draw a square around the markers
+        cv2.aruco.drawDetectedMarkers(frame, corners)
+    for rvec, tvec in zip(rvecs, tvecs):
+        # Draw Axis
+        cv2.aruco.drawAxis(frame, matrix_coefficients, distortion_coefficients, rvec, tvec, 0.1)
+    return frame
+
+
+def pose_esitmation(frame, aruco_dict_type, matrix_coefficients, distortion_coefficients, tagSize):
+
+    '''
+    frame - Frame from the video stream
+    aruco_dict_type - self-explanatory, the aruco dictionary containing the tag
+    matrix_coefficients - Intrinsic matrix of the calibrated camera
+    distortion_coefficients - Distortion coefficients associated with your camera
+    tagSize - the size of the tag (black area) in m = 1.2
+
+    return:-
+    frame - The frame with the axis drawn on it
+    rvec - rotation vector (opencv condensed version)
+    tvec - translation vector, translation in x,y,z in m
+    '''
+
+    corners, ids, rvecs, tvecs = detect_markers(frame, aruco_dict_type, matrix_coefficients,
+                                                distortion_coefficients, tagSize)
+    #rmat = cv2.Rodrigues(rvec)[0]
+    #cv2.putText(frame,f't:{-1*tvec}, r:{rvec}', (25, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 255), 2, 3)
+    draw_markers(frame, corners, rvecs, tvecs, matrix_coefficients, distortion_coefficients)
+
+    if len(tvecs) > 0:
+        # pose of the last marker found
+        return frame,tvecs[-1][0][0],rvecs[-1][0][0]
+    return frame,[0,0,0],[0,0,0]
@@ -0,0 +1,118 @@
+'''Safety watchdog for stale inputs
+
+Runs on its own thread so it keeps working when the station loop itself is stuck (for
+instance in a blocking MAVLink wait). Each watched input is a function returning the
+perf_counter time of its latest update (None while the input has never been seen, so
+peers that are not connected yet do not trip). When an input is older than its deadline
+the trip callback runs once; when it is fresh again the clear callback runs.
+
+Reaction latency is measured from the moment the deadline passed to the moment the trip
+callback returned, so it includes the polling delay and the reaction itself (e.g.
+sending neutral RC overrides).
+'''
+
+import threading
+import time
+
+
+class Watchdog():
+    """Deadline monitor for station inputs
+
+    Attributes:
+        inputs (dict): Name -> (last update function, deadline in s)
+        period (float): Polling period, the worst case detection delay
+        tripped (dict): Name -> age at the moment it tripped, for inputs currently stale, only
+            touched by the watchdog thread
+        staleInputs (tuple): Names of the inputs currently stale, replaced (never changed) on
+            every trip and clear so other threads can read it without a lock
+        trips (dict): Name -> number of trips
+        reaction (dict): Name -> list of measured reaction latencies in s
+    """
+
+    def __init__(self, onTrip, onClear, period=0.02):
+        """Summary
+
+        Args:
+            onTrip (callable): onTrip(name, age) when an input passes its deadline
+            onClear (callable): onClear(name, age) when a tripped input is fresh again
+            period (float, optional): Polling period in s
+        """
+        self.onTrip = onTrip
+        self.onClear = onClear
+        self.period = period
+        self.inputs = {}
+        self.tripped = {}
+        self.staleInputs = ()
+        self.trips = {}
+        self.reaction = {}
+        self.running = False
+        self.thread = None
+
+    def watch(self, name, lastUpdate, deadline):
+        """Watch an input
+
+        Args:
+            name (str): Input name, e.g. 'haptics'
+            lastUpdate (callable): Returns the perf_counter time of the latest update or None
+            deadline (float): Longest acceptable age in s, 0 or less to not watch it
+        """
+        if deadline > 0:
+            self.inputs[name] = (lastUpdate, deadline)
+            self.trips.setdefault(name, 0)
+            self.reaction.setdefault(name, [])
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='watchdog')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        while self.running:
+            self.check()
+            time.sleep(self.period)
+
+    def check(self):
+        for name, (lastUpdate, deadline) in list(self.inputs.items()):
+            last = lastUpdate()
+            if last is None:
+                continue
+            now = time.perf_counter()
+            age = now - last
+            if age > deadline and name not in self.tripped:
+                self.tripped[name] = age
+                self.staleInputs = tuple(self.tripped)
+                self.trips[name] += 1
+                try:
+                    self.onTrip(name, age)
+                except Exception as e:
+                    print(f"watchdog: reaction to {name} failed: {type(e).__name__}: {e}")
+                latency = time.perf_counter() - (last + deadline)
+                self.reaction[name].append(latency)
+                print(f"watchdog: {name} stale for {age:0.2f}s, reacted {latency * 1000:0.1f}ms after its deadline")
+            elif age <= deadline and name in self.tripped:
+                del self.tripped[name]
+                self.staleInputs = tuple(self.tripped)
+                try:
+                    self.onClear(name, age)
+                except Exception as e:
+                    print(f"watchdog: clearing {name} failed: {type(e).__name__}: {e}")
+
+    def stale(self, name):
+        return name in self.staleInputs
+
+    def summary(self):
+        """Trips and reaction latency per input, e.g. 'haptics 2 trips, reaction mean 11.2ms max 19.8ms'"""
+        parts = []
+        for name, latencies in self.reaction.items():
+            if latencies:
+                parts.append(f"{name} {self.trips[name]} trips, reaction mean "
+                             f"{sum(latencies) / len(latencies) * 1000:0.1f}ms max {max(latencies) * 1000:0.1f}ms")
+            else:
+                parts.append(f"{name} 0 trips")
+        return ' | '.join(parts)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)